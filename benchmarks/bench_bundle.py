@@ -0,0 +1,62 @@
+"""
+Benchmark importing an exported environment bundle against creating the same
+environment locally (solve, fetch and link).
+
+The environment is built and exported from one env_dir, and then created
+and imported into a second env_dir (with a different prefix length, so that
+the import includes relocation).
+
+    python benchmarks/bench_bundle.py python=3.6 numpy
+
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import conda_execute.config
+from conda_execute.tmpenv import create_env, export_bundle, import_bundle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('specs', nargs='+', help='The package specs of the environment.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='conda-execute-bench_')
+    try:
+        conda_execute.config.env_dir = os.path.join(tmp_dir, 'exporter')
+        for extension in ['.tar.gz', '.tar.zst']:
+            bundle = os.path.join(tmp_dir, 'bundle' + extension)
+            start = time.time()
+            export_bundle(args.specs, bundle)
+            print('export ({}): {:7.2f}s, {:.1f}MB'.format(
+                extension, time.time() - start, os.path.getsize(bundle) / 1024. ** 2))
+
+        conda_execute.config.env_dir = os.path.join(tmp_dir, 'the_importing_node')
+        creation, imports = [], dict((extension, []) for extension in ['.tar.gz', '.tar.zst'])
+        for _ in range(args.repeat):
+            start = time.time()
+            env = create_env(args.specs)
+            creation.append(time.time() - start)
+            shutil.rmtree(env)
+            for extension, timings in imports.items():
+                start = time.time()
+                env = import_bundle(os.path.join(tmp_dir, 'bundle' + extension))
+                timings.append(time.time() - start)
+                shutil.rmtree(env)
+
+        print('local creation:    {:7.2f}s'.format(min(creation)))
+        for extension, timings in sorted(imports.items()):
+            print('import ({}): {:7.2f}s  speedup: {:5.1f}x'.format(
+                extension, min(timings), min(creation) / min(timings)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
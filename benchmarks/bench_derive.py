@@ -0,0 +1,61 @@
+"""
+Benchmark deriving a temporary environment from its nearest neighbour against
+creating it from scratch.
+
+A base environment is created from the base specification, and then for each
+set of leaf packages an environment of ``base + leaves`` is created twice: once
+with derivation disabled and once with it enabled. The package cache is shared,
+so both timings exclude downloading.
+
+    python benchmarks/bench_derive.py --base python=3.6 --base numpy \\
+        --leaves six --leaves six,pytz
+
+"""
+from __future__ import print_function
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import conda_execute.config
+from conda_execute.tmpenv import create_env
+
+
+def timed_create(spec, derive_max_distance):
+    conda_execute.config.derive_max_distance = derive_max_distance
+    start = time.time()
+    env = create_env(spec)
+    duration = time.time() - start
+    shutil.rmtree(env)
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--base', action='append', default=[],
+                        help='A package spec of the base environment.')
+    parser.add_argument('--leaves', action='append', default=[],
+                        help='A comma separated list of leaf packages to add to the base.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    conda_execute.config.env_dir = tempfile.mkdtemp(prefix='conda-execute-bench_')
+    try:
+        # Build the base environment (and warm the package cache for it).
+        conda_execute.config.derive_max_distance = 0
+        create_env(args.base)
+        for leaves in args.leaves:
+            spec = args.base + leaves.split(',')
+            # Warm the package cache for the leaves too.
+            timed_create(spec, 0)
+            full = min(timed_create(spec, 0) for _ in range(args.repeat))
+            derived = min(timed_create(spec, 1000) for _ in range(args.repeat))
+            print('+{:<30} full: {:7.2f}s  derived: {:7.2f}s  speedup: {:5.1f}x'.format(
+                leaves, full, derived, full / derived))
+    finally:
+        shutil.rmtree(conda_execute.config.env_dir)
+
+
+if __name__ == '__main__':
+    main()
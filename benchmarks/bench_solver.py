@@ -0,0 +1,82 @@
+"""
+Benchmark the solver backends (see conda_execute.solver) against each other,
+solving and creating the same environments from the same local channel.
+
+For each backend, the time taken to load the index and solve each spec, and
+to create its environment from scratch (with derivation disabled), is
+measured. The package cache is warmed before the creations are timed, so the
+timings exclude downloading.
+
+    python benchmarks/bench_solver.py --channel /path/to/local/channel \\
+        --spec python=3.6,numpy --spec python=3.6,scipy,pandas
+
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import conda_execute.config
+import conda_execute.solver
+from conda_execute.tmpenv import create_env
+
+
+def timed_solve(backend, channels, spec):
+    start = time.time()
+    backend.solve(backend.get_index(channels), spec)
+    return time.time() - start
+
+
+def timed_create(channels, spec):
+    start = time.time()
+    env = create_env(spec, extra_channels=channels)
+    duration = time.time() - start
+    shutil.rmtree(env)
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--channel', required=True,
+                        help='The local channel (a directory, or a file:// URL) to solve against.')
+    parser.add_argument('--spec', action='append', default=[],
+                        help='A comma separated list of package specs of an environment.')
+    parser.add_argument('--backend', action='append', default=None,
+                        help='A backend to benchmark (default all of them).')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    channel = args.channel
+    if '://' not in channel:
+        channel = 'file://' + os.path.abspath(channel)
+    channels = [channel]
+    backends = args.backend or sorted(conda_execute.solver._BACKENDS)
+
+    conda_execute.config.env_dir = tempfile.mkdtemp(prefix='conda-execute-bench_')
+    conda_execute.config.derive_max_distance = 0
+    try:
+        print('{:<12} {:<40} {:>9} {:>9}'.format('backend', 'spec', 'solve', 'create'))
+        for name in backends:
+            conda_execute.config.solver = name
+            backend = conda_execute.solver.get_backend()
+            for spec in args.spec:
+                packages = spec.split(',')
+                try:
+                    # Warm the package cache (and any repodata cache).
+                    timed_create(channels, packages)
+                except Exception as exception:
+                    print('{:<12} {:<40} {}: {}'.format(name, spec, type(exception).__name__,
+                                                        exception))
+                    continue
+                solve = min(timed_solve(backend, channels, packages) for _ in range(args.repeat))
+                create = min(timed_create(channels, packages) for _ in range(args.repeat))
+                print('{:<12} {:<40} {:8.2f}s {:8.2f}s'.format(name, spec, solve, create))
+    finally:
+        shutil.rmtree(conda_execute.config.env_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Micro-benchmark of extract_spec over a corpus of real "# conda execute"
+headers, comparing against a full-file scan parsed with PyYAML's pure-Python
+safe loader (the previous implementation).
+
+Each header is benchmarked as a short script and as the top of a large data
+script, which the previous implementation read in full when no header was
+present.
+
+    python benchmarks/bench_spec.py
+
+"""
+from __future__ import print_function
+
+from io import StringIO
+import re
+import timeit
+
+import yaml
+
+from conda_execute.execute import extract_spec
+
+
+CORPUS = {
+    'readme': u'''#!/usr/bin/env python
+"""
+A script that uses numpy's random normal distribution to print 3 numbers.
+
+"""
+
+# conda execute
+# env:
+#  - python >=3
+#  - numpy
+
+import numpy as np
+''',
+    'run_with': u'''#!/usr/bin/env conda-execute
+
+# conda execute
+# env:
+#  - python >=3
+#  - numpy
+# run_with: python
+
+import numpy as np
+''',
+    'channels': u'''#!/usr/bin/env python
+# conda execute
+# channels:
+#  - conda-forge
+#  - bioconda
+# env:
+#  - python 3.6*
+#  - pandas >=0.20
+#  - scipy >=0.19,<1
+#  - matplotlib
+#  - seaborn
+#  - requests
+# run_with: [python, -u]
+''',
+    'flow': u'''# conda execute
+# env: [python, numpy, scipy]
+# run_with: python
+''',
+    'complex': u'''# conda execute
+# env:
+#  - python
+# run_with: ["python", "-c", "print(\\"hi\\")"]
+''',
+    'no_header': u'''#!/bin/sh
+echo "no header here"
+''',
+}
+
+DATA = u'data = [\n' + u'    [{}],\n'.format(', '.join(['1.2345'] * 10)) * 30000 + u']\n'
+
+
+def reference_extract_spec(fh):
+    spec = []
+    in_spec = False
+    for line in fh:
+        if in_spec:
+            if not line.strip().startswith('#'):
+                break
+            if re.search(r'^\ *\#\ *\#', line):
+                continue
+            spec.append(line.strip(' #\n'))
+        elif line.strip() in ['# conda execute', '# conda execute:']:
+            in_spec = True
+    return yaml.load(StringIO(u'\n'.join(spec)), Loader=yaml.SafeLoader) or {}
+
+
+def bench(func, text, number):
+    fh = StringIO(text)
+
+    def run():
+        fh.seek(0)
+        func(fh)
+    return min(timeit.repeat(run, number=number, repeat=3)) / number
+
+
+def main():
+    print('{:<22} {:>14} {:>14} {:>9}'.format('header', 'reference (us)', 'current (us)', 'speedup'))
+    for name, header in sorted(CORPUS.items()):
+        for suffix, text, number in [('', header, 2000), (' + 2MB data', header + DATA, 5)]:
+            reference = bench(reference_extract_spec, text, number) * 1e6
+            current = bench(extract_spec, text, number) * 1e6
+            print('{:<22} {:>14.1f} {:>14.1f} {:>8.1f}x'.format(
+                name + suffix, reference, current, reference / current))
+
+
+if __name__ == '__main__':
+    main()
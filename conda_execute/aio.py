@@ -0,0 +1,223 @@
+"""
+An asyncio interface to conda execute (Python 3.5+), for job runners which
+mustn't block their event loop::
+
+    executor = AsyncExecutor()
+    code = await executor.run('job.py', ['--verbose'], stdout=print_line)
+
+Environments are created in a thread pool, by an :class:`Executor`, and
+concurrent requests for the same environment share a single build. Scripts
+are run as subprocesses whose output may be streamed, line by line, to
+callbacks, and whose resource usage is recorded as
+:func:`~conda_execute.execute.run_within_env` records it. Cancelling an
+execution terminates the script (killing it if it doesn't exit within
+``terminate_timeout`` seconds). A build which is
+under way can't be interrupted, so it continues, in its thread, until the
+environment (and its lock) is complete, for the next execution to use.
+
+"""
+import asyncio
+import inspect
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from conda_execute.execute import _resources, _sink, _wait, command_environment
+from conda_execute.executor import Executor, _code_file
+from conda_execute.tmpenv import canonical_specs
+
+
+async def _stream(pipe, callback):
+    """Call the callback with each line read from the pipe, awaiting it if need be."""
+    if pipe is None:
+        return
+    reader = asyncio.StreamReader()
+    transport, _ = await asyncio.get_event_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    try:
+        while True:
+            try:
+                line = await reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError as exception:
+                # The end of the output, without a final newline.
+                line = exception.partial
+            except asyncio.LimitOverrunError as exception:
+                # Lines longer than the buffer are passed on in pieces.
+                line = await reader.readexactly(exception.consumed)
+            if not line:
+                return
+            result = callback(line)
+            if inspect.isawaitable(result):
+                await result
+    finally:
+        transport.close()
+
+
+def _exit(process):
+    """
+    A future of the return code and resource usage of the process (see
+    :func:`conda_execute.execute._wait`). The process is waited for by a
+    thread of its own, rather than by asyncio's child watcher (which
+    discards the resource usage), so that long-running scripts don't
+    occupy the threads which build environments.
+
+    """
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+
+    def resolve(method, value):
+        if not future.done():
+            method(value)
+
+    def wait():
+        try:
+            result = _wait(process)
+        except Exception as exception:
+            loop.call_soon_threadsafe(resolve, future.set_exception, exception)
+        else:
+            loop.call_soon_threadsafe(resolve, future.set_result, result)
+
+    thread = threading.Thread(target=wait)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+async def _terminate(process, exited, timeout):
+    # The process is signalled directly, as Popen.terminate may reap it from under the waiting
+    # thread.
+    if exited.done():
+        return
+    try:
+        os.kill(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        await asyncio.wait_for(asyncio.shield(exited), timeout)
+    except asyncio.TimeoutError:
+        os.kill(process.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+        await asyncio.shield(exited)
+
+
+class AsyncExecutor(object):
+    def __init__(self, executor=None, terminate_timeout=5):
+        """
+        Executes scripts in their temporary environments, without blocking
+        the event loop.
+
+        The executor (an :class:`Executor`, by default configured as
+        ``conda execute`` is) provides the configuration and the caches.
+        Cancelled scripts are killed if they haven't exited terminate_timeout
+        seconds after being asked to.
+
+        """
+        self.executor = executor or Executor()
+        self.terminate_timeout = terminate_timeout
+        # The builds under way, keyed as the executor's environments are.
+        self._builds = {}
+
+    async def ensure_env(self, spec, channels=()):
+        """
+        Return the prefix of the environment of the given spec (a list of
+        package specifications) and channels, creating it if need be.
+
+        """
+        env_prefix, hit, timings = await self._ensure_env(spec, channels)
+        return env_prefix
+
+    async def _ensure_env(self, spec, channels):
+        key = (canonical_specs(spec), tuple(self.executor._channels(channels)))
+        build = self._builds.get(key)
+        if build is None:
+            timings = {}
+
+            def ensure_env():
+                env_prefix, hit = self.executor._ensure_env(spec, channels, timings)
+                return env_prefix, hit, timings
+
+            loop = asyncio.get_event_loop()
+            build = self._builds[key] = asyncio.ensure_future(
+                loop.run_in_executor(None, ensure_env))
+            build.add_done_callback(lambda _: self._builds.pop(key, None))
+        # A cancelled waiter mustn't cancel the build which others are waiting for.
+        return await asyncio.shield(build)
+
+    async def run(self, path, args=(), stdout=None, stderr=None):
+        """
+        Execute the script at the given path, with the given arguments, in
+        its environment, returning its exit code.
+
+        If given, stdout and stderr are callables (or coroutine functions)
+        called with each line (as bytes) of the script's output, or binary
+        file-like objects (e.g. a :class:`~conda_execute.execute.RingBuffer`)
+        to which the output is written, rather than the output being
+        inherited from this process.
+
+        """
+        path = os.path.abspath(path)
+        event = {'time': time.time(), 'phases': {}}
+        try:
+            spec = self.executor._spec(path)
+            event['phases']['spec'] = time.time() - event['time']
+            return await self._run(path, spec, args, (), stdout, stderr, event)
+        except BaseException as exception:
+            # Including the cancellation of the execution.
+            event['error'] = type(exception).__name__
+            raise
+        finally:
+            await self._record_event(event)
+
+    async def run_code(self, source, args=(), stdout=None, stderr=None):
+        """
+        Execute the given source code (which has a ``# conda execute``
+        header, as a script would), as :meth:`run` does a script.
+
+        """
+        event = {'time': time.time(), 'phases': {}}
+        try:
+            spec = self.executor._code_spec(source)
+            event['phases']['spec'] = time.time() - event['time']
+            with _code_file(source) as (path, pass_fds):
+                return await self._run(path, spec, args, pass_fds, stdout, stderr, event)
+        except BaseException as exception:
+            event['error'] = type(exception).__name__
+            raise
+        finally:
+            await self._record_event(event)
+
+    async def _record_event(self, event):
+        # The event log is appended to (under a file lock) in a thread, not on the loop.
+        await asyncio.get_event_loop().run_in_executor(None, self.executor._record_event, event)
+
+    async def _run(self, path, spec, args, pass_fds, stdout, stderr, event):
+        env_spec = self.executor._env_spec(spec)
+        phase_start = time.time()
+        env_prefix, event['hit'], timings = await self._ensure_env(
+            env_spec, spec.get('channels', []))
+        event['phases'].update(timings)
+        event['env'] = os.path.basename(env_prefix)
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.executor._record_usage, env_prefix, spec)
+        event['phases']['env'] = time.time() - phase_start
+
+        phase_start = time.time()
+        event['startup'] = phase_start - event['time']
+        cmd, environ = command_environment(env_prefix, spec['run_with'] + [path] + list(args))
+        kwargs = {'pass_fds': pass_fds} if pass_fds else {}
+        process = subprocess.Popen(cmd, env=environ,
+                                   stdout=None if stdout is None else subprocess.PIPE,
+                                   stderr=None if stderr is None else subprocess.PIPE, **kwargs)
+        exited = _exit(process)
+        try:
+            await asyncio.gather(_stream(process.stdout, _sink(stdout)),
+                                 _stream(process.stderr, _sink(stderr)))
+            event['code'], _ = await asyncio.shield(exited)
+        finally:
+            await _terminate(process, exited, self.terminate_timeout)
+            event['phases']['run'] = time.time() - phase_start
+            event['resources'] = {'wall': event['phases']['run']}
+            if exited.done() and exited.exception() is None:
+                event['resources'].update(_resources(exited.result()[1]))
+        return event['code']
@@ -0,0 +1,269 @@
+"""
+Compressed archives of temporary environments.
+
+Environments which have been idle for ``archive-after`` hours are packed into
+a compressed tarball in the ``archive-dir`` and removed (by ``conda tmpenv
+archive``), and are restored to their original prefix when next needed. As
+the prefix is unchanged, no prefix rewriting is needed on restoration.
+Archives are laid out in the archive-dir as their environments are in the
+env-dir (i.e. sharded, if the env-dir is).
+
+The files which were hardlinked to the package cache are recorded in the
+archive, and hardlinked to it again on restoration (where the package is
+still in the cache), so that restored environments take no more disk than
+they did.
+
+Archives are compressed with zstd if the ``zstandard`` package is available,
+and gzip otherwise.
+
+"""
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import conda_execute.catalog
+import conda_execute.config
+
+
+log = logging.getLogger('conda-tmpenv')
+log.addHandler(logging.NullHandler())
+
+
+_EXTENSIONS = ['.tar.zst', '.tar.gz']
+
+
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def pack(directory, path, arcname='.', exclude=(), extra=None):
+    """
+    Pack the contents of the directory (under the given name) into a
+    compressed tarball at path, written atomically. Paths relative to the
+    directory in ``exclude`` are left out, and ``extra`` may map additional
+    member names to their (bytes) content.
+
+    zstd compression is used for paths ending in ".zst", and gzip otherwise.
+
+    """
+    def tar_filter(tarinfo):
+        if os.path.relpath(tarinfo.name, arcname) in exclude:
+            return None
+        return tarinfo
+
+    def add(tar):
+        tar.add(directory, arcname=arcname, filter=tar_filter)
+        for name, content in sorted((extra or {}).items()):
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(content)
+            tarinfo.mtime = time.time()
+            tar.addfile(tarinfo, io.BytesIO(content))
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            if path.endswith('.zst'):
+                with zstandard.ZstdCompressor().stream_writer(fh, closefd=False) as writer:
+                    with tarfile.open(fileobj=writer, mode='w|') as tar:
+                        add(tar)
+            else:
+                with tarfile.open(fileobj=fh, mode='w:gz', compresslevel=6) as tar:
+                    add(tar)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _extractall(tar, directory):
+    if hasattr(tarfile, 'tar_filter'):
+        # Keep permissions and links as they were, but refuse anything which
+        # would be extracted outside of the directory.
+        tar.extractall(directory, filter='tar')
+    else:
+        tar.extractall(directory)
+
+
+def unpack(path, directory):
+    """
+    Unpack a tarball created by :func:`pack` (of either compression) into
+    the given directory, which must not exist. The directory appears only
+    once fully unpacked.
+
+    """
+    parent = os.path.dirname(directory)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+    try:
+        with open(path, 'rb') as fh:
+            if fh.read(4) == _ZSTD_MAGIC:
+                if zstandard is None:
+                    raise RuntimeError('Unable to unpack {}: the zstandard package is '
+                                       'not installed.'.format(path))
+                fh.seek(0)
+                with zstandard.ZstdDecompressor().stream_reader(fh) as reader:
+                    with tarfile.open(fileobj=reader, mode='r|') as tar:
+                        _extractall(tar, tmp_dir)
+            else:
+                fh.seek(0)
+                with tarfile.open(fileobj=fh, mode='r:gz') as tar:
+                    _extractall(tar, tmp_dir)
+        os.rename(tmp_dir, directory)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def archive_path(env_prefix):
+    """
+    The path of the archive of the given environment, if one exists, or
+    None.
+
+    """
+    name = os.path.relpath(env_prefix, conda_execute.config.env_dir)
+    for extension in _EXTENSIONS:
+        path = os.path.join(conda_execute.config.archive_dir, name + extension)
+        if os.path.exists(path):
+            return path
+
+
+def archived_envs():
+    """
+    Return a list of (env_prefix, archive_path) of the archived environments.
+
+    """
+    envs = []
+    for extension in _EXTENSIONS:
+        for name, path in conda_execute.catalog.sharded_files(conda_execute.config.archive_dir,
+                                                              extension):
+            envs.append((os.path.join(conda_execute.config.env_dir, name), path))
+    return sorted(envs)
+
+
+# The record, within an archive, of the files which were hardlinked to the package cache.
+_PKG_LINKS = 'conda-meta/conda-execute.pkg-links'
+
+
+def _pkg_links(env_prefix):
+    """
+    The [dist_name, path] of each file of the environment which is a
+    hardlink to the file of its package in the pkg_dir.
+
+    """
+    links = []
+    meta_dir = os.path.join(env_prefix, 'conda-meta')
+    for fname in sorted(os.listdir(meta_dir)) if os.path.isdir(meta_dir) else []:
+        if not fname.endswith('.json'):
+            continue
+        dist_name = fname[:-len('.json')]
+        with open(os.path.join(meta_dir, fname), 'r') as fh:
+            files = json.load(fh).get('files', [])
+        for path in files:
+            try:
+                stat = os.lstat(os.path.join(env_prefix, path))
+                pkg_stat = os.lstat(os.path.join(conda_execute.config.pkg_dir, dist_name, path))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) == (pkg_stat.st_dev, pkg_stat.st_ino):
+                links.append([dist_name, path])
+    return links
+
+
+def _relink(env_prefix):
+    """
+    Hardlink the files of a restored environment to the package cache, as
+    they were before it was archived.
+
+    """
+    links_file = os.path.join(env_prefix, _PKG_LINKS)
+    try:
+        with open(links_file, 'r') as fh:
+            links = json.load(fh)
+    except (IOError, OSError, ValueError):
+        return
+    for dist_name, path in links:
+        source = os.path.join(conda_execute.config.pkg_dir, dist_name, path)
+        dest = os.path.join(env_prefix, path)
+        try:
+            if os.path.getsize(source) != os.path.getsize(dest):
+                continue
+            tmp_path = dest + '.conda-execute-tmp'
+            os.link(source, tmp_path)
+            os.rename(tmp_path, dest)
+        except OSError:
+            # The package has been removed from the cache (or is on another device).
+            continue
+    os.remove(links_file)
+
+
+def archive_env(env_prefix, last_used=None):
+    """
+    Pack the environment into the archive directory, and remove it. The
+    archive's mtime is set to the time the environment was last used.
+
+    """
+    extension = '.tar.zst' if zstandard is not None else '.tar.gz'
+    path = os.path.join(conda_execute.config.archive_dir,
+                        os.path.relpath(env_prefix, conda_execute.config.env_dir) + extension)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    log.warn('Archiving unused temporary environment {} to {}.'.format(env_prefix, path))
+    links = json.dumps(_pkg_links(env_prefix)).encode('utf-8')
+    pack(env_prefix, path, extra={_PKG_LINKS: links})
+    if last_used is not None:
+        os.utime(path, (last_used, last_used))
+    shutil.rmtree(env_prefix)
+    conda_execute.catalog.remove(env_prefix)
+    return path
+
+
+def restore_env(env_prefix):
+    """
+    Restore the archived environment to its prefix, returning whether there
+    was an archive to restore.
+
+    """
+    path = archive_path(env_prefix)
+    if path is None:
+        return False
+    if path.endswith('.tar.zst') and zstandard is None:
+        log.warn('Unable to restore {}: the zstandard package is not '
+                 'installed.'.format(path))
+        return False
+    log.info('Restoring {} from {}'.format(env_prefix, path))
+    if os.path.exists(env_prefix):
+        shutil.rmtree(env_prefix)
+    unpack(path, env_prefix)
+    _relink(env_prefix)
+    os.remove(path)
+    conda_execute.catalog.add(env_prefix)
+    return True
+
+
+def disk_usage(path):
+    """
+    The number of bytes used by the file or directory at path, counting each
+    hardlinked file once.
+
+    """
+    if os.path.isfile(path):
+        return os.lstat(path).st_size
+    seen = set()
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files + dirs:
+            stat = os.lstat(os.path.join(root, name))
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
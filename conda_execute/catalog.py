@@ -0,0 +1,142 @@
+"""
+The catalog of the temporary environments in the env_dir.
+
+Environments are sharded into subdirectories of the env_dir named by the
+first characters of their hash (``<env_dir>/3f/3fa4...``, see the
+``shard-env-dir`` config), so that no single directory holds thousands of
+entries. The environments are listed in ``<env_dir>/.catalog.json``, which is
+rewritten atomically (under a lock) whenever one is created or removed, so
+that listing them never needs to walk the store. The catalog is rebuilt from
+the store with ``conda tmpenv reindex``, or automatically if it is missing.
+
+"""
+import json
+import logging
+import os
+
+import conda_execute.config
+from conda_execute.lock import Locked
+from conda_execute.utils import atomic_write
+
+
+log = logging.getLogger('conda-tmpenv')
+log.addHandler(logging.NullHandler())
+
+
+SHARD_LENGTH = 2
+
+
+def env_path(name, env_dir=None):
+    """
+    The prefix of the environment with the given name (hash) in the env_dir.
+
+    """
+    if env_dir is None:
+        env_dir = conda_execute.config.env_dir
+    if conda_execute.config.shard_env_dir:
+        return os.path.join(env_dir, name[:SHARD_LENGTH], name)
+    return os.path.join(env_dir, name)
+
+
+def sharded_files(directory, extension):
+    """
+    Return a list of (name, path) of the files with the given extension in
+    the directory, at its top level or in a shard subdirectory, where name is
+    the path relative to the directory without the extension.
+
+    """
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for fname in sorted(os.listdir(directory)):
+        path = os.path.join(directory, fname)
+        if len(fname) == SHARD_LENGTH and os.path.isdir(path):
+            names = [os.path.join(fname, shard_fname) for shard_fname in sorted(os.listdir(path))]
+        else:
+            names = [fname]
+        for name in names:
+            if name.endswith(extension) and not os.path.basename(name).startswith('.'):
+                files.append((name[:-len(extension)], os.path.join(directory, name)))
+    return files
+
+
+def _catalog_file():
+    return os.path.join(conda_execute.config.env_dir, '.catalog.json')
+
+
+def _read():
+    try:
+        with open(_catalog_file(), 'r') as fh:
+            return set(json.load(fh)['envs'])
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def _write(entries):
+    atomic_write(_catalog_file(), json.dumps({'envs': sorted(entries)}, indent=1))
+
+
+def _entry(env_prefix):
+    return os.path.relpath(env_prefix, conda_execute.config.env_dir)
+
+
+def envs():
+    """
+    The prefixes of the environments in the catalog. (This includes any
+    environments which are still being created.)
+
+    """
+    entries = _read()
+    if entries is None:
+        if not os.path.isdir(conda_execute.config.env_dir):
+            return []
+        entries = reindex()
+    return [os.path.join(conda_execute.config.env_dir, entry) for entry in sorted(entries)]
+
+
+def add(env_prefix):
+    with Locked(_catalog_file()):
+        entries = _read()
+        if entries is None:
+            entries = reindex()
+        if _entry(env_prefix) not in entries:
+            entries.add(_entry(env_prefix))
+            _write(entries)
+
+
+def remove(env_prefix):
+    with Locked(_catalog_file()):
+        entries = _read()
+        if entries is None:
+            entries = reindex()
+        if _entry(env_prefix) in entries:
+            entries.discard(_entry(env_prefix))
+            _write(entries)
+
+
+def _is_env(path):
+    return os.path.isdir(os.path.join(path, 'conda-meta'))
+
+
+def reindex():
+    """
+    Rebuild the catalog by walking the env_dir, finding both sharded and
+    (unsharded) environments. Returns the set of catalog entries.
+
+    """
+    env_dir = conda_execute.config.env_dir
+    entries = set()
+    names = os.listdir(env_dir) if os.path.isdir(env_dir) else []
+    for name in names:
+        path = os.path.join(env_dir, name)
+        if name.startswith('.'):
+            continue
+        elif _is_env(path):
+            entries.add(name)
+        elif len(name) == SHARD_LENGTH and os.path.isdir(path):
+            for env_name in os.listdir(path):
+                if not env_name.startswith('.') and _is_env(os.path.join(path, env_name)):
+                    entries.add(os.path.join(name, env_name))
+    log.debug('Indexed {} temporary environments in {}'.format(len(entries), env_dir))
+    _write(entries)
+    return entries
@@ -24,8 +24,12 @@ if conda_44:
     from conda.exports import Resolve
     from conda.exports import get_index
     from conda.common.serialize import yaml_dump, yaml_load
+    from conda.base.context import context
+    subdir = context.subdir
 elif conda_42:
     from conda.config import user_rc_path, sys_rc_path
+    from conda.base.context import context
+    subdir = context.subdir
     from conda.exports import envs_dirs, pkgs_dirs
     from conda.exports import Resolve
     from conda.exports import get_index
@@ -36,6 +40,7 @@ else:
     from conda.resolve import Resolve
     from conda.api import get_index
     from conda.utils import yaml_load
+    from conda.config import subdir
 
 user_rc_path, sys_rc_path = user_rc_path, sys_rc_path
     
@@ -43,6 +48,7 @@ envs_dirs, pkgs_dirs = envs_dirs, pkgs_dirs
 Resolve = Resolve
 get_index = get_index
 yaml_load = yaml_load
+subdir = subdir
 
 
 def collect_rc():
@@ -1,7 +1,10 @@
+import hashlib
+import json
 import logging
 import os
+import sys
 
-from conda_execute.conda_interface import envs_dirs, pkgs_dirs, rc
+from conda_execute.utils import atomic_write
 
 
 log = logging.getLogger('conda-execute')
@@ -20,21 +23,288 @@ def setup_logging(level):
         logger.setLevel(level + offset)
 
 
-execute_config = rc.get('conda-execute') or {}
-env_dir_template = execute_config.get('env-dir', '%s/../tmp_envs' % envs_dirs[0])
+# conda's search path for condarc files (as of conda 4.4; earlier versions read
+# a subset of these), where "condarc.d" directories hold any number of .yml
+# or .yaml files. Variables which aren't set drop their paths.
+_CONDARC_SEARCH_PATH = [
+    '/etc/conda/.condarc', '/etc/conda/condarc', '/etc/conda/condarc.d/',
+    '/var/lib/conda/.condarc', '/var/lib/conda/condarc', '/var/lib/conda/condarc.d/',
+    '$CONDA_ROOT/.condarc', '$CONDA_ROOT/condarc', '$CONDA_ROOT/condarc.d/',
+    '$XDG_CONFIG_HOME/conda/.condarc', '$XDG_CONFIG_HOME/conda/condarc',
+    '$XDG_CONFIG_HOME/conda/condarc.d/',
+    '~/.config/conda/.condarc', '~/.config/conda/condarc', '~/.config/conda/condarc.d/',
+    '~/.conda/.condarc', '~/.conda/condarc', '~/.conda/condarc.d/',
+    '~/.condarc',
+    '$CONDA_PREFIX/.condarc', '$CONDA_PREFIX/condarc', '$CONDA_PREFIX/condarc.d/',
+    '$CONDARC',
+]
 
-# Expand user and normalize the path.
-env_dir = os.path.normpath(os.path.expanduser(env_dir_template))
+
+def _conda_files():
+    """
+    The paths of the files (and directories) whose change could change
+    conda's settings: the condarc files of conda's search path and the conda
+    package itself.
+
+    """
+    environ = dict(os.environ)
+    # conda's root prefix, which is where conda execute is installed.
+    environ.setdefault('CONDA_ROOT', sys.prefix)
+    paths = []
+    for path in _CONDARC_SEARCH_PATH:
+        variable = path.split('/', 1)[0][1:] if path.startswith('$') else None
+        if variable is not None:
+            if not environ.get(variable):
+                continue
+            path = environ[variable] + path[len(variable) + 1:]
+        path = os.path.normpath(os.path.expanduser(path))
+        paths.append(path)
+        if os.path.isdir(path):
+            try:
+                fnames = sorted(os.listdir(path))
+            except OSError:
+                fnames = []
+            paths.extend(os.path.join(path, fname) for fname in fnames
+                         if fname.endswith(('.yml', '.yaml')))
+    try:
+        from importlib.util import find_spec
+    except ImportError:
+        # Python 2.
+        import imp
+        try:
+            paths.append(os.path.join(imp.find_module('conda')[1], '__init__.py'))
+        except ImportError:
+            pass
+    else:
+        conda_spec = find_spec('conda')
+        if conda_spec is not None and conda_spec.origin:
+            paths.append(conda_spec.origin)
+    return paths
+
+
+def _settings_file():
+    return os.path.expanduser(os.path.join('~', '.conda', 'conda-execute-settings.json'))
+
+
+def _conda_settings():
+    """
+    The settings which conda execute needs from conda (the default envs and
+    pkgs directories, the platform subdir and the ``conda-execute`` section of
+    the condarc), along with their cache key and whether they were read from
+    the cache.
+
+    Importing conda to find these is slow, and unnecessary when executing in
+    an existing environment, so the settings are cached (by
+    :func:`cache_conda_settings`) in ``~/.conda/conda-execute-settings.json``
+    until any of the condarc files, the ``CONDA*`` environment variables or
+    conda itself change.
+
+    """
+    key = [sys.prefix, sorted((name, value) for name, value in os.environ.items()
+                              if name.startswith('CONDA') or name == 'XDG_CONFIG_HOME')]
+    for path in _conda_files():
+        try:
+            key.append([path, os.path.getmtime(path)])
+        except OSError:
+            key.append([path, None])
+    key = hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+    try:
+        with open(_settings_file(), 'r') as fh:
+            cached = json.load(fh)
+        if cached['key'] == key:
+            return cached['settings'], key, True
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    from conda_execute.conda_interface import envs_dirs, pkgs_dirs, rc, subdir
+    settings = {'envs_dir': envs_dirs[0], 'pkgs_dir': pkgs_dirs[0], 'subdir': subdir,
+                'execute_config': rc.get('conda-execute') or {}}
+    return settings, key, False
+
+
+def cache_conda_settings():
+    """
+    Cache the conda settings, unless they were read from the cache, so that
+    the next process needn't import conda to find them. Called by the
+    command line interfaces, so that merely importing conda execute doesn't
+    write to the user's home directory.
+
+    """
+    if _conda_cached:
+        return
+    try:
+        atomic_write(_settings_file(), json.dumps({'key': _conda_key, 'settings': _conda}))
+    except (IOError, OSError, TypeError, ValueError) as exception:
+        log.debug('Unable to cache the conda settings: {}'.format(exception))
+
+
+_conda, _conda_key, _conda_cached = _conda_settings()
+
+# The platform (e.g. linux-64) of the packages in the environments.
+subdir = _conda['subdir']
+
+execute_config = _conda['execute_config']
+env_dir_template = execute_config.get('env-dir', '%s/../tmp_envs' % _conda['envs_dir'])
+if not isinstance(env_dir_template, list):
+    env_dir_template = [env_dir_template]
+
+# Expand user and normalize the paths. All but the last are read-only (e.g.
+# shared) stores, which are searched for environments before the last: the
+# local, writable, store where environments are created.
+env_dirs = [os.path.normpath(os.path.expanduser(template)) for template in env_dir_template]
+shared_env_dirs, env_dir = env_dirs[:-1], env_dirs[-1]
+
+# Whether environments are placed in subdirectories of the env_dir named by the
+# first characters of their hash (e.g. <env_dir>/3f/3fa4...), so that no single
+# directory holds thousands of environments.
+shard_env_dir = execute_config.get('shard-env-dir', True)
 
 
 # The miniumum amount of time since a new process has used an environment
-# (in hours) before it can be considered for removing.
+# (in days) before it can be considered for removing.
 min_age = execute_config.get('remove-if-unused-for', 25)
 
 
-pkg_dir_template = execute_config.get('pkg-dir', pkgs_dirs[0])
+# The number of hours without use after which an environment is packed into a
+# compressed archive by conda tmpenv archive (and restored when next needed),
+# rather than being kept in full until it is removed. Zero disables archiving.
+archive_after = execute_config.get('archive-after', 0)
+
+archive_dir_template = execute_config.get('archive-dir', env_dir + '_archive')
+
+# Expand user and normalize the path.
+archive_dir = os.path.normpath(os.path.expanduser(archive_dir_template))
+
+
+# The number of most frequently used environments which are never cleaned up,
+# and which are rebuilt in the background if they are removed or damaged.
+keep_warm = execute_config.get('keep-warm', 0)
+
+# The number of days after which the usage record of a removed (and since
+# unused) environment is forgotten.
+forget_usage_after = execute_config.get('forget-usage-after', 90)
+
+# The minimum number of seconds between the checks (at the end of executions)
+# that the hot environments are built, and the pruning of usage records.
+usage_interval = execute_config.get('usage-interval', 300)
+
+
+# The maximum number of temporary environments which may be created at once on
+# this machine. Zero means no limit.
+max_concurrent_creations = execute_config.get('max-concurrent-creations', 0)
+
+
+# Whether to check the files of an existing environment against the manifest
+# written when it was created before reusing it (repairing any damaged
+# packages), and how often (in seconds) each environment is checked.
+verify_envs = execute_config.get('verify-envs', False)
+verify_interval = execute_config.get('verify-interval', 60 * 60)
+
+
+# The maximum number of differing packages between a new environment and the
+# nearest existing temporary environment for the new one to be derived from
+# it, rather than created from scratch. Zero disables derivation.
+derive_max_distance = execute_config.get('derive-max-distance', 10)
+
+
+# The backend which solves specifications and installs the packages into the
+# environments: conda (conda's classic solver), libmamba (the solver of the
+# conda-libmamba-solver plugin) or micromamba (the micromamba executable,
+# found on the PATH unless given).
+solver = execute_config.get('solver', 'conda')
+micromamba = execute_config.get('micromamba', 'micromamba')
+
+# Seconds a solve may take (in a worker process, which is killed if it takes
+# longer) before it fails. Zero (the default, as the index must be sent to
+# the worker) solves in this process, without a limit.
+solve_timeout = execute_config.get('solve-timeout', 0)
+
+# The address space, in bytes, to which the solver worker processes are
+# limited (where the platform supports it). Zero is no limit.
+solve_max_memory_bytes = execute_config.get('solve-max-memory-bytes', 0)
+
+# Seconds for which a spec whose solve timed out, or ran out of memory, fails
+# immediately rather than being solved again.
+solve_failure_cooldown = execute_config.get('solve-failure-cooldown', 3600)
+
+# The number of idle solver worker processes kept (with the last index they
+# were sent) for the later solves of the same process.
+solver_workers = execute_config.get('solver-workers', 2)
+
+
+pkg_dir_template = execute_config.get('pkg-dir', _conda['pkgs_dir'])
 
 # Expand user and normalize the path.
 pkg_dir = os.path.normpath(os.path.expanduser(pkg_dir_template))
 
 
+script_cache_dir_template = execute_config.get('script-cache-dir',
+                                               '%s/../script_cache' % _conda['envs_dir'])
+
+# Expand user and normalize the path.
+script_cache_dir = os.path.normpath(os.path.expanduser(script_cache_dir_template))
+
+
+# The number of seconds for which a cached remote script is used without
+# revalidating it with the server. Zero means always revalidate (a conditional
+# request which costs a single round trip if the script is unchanged).
+script_max_age = execute_config.get('remote-script-max-age', 0)
+
+# The number of days after which a cached remote script which hasn't been
+# used is removed from the script cache.
+script_cache_max_age = execute_config.get('script-cache-max-age', 30)
+
+
+# Each execution appends an event (its environment, whether that was already
+# built, the time taken by each phase and the exit code) to this JSON-lines log.
+# The log is rotated when it grows beyond event-log-max-bytes, keeping
+# event-log-backups old logs. An empty value disables the log.
+event_log_template = execute_config.get('event-log', os.path.join(env_dir, '.events', 'events.jsonl'))
+
+# Expand user and normalize the path.
+event_log = event_log_template and os.path.normpath(os.path.expanduser(event_log_template))
+event_log_max_bytes = execute_config.get('event-log-max-bytes', 16 * 1024 * 1024)
+event_log_backups = execute_config.get('event-log-backups', 4)
+
+
+# The file (e.g. in node_exporter's textfile collector directory) to which
+# the cleanup after each execution writes Prometheus metrics of the
+# environments and executions, at most once every metrics-interval seconds.
+# An empty value disables writing the metrics other than on demand (with
+# "conda tmpenv metrics").
+metrics_textfile_template = execute_config.get('metrics-textfile', None)
+
+# Expand user and normalize the path.
+metrics_textfile = (metrics_textfile_template and
+                    os.path.normpath(os.path.expanduser(metrics_textfile_template)))
+metrics_interval = execute_config.get('metrics-interval', 60)
+
+
+def env_dir_settings(path):
+    """
+    The settings of the env_dir at the given path (e.g. an Executor's, or
+    that given to conda tmpenv with --env-dir): the env_dir itself and the
+    settings which would otherwise be shared with the configured env_dir's
+    tree, placed beside or within the given one instead (the archive
+    directory, the script cache and the event log). The configured
+    settings are returned for the configured env_dir.
+
+    """
+    path = os.path.normpath(os.path.expanduser(path))
+    if path == env_dir:
+        return {'env_dir': env_dir, 'archive_dir': archive_dir,
+                'script_cache_dir': script_cache_dir, 'event_log': event_log}
+    return {'env_dir': path,
+            'archive_dir': path + '_archive',
+            'script_cache_dir': path + '_script_cache',
+            # Unless the event log is disabled.
+            'event_log': event_log and os.path.join(path, '.events', 'events.jsonl')}
+
+
+# The "# conda execute" header must start within this many lines and bytes of
+# the top of a script. Larger scripts are not read beyond these limits.
+spec_header_max_lines = execute_config.get('spec-header-max-lines', 500)
+spec_header_max_bytes = execute_config.get('spec-header-max-bytes', 64 * 1024)
+
+
@@ -0,0 +1,298 @@
+"""
+A log of the executions of scripts, for analysing the performance of
+conda execute (see ``conda tmpenv stats``).
+
+Each execution appends a single JSON line to the ``event-log``, recording:
+
+ * ``time``: when the execution started.
+ * ``env``: the name (hash) of the environment.
+ * ``hit``: whether the environment was already built (rather than being
+   created, restored or repaired).
+ * ``phases``: the seconds spent in each phase (``spec`` parsing, preparing
+   the ``env``, of which any ``solve`` of the spec, and the ``run`` of the
+   script itself).
+ * ``startup``: the seconds from the start of the conda execute process to
+   the start of the script.
+ * ``code``: the exit code of the script, or ``error``: the exception which
+   prevented it from running.
+ * ``resources``: the resources used by the script (see
+   :func:`conda_execute.execute.execute_within_env`).
+
+Events are appended with a single ``write`` to a file opened for appending,
+so concurrent executions never interleave their lines. The log is rotated
+once it exceeds ``event-log-max-bytes``, keeping ``event-log-backups`` old
+logs, so it never grows without bound.
+
+"""
+from __future__ import division
+
+import json
+import logging
+import math
+import os
+
+import conda_execute.config
+from conda_execute.lock import Locked
+
+
+log = logging.getLogger('conda-execute')
+log.addHandler(logging.NullHandler())
+
+
+def _log_files(path):
+    """The rotated logs followed by the current log, oldest first."""
+    backups = ['{}.{}'.format(path, n)
+               for n in range(conda_execute.config.event_log_backups, 0, -1)]
+    return backups + [path]
+
+
+def _rotate(path):
+    with Locked(path):
+        # Another process may have rotated the log while we waited.
+        if (not os.path.exists(path) or
+                os.path.getsize(path) <= conda_execute.config.event_log_max_bytes):
+            return
+        files = _log_files(path)
+        if os.path.exists(files[0]):
+            os.remove(files[0])
+        for older, newer in zip(files, files[1:]):
+            if os.path.exists(newer):
+                os.rename(newer, older)
+
+
+def record_event(event, path=None):
+    """
+    Append the event (a JSON serialisable dictionary) to the event log (or
+    to the given log), rotating the log if it has grown too large.
+
+    """
+    if path is None:
+        path = conda_execute.config.event_log
+    if not path:
+        return
+    line = json.dumps(event, sort_keys=True, separators=(',', ':')) + '\n'
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if size > conda_execute.config.event_log_max_bytes:
+            _rotate(path)
+    except (IOError, OSError) as exception:
+        log.debug('Unable to record the execution event: {}'.format(exception))
+
+
+def read_events(since=None):
+    """
+    Generate the events in the event log (including the rotated logs), oldest
+    first, optionally only those since the given timestamp. Lines which
+    can't be parsed (e.g. truncated by a full disk) are skipped.
+
+    """
+    path = conda_execute.config.event_log
+    if not path:
+        return
+    for fname in _log_files(path):
+        try:
+            fh = open(fname, 'r')
+        except (IOError, OSError):
+            continue
+        with fh:
+            for line in fh:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if since is None or event.get('time', 0) >= since:
+                    yield event
+
+
+def tail_events(position):
+    """
+    Generate the events appended to the event log since the given position:
+    a dictionary which is updated in place as events are read, and which
+    starts empty (to read from the start of the current log). Events in a
+    log which has since been rotated are still read, and incompletely
+    written lines are left to be read next time.
+
+    """
+    path = conda_execute.config.event_log
+    if not path:
+        return
+    try:
+        current = os.stat(path)
+    except OSError:
+        current = None
+    files = []
+    start = position.get('offset', 0)
+    if position.get('inode') is not None and (current is None or
+                                              current.st_ino != position['inode']):
+        # Finish reading the log which has since been rotated, and read any
+        # logs rotated after it.
+        for fname in _log_files(path)[:-1]:
+            try:
+                inode = os.stat(fname).st_ino
+            except OSError:
+                continue
+            if files:
+                files.append((fname, 0))
+            elif inode == position['inode']:
+                files.append((fname, start))
+        start = 0
+    if current is not None:
+        # The log may have been truncated (e.g. by hand).
+        files.append((path, start if start <= current.st_size else 0))
+
+    for fname, offset in files:
+        with open(fname, 'rb') as fh:
+            position.update(inode=os.fstat(fh.fileno()).st_ino, offset=offset)
+            fh.seek(offset)
+            for line in fh:
+                if not line.endswith(b'\n'):
+                    break
+                position['offset'] += len(line)
+                try:
+                    event = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+                yield event
+
+
+class Histogram(object):
+    def __init__(self, growth=1.02, smallest=1e-3):
+        """
+        A histogram of positive values in logarithmically sized buckets, each
+        ``growth`` times larger than the last, from which percentiles can be
+        estimated (to within the bucket width) in constant memory.
+
+        """
+        self.growth = growth
+        self.smallest = smallest
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.
+        self.max = None
+
+    def _bucket(self, value):
+        if value <= self.smallest:
+            return 0
+        return 1 + int(math.log(value / self.smallest, self.growth))
+
+    def add(self, value):
+        bucket = self._bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        The estimated value below which the given percentage of the values
+        fall, or None if there are no values.
+
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * percent / 100.)))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                break
+        if bucket == 0:
+            return min(self.smallest, self.max)
+        # The geometric middle of the bucket, but no more than the largest value.
+        return min(self.smallest * self.growth ** (bucket - 0.5), self.max)
+
+
+class Stats(object):
+    def __init__(self):
+        """
+        Aggregate statistics of a stream of events, using memory proportional
+        to the number of distinct environments rather than of events.
+
+        """
+        self.runs = 0
+        self.hits = 0
+        self.failures = 0
+        self.first = self.last = None
+        self.phases = {}
+        self.startup = Histogram()
+        #: Per environment: [runs, creations, seconds spent preparing the env].
+        self.envs = {}
+        #: Per environment, for the current and the previous build of the env:
+        #: [runs, CPU seconds, peak resident set size].
+        self.resources = {}
+
+    def add(self, event):
+        self.runs += 1
+        if event.get('hit'):
+            self.hits += 1
+        if event.get('error') or event.get('code'):
+            self.failures += 1
+        if self.first is None:
+            self.first = event.get('time')
+        self.last = event.get('time')
+        for phase, duration in event.get('phases', {}).items():
+            self.phases.setdefault(phase, Histogram()).add(duration)
+        if 'startup' in event:
+            self.startup.add(event['startup'])
+        if event.get('env') is None:
+            # The execution failed before its environment was known.
+            return
+        env = self.envs.setdefault(event['env'], [0, 0, 0.])
+        env[0] += 1
+        if not event.get('hit'):
+            env[1] += 1
+            env[2] += event.get('phases', {}).get('env', 0)
+
+        resources = event.get('resources', {})
+        if 'user' in resources:
+            builds = self.resources.setdefault(event['env'], [])
+            if not builds or not event.get('hit'):
+                builds.append([0, 0., 0])
+                del builds[:-2]
+            build = builds[-1]
+            build[0] += 1
+            build[1] += resources['user'] + resources['system']
+            build[2] = max(build[2], resources['max_rss'])
+
+    def top_envs(self, n, key='created'):
+        """
+        The n environments with the most ``runs``, or which took the most
+        time to be ``created``, as (env, runs, creations, creation seconds).
+
+        """
+        index = {'runs': 0, 'created': 2}[key]
+        envs = [item for item in self.envs.items() if item[1][index]]
+        envs.sort(key=lambda item: item[1][index], reverse=True)
+        return [(env, runs, creations, seconds)
+                for env, (runs, creations, seconds) in envs[:n]]
+
+    def top_resources(self, n):
+        """
+        The n environments whose scripts' CPU time or peak memory grew the
+        most when the environment was last (re)built, followed by those using
+        the most memory, as (env, runs, mean CPU seconds, peak resident set
+        size, CPU change, peak memory change) since the last build. The
+        changes are ratios to the previous build, or None if there wasn't one.
+
+        """
+        envs = []
+        for env, builds in self.resources.items():
+            runs, cpu, max_rss = builds[-1]
+            cpu_change = rss_change = None
+            if len(builds) == 2:
+                previous_runs, previous_cpu, previous_max_rss = builds[0]
+                if previous_cpu:
+                    cpu_change = (cpu / runs) / (previous_cpu / previous_runs)
+                if previous_max_rss:
+                    rss_change = max_rss / previous_max_rss
+            envs.append((env, runs, cpu / runs, max_rss, cpu_change, rss_change))
+        envs.sort(key=lambda item: (max(item[4] or 0, item[5] or 0), item[3]), reverse=True)
+        return envs[:n]
@@ -1,7 +1,10 @@
 from __future__ import print_function
 
 import argparse
+import collections
+import errno
 from io import StringIO
+import json
 import logging
 import os
 import platform
@@ -10,24 +13,129 @@ import shutil
 import stat
 import subprocess
 import re
-import requests
+import threading
+import time
 
 import psutil
 import yaml
 
 import conda_execute.config
+import conda_execute.events
+import conda_execute.remote
+import conda_execute.usage
 from conda_execute.tmpenv import (cleanup_tmp_envs, register_env_usage,
-                                  create_env)
+                                  create_env, env_is_complete, find_env,
+                                  parse_duration, parse_pin, plan_env, recently_verified,
+                                  update_retention)
 
 
 log = logging.getLogger('conda-execute')
 log.addHandler(logging.NullHandler())
 
 
-def extract_spec(fh):
+# Values which must be left to YAML to interpret: anything that starts with
+# an indicator character or a digit (i.e. could be a number or a date).
+_YAML_SPECIAL = re.compile(r'''^[-?:,\[\]{}#&*!|>'"%@`.~+=<]|^\d''')
+_YAML_KEYWORDS = set(['yes', 'no', 'true', 'false', 'on', 'off', 'null'])
+_SPEC_KEY = re.compile(r'^([A-Za-z_][\w-]*):(?:\s+(.*))?$')
+
+
+def _plain_scalar(value):
+    """
+    Return the string that the given simple YAML scalar represents, or None
+    if YAML is needed to interpret it.
+
+    """
+    if (len(value) >= 2 and value[0] == value[-1] and value[0] in '\'"' and
+            not re.search(r'''[\\'"]''', value[1:-1])):
+        return value[1:-1]
+    if (not value or _YAML_SPECIAL.match(value) or value.lower() in _YAML_KEYWORDS or
+            ': ' in value or ' #' in value or value.endswith(':')):
+        return None
+    return value
+
+
+def _parse_simple_spec(lines):
+    """
+    Parse the common forms of spec (a mapping of keys to plain strings, flow
+    lists or block lists of plain strings) without YAML. Returns None if the
+    spec uses anything more complex.
+
+    """
+    spec = {}
+    key = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('- ') and key is not None:
+            item = _plain_scalar(line[2:].strip())
+            if item is None:
+                return None
+            if spec[key] is None:
+                spec[key] = []
+            elif not isinstance(spec[key], list):
+                return None
+            spec[key].append(item)
+            continue
+
+        match = _SPEC_KEY.match(line)
+        if match is None:
+            return None
+        key, value = match.groups()
+        if not value:
+            spec[key] = None
+        elif value.startswith('[') and value.endswith(']'):
+            inner = value[1:-1].strip()
+            items = [_plain_scalar(item.strip()) for item in inner.split(',')] if inner else []
+            if None in items or re.search(r'[\[\]{}]', inner):
+                return None
+            spec[key] = items
+            # Block list items can't follow a flow list.
+            key = None
+        else:
+            value = _plain_scalar(value)
+            if value is None:
+                return None
+            spec[key] = value
+            key = None
+    return spec
+
+
+def parse_spec(lines):
+    """
+    Parse the lines of a "# conda execute" block (with the comment
+    characters removed) into a spec dictionary.
+
+    """
+    spec = _parse_simple_spec(lines)
+    if spec is None:
+        # Fall back to the (much faster) C loader, where it is available.
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        spec = yaml.load(StringIO(u'\n'.join(lines)), Loader=loader)
+    return spec or {}
+
+
+def extract_spec(fh, max_lines=None, max_bytes=None):
+    """
+    Extract the spec from the "# conda execute" header of the given file (or
+    iterable of lines).
+
+    The search for the header stops once ``max_lines`` lines or ``max_bytes``
+    bytes (defaulting to the ``spec-header-max-lines`` and
+    ``spec-header-max-bytes`` config) have been read without finding it, and
+    reading stops at the first non-comment line after it, so that large
+    scripts needn't be read in full.
+
+    """
+    if max_lines is None:
+        max_lines = conda_execute.config.spec_header_max_lines
+    if max_bytes is None:
+        max_bytes = conda_execute.config.spec_header_max_bytes
     spec = []
     in_spec = False
     shebang = []
+    n_bytes = 0
 
     for i, line in enumerate(fh):
         if i == 0:
@@ -41,8 +149,14 @@ def extract_spec(fh):
             spec.append(line.strip(' #\n'))
         elif line.strip() in ['# conda execute', '# conda execute:']:
             in_spec = True
+        else:
+            n_bytes += len(line)
+            if i + 1 >= max_lines or n_bytes >= max_bytes:
+                log.debug('No "# conda execute" header found in the first {} lines '
+                          '({} bytes).'.format(i + 1, n_bytes))
+                break
 
-    spec = yaml.safe_load(StringIO(u'\n'.join(spec))) or {}
+    spec = parse_spec(spec)
     if 'run_with' in spec:
         if not isinstance(spec['run_with'], list):
             spec['run_with'] = spec['run_with'].split()
@@ -73,25 +187,231 @@ def read_shebang(line):
     return shebang
 
 
-def execute(path, force_env=False, arguments=()):
-    with open(path, 'r') as fh:
-        spec = extract_spec(fh)
+def plan(path, spec=None, env_prefix=None):
+    """
+    Predict the cost of executing the script at the given path, without
+    executing it or building its environment (see
+    :func:`conda_execute.tmpenv.plan_env`).
 
+    """
+    if spec is None:
+        with open(path, 'r') as fh:
+            spec = extract_spec(fh)
     env_spec = spec.get('env', [])
     if not env_spec:
         raise RuntimeError("No environment was found in the '# conda execute' "
                            "specification.")
-    log.info('Using specification: \n{}'.format(yaml.dump(spec)))
+    return plan_env(env_spec, spec.get('channels', []), env_prefix)
+
+
+_PYTHON = re.compile(r'^python[\d.]*(\.exe)?$')
+
+# The options of env which take their argument separately (e.g. "env -u NAME python").
+_ENV_OPTIONS_WITH_ARGUMENT = ['-u', '--unset', '-C', '--chdir']
 
-    env_prefix = create_env(env_spec, force_env, spec.get('channels', []))
-    log.info('Prefix: {}'.format(env_prefix))
 
-    return execute_within_env(env_prefix, spec['run_with'] + [path] + list(arguments))
+# Run (with python -c) in the script's environment to profile it: the
+# arguments are the profiler, the output path (without extension), the
+# script, and the script's arguments.
+_PROFILE_BOOTSTRAP = '''
+import os, runpy, sys
+profiler_name, output, script = sys.argv[1:4]
+sys.argv = sys.argv[3:]
+sys.path[0] = os.path.dirname(os.path.abspath(script))
+if profiler_name == 'tracemalloc':
+    import tracemalloc
+    tracemalloc.start(25)
+    try:
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot.dump(output + '.tracemalloc')
+        with open(output + '.txt', 'w') as fh:
+            fh.write('Peak traced memory: {:.1f} MiB\\n'.format(peak / 1024. ** 2))
+            for stat in snapshot.statistics('lineno')[:30]:
+                fh.write('{}\\n'.format(stat))
+else:
+    import cProfile, pstats
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(runpy.run_path, script, run_name='__main__')
+    finally:
+        profiler.dump_stats(output + '.pstats')
+        with open(output + '.txt', 'w') as fh:
+            pstats.Stats(output + '.pstats', stream=fh).sort_stats('cumulative').print_stats(30)
+'''
+
+
+def _profile_command(run_with, path, arguments, profiler, output):
+    """
+    The command which runs the script under the given profiler (``cprofile``
+    or ``tracemalloc``), writing the profile to output plus ``.pstats`` or
+    ``.tracemalloc``, and a summary of the top functions to output plus
+    ``.txt``. Returns None if the script isn't run directly by Python.
+
+    """
+    interpreter = 0
+    if os.path.basename(run_with[0]) == 'env':
+        # e.g. "#!/usr/bin/env python": skip env's options and variable assignments.
+        interpreter = 1
+        while interpreter < len(run_with) and (run_with[interpreter].startswith('-') or
+                                               '=' in run_with[interpreter]):
+            if run_with[interpreter] in _ENV_OPTIONS_WITH_ARGUMENT:
+                interpreter += 1
+            interpreter += 1
+    if interpreter >= len(run_with):
+        return None
+    options = run_with[interpreter + 1:]
+    if (not _PYTHON.match(os.path.basename(run_with[interpreter])) or
+            any(not option.startswith('-') or option in ['-m', '-c'] for option in options)):
+        return None
+    return list(run_with) + ['-c', _PROFILE_BOOTSTRAP, profiler, output, path] + list(arguments)
+
+
+def _profile_output(path):
+    if path.startswith('/proc/'):
+        # Code run from an anonymous file.
+        name = 'code'
+    else:
+        name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.abspath('{}.{}'.format(name, time.strftime('%Y%m%d-%H%M%S')))
+
+
+def format_resources(resources):
+    """
+    A human readable summary of the resources used by a script (as
+    collected by :func:`execute_within_env`).
+
+    """
+    lines = ['Wall clock time: {:.3f}s'.format(resources['wall'])]
+    if 'user' in resources:
+        lines.extend(['User CPU time: {:.3f}s'.format(resources['user']),
+                      'System CPU time: {:.3f}s'.format(resources['system']),
+                      'Peak resident set size: {:.1f} MiB'.format(resources['max_rss'] / 1024. ** 2),
+                      'Block I/O operations: {} in, {} out'.format(resources['blocks_in'],
+                                                                  resources['blocks_out']),
+                      'Context switches: {} voluntary, {} involuntary'.format(
+                          resources['voluntary_switches'], resources['involuntary_switches'])])
+    return '\n'.join(lines)
+
+
+def _write_timings(output, resources):
+    """
+    Add the resource usage of the script to the start of the summary at
+    output plus ``.txt``.
+
+    """
+    summary = ''
+    if os.path.exists(output + '.txt'):
+        with open(output + '.txt', 'r') as fh:
+            summary = '\n' + fh.read()
+    with open(output + '.txt', 'w') as fh:
+        fh.write(format_resources(resources) + '\n' + summary)
+
+
+def execute(path, force_env=False, arguments=(), spec=None, env_prefix=None,
+            pass_fds=(), profile=None, timings=False):
+    """
+    Execute the script at the given path in its temporary environment.
+
+    The spec extracted from the script and the prefix of its environment may
+    be passed if they are already known (e.g. cached alongside a remote script).
+    Any file descriptors which the path refers to (e.g. ``/proc/self/fd/N``)
+    must be passed so that they are inherited by the script's process.
+
+    If profile is given (``cprofile`` or ``tracemalloc``), a Python script is
+    run under that profiler, and the profile and a summary of it are written
+    to the current directory. Scripts not run with Python are only timed.
+
+    The execution, and the resources used by the script, are recorded in the
+    event log (see :mod:`conda_execute.events`). If timings is True, they are
+    also reported on stderr.
+
+    """
+    event = {'time': time.time(), 'phases': {}}
+    try:
+        return _execute(path, force_env, arguments, spec, env_prefix, pass_fds, profile,
+                        timings, event)
+    except Exception as exception:
+        event['error'] = type(exception).__name__
+        raise
+    finally:
+        conda_execute.events.record_event(event)
 
 
-def execute_within_env(env_prefix, cmd):
-    register_env_usage(env_prefix)
+def _execute(path, force_env, arguments, spec, env_prefix, pass_fds, profile, timings,
+             event):
+    phase_start = time.time()
+    if spec is None:
+        with open(path, 'r') as fh:
+            spec = extract_spec(fh)
+        event['phases']['spec'] = time.time() - phase_start
+        phase_start = time.time()
 
+    env_spec = spec.get('env', [])
+    if not env_spec:
+        raise RuntimeError("No environment was found in the '# conda execute' "
+                           "specification.")
+    if spec.get('keep_for') is not None:
+        # Fail early on a malformed duration.
+        parse_duration(spec['keep_for'])
+    # And pin.
+    parse_pin(spec.get('pin'))
+    log.info('Using specification: \n{}'.format(yaml.dump(spec)))
+
+    if env_prefix is None:
+        env_prefix = find_env(env_spec, spec.get('channels', []))
+    event['env'] = os.path.basename(env_prefix)
+    event['hit'] = (not force_env and env_is_complete(env_prefix) and
+                    recently_verified(env_prefix))
+    if not event['hit']:
+        env_prefix = create_env(env_spec, force_env, spec.get('channels', []),
+                                timings=event['phases'])
+    log.info('Prefix: {}'.format(env_prefix))
+    conda_execute.usage.record_usage(env_prefix, env_spec, spec.get('channels', []))
+    update_retention(env_prefix, spec.get('keep_for'), spec.get('pin'))
+    event['phases']['env'] = time.time() - phase_start
+
+    cmd = spec['run_with'] + [path] + list(arguments)
+    if profile:
+        output = _profile_output(path)
+        profile_cmd = _profile_command(spec['run_with'], path, arguments, profile, output)
+        if profile_cmd is None:
+            log.warn('The script is not run with Python, so it can only be timed.')
+        else:
+            cmd = profile_cmd
+
+    phase_start = time.time()
+    event['startup'] = phase_start - psutil.Process().create_time()
+    event['resources'] = {}
+    event['code'] = execute_within_env(env_prefix, cmd, pass_fds=pass_fds,
+                                       resources=event['resources'])
+    event['phases']['run'] = time.time() - phase_start
+
+    import sys
+    if profile:
+        _write_timings(output, event['resources'])
+        written = [output + extension for extension in ['.pstats', '.tracemalloc', '.txt']
+                   if os.path.exists(output + extension)]
+        print('Profile written to {}'.format(', '.join(written)), file=sys.stderr)
+    if timings:
+        print('Startup time: {:.3f}s ({})'.format(
+            event['startup'], ', '.join('{} {:.3f}s'.format(phase, event['phases'][phase])
+                                        for phase in ['spec', 'env', 'solve']
+                                        if phase in event['phases'])), file=sys.stderr)
+        print(format_resources(event['resources']), file=sys.stderr)
+    return event['code']
+
+
+def command_environment(env_prefix, cmd):
+    """
+    Return the command (with its executable found in the environment, on
+    Windows) and the environment variables with which to run it within the
+    environment at env_prefix.
+
+    """
+    cmd = list(cmd)
     if platform.system() == 'Windows':
         import distutils.spawn
         paths = [os.path.join(env_prefix),
@@ -107,19 +427,260 @@ def execute_within_env(env_prefix, cmd):
     environ = os.environ.copy()
     environ["PATH"] = full_path
     environ["PREFIX"] = env_prefix
-
-    # The default is a non-zero return code. Successful processes will set this themselves.
-    code = 42
+    return cmd, environ
+
+
+def _wait(process):
+    """
+    Wait for the process to exit, returning its return code and its
+    resource usage (or None, where os.wait4 isn't available).
+
+    """
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+    while True:
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+            break
+        except OSError as exception:
+            # Python < 3.5 doesn't retry system calls interrupted by a signal.
+            if exception.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return process.returncode, rusage
+
+
+def _resources(rusage):
+    """
+    The resources (see :func:`run_within_env`) of the resource usage
+    returned by :func:`_wait`, other than the wall clock time.
+
+    """
+    if rusage is None:
+        return {}
+    return {'user': rusage.ru_utime, 'system': rusage.ru_stime,
+            # Kilobytes, other than on macOS.
+            'max_rss': rusage.ru_maxrss * (1 if platform.system() == 'Darwin' else 1024),
+            'blocks_in': rusage.ru_inblock, 'blocks_out': rusage.ru_oublock,
+            'voluntary_switches': rusage.ru_nvcsw, 'involuntary_switches': rusage.ru_nivcsw}
+
+
+class RingBuffer(object):
+    def __init__(self, max_bytes=64 * 1024):
+        """
+        A sink for the output of a command which keeps only the last
+        max_bytes written to it.
+
+        """
+        self.max_bytes = max_bytes
+        #: The number of bytes which have been discarded.
+        self.discarded = 0
+        self._chunks = collections.deque()
+        self._size = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            excess = self._size - self.max_bytes
+            if len(self._chunks[0]) <= excess:
+                excess = len(self._chunks.popleft())
+            else:
+                self._chunks[0] = self._chunks[0][excess:]
+            self._size -= excess
+            self.discarded += excess
+
+    def getvalue(self):
+        return b''.join(self._chunks)
+
+
+class ExecutionResult(object):
+    def __init__(self, code=None, error=None, resources=None, phases=None,
+                 stdout=None, stderr=None):
+        """
+        The outcome of running a command: its return code, or (if it
+        couldn't be started) None and the exception which prevented it; the
+        resources it used (see :func:`run_within_env`); the seconds spent
+        in each phase of the execution (where known, see
+        :mod:`conda_execute.events`); and the stdout and stderr sinks given
+        (e.g. :class:`RingBuffer` instances).
+
+        """
+        self.code = code
+        self.error = error
+        self.resources = resources if resources is not None else {}
+        self.phases = phases if phases is not None else {}
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def __repr__(self):
+        return '<ExecutionResult code={!r} error={!r}>'.format(self.code, self.error)
+
+
+# The longest line passed to an output callback. Longer lines are passed on in pieces.
+_MAX_LINE = 64 * 1024
+
+
+def _sink(target):
+    """The callable to which to pass each line of output, if any."""
+    if target is None or callable(target):
+        return target
+    return target.write
+
+
+def _pump(pipe, sink, errors):
+    """
+    Pass each line read from the pipe to the sink. Should the sink fail,
+    the failure is kept in errors and the rest of the output is discarded
+    (so that the command isn't blocked on a full pipe).
+
+    """
+    with pipe:
+        for line in iter(lambda: pipe.readline(_MAX_LINE), b''):
+            if sink is None:
+                continue
+            try:
+                sink(line)
+            except Exception as exception:
+                errors.append(exception)
+                sink = None
+
+
+def run_within_env(env_prefix, cmd, pass_fds=(), stdout=None, stderr=None, register_usage=True):
+    """
+    Run the command in the environment, returning an
+    :class:`ExecutionResult`.
+
+    The output of the command is inherited unless stdout or stderr is given:
+    a callable, called with each line of the output (as bytes), or a binary
+    file-like object (e.g. a :class:`RingBuffer`, or a file opened with
+    ``'wb'``) to which the output is written. Either way, the output is
+    never held in memory in full.
+
+    The resources used by the command are the ``wall`` clock time and (on
+    Unix) the ``user`` and ``system`` CPU time, in seconds, the peak
+    resident set size (``max_rss``, in bytes), the block I/O operations
+    (``blocks_in`` and ``blocks_out``) and the context switches
+    (``voluntary_switches`` and ``involuntary_switches``).
+
+    A command which can't be started (e.g. because it isn't found) is
+    reported as the result's error, rather than raised.
+
+    The usage of the environment is registered (see
+    :func:`conda_execute.tmpenv.register_env_usage`) unless the caller has
+    already done so.
+
+    """
+    if register_usage:
+        register_env_usage(env_prefix)
+    cmd, environ = command_environment(env_prefix, cmd)
+    result = ExecutionResult(stdout=stdout, stderr=stderr)
+    sinks = [_sink(stdout), _sink(stderr)]
+
+    start = time.time()
+    log.debug('Running command: {}'.format(cmd))
+    kwargs = {'pass_fds': pass_fds} if pass_fds else {}
     try:
-        log.debug('Running command: {}'.format(cmd))
-        code = subprocess.check_call(cmd, env=environ)
-    except subprocess.CalledProcessError as exception:
-        code = exception.returncode
-        log.warn('{}: {}'.format(type(exception).__name__, exception))
+        process = subprocess.Popen(cmd, env=environ,
+                                   stdout=subprocess.PIPE if sinks[0] else None,
+                                   stderr=subprocess.PIPE if sinks[1] else None, **kwargs)
     except Exception as exception:
-        log.warn('{}: {}'.format(type(exception).__name__, exception))
+        result.error = exception
+        result.resources['wall'] = time.time() - start
+        return result
+
+    errors = []
+    pumps = [threading.Thread(target=_pump, args=(pipe, sink, errors))
+             for pipe, sink in zip([process.stdout, process.stderr], sinks) if pipe is not None]
+    for pump in pumps:
+        pump.daemon = True
+        pump.start()
+    try:
+        result.code, rusage = _wait(process)
+    except BaseException:
+        # As subprocess.call does, e.g. on KeyboardInterrupt.
+        process.kill()
+        process.wait()
+        raise
     finally:
-        return code
+        for pump in pumps:
+            pump.join()
+    result.resources['wall'] = time.time() - start
+    result.resources.update(_resources(rusage))
+    if errors:
+        raise errors[0]
+    return result
+
+
+def execute_within_env(env_prefix, cmd, pass_fds=(), resources=None):
+    """
+    Run the command in the environment, with its output inherited,
+    returning its return code (42 if it couldn't be started).
+
+    If a resources dictionary is given, the resources used by the command
+    (see :func:`run_within_env`) are stored in it.
+
+    """
+    result = run_within_env(env_prefix, cmd, pass_fds=pass_fds)
+    if resources is not None:
+        resources.update(result.resources)
+    if result.error is not None:
+        log.warn('{}: {}'.format(type(result.error).__name__, result.error))
+        return 42
+    if result.code:
+        log.warn('Command {} returned non-zero exit status {}'.format(cmd, result.code))
+    return result.code
+
+
+def _fetch_remote_script(url):
+    """
+    Return the cached path and spec of the remote script, downloading it
+    only if it has changed. (The environment isn't cached with the spec, as
+    it depends on the env-dir, and which environments exist, at the time.)
+
+    """
+    path, entry = conda_execute.remote.fetch_script(url)
+    if 'spec' not in entry:
+        with open(path, 'r') as fh:
+            entry['spec'] = extract_spec(fh)
+        conda_execute.remote.write_entry(url, entry)
+    return path, entry['spec']
+
+
+# Not (yet) exposed by the os module.
+_MFD_EXEC = 0x0010
+
+
+def _write_code_to_memfd(code):
+    """
+    Write the code to an anonymous in-memory file, returning the path by
+    which a child process can read it (``/proc/self/fd/N``) and the file
+    descriptor, which must be passed on to the child.
+
+    Returns None where anonymous files aren't supported (anything but Linux,
+    or Python < 3.8).
+
+    """
+    if not hasattr(os, 'memfd_create') or not os.path.isdir('/proc/self/fd'):
+        return None
+    try:
+        # Explicitly request an executable file, as kernels may be configured
+        # to default to non-executable anonymous files.
+        fd = os.memfd_create('conda-execute', os.MFD_CLOEXEC | _MFD_EXEC)
+    except OSError:
+        try:
+            # Kernels older than 6.3 reject the MFD_EXEC flag.
+            fd = os.memfd_create('conda-execute')
+        except OSError:
+            return None
+    data = code.encode('utf-8')
+    while data:
+        data = data[os.write(fd, data):]
+    log.info('Writing temporary code to anonymous file descriptor {}'.format(fd))
+    return '/proc/self/fd/{}'.format(fd), fd
 
 
 def _write_code_to_disk(code):
@@ -138,6 +699,18 @@ def main():
     parser.add_argument('path', nargs='?',
                         help='The script to execute.')
     parser.add_argument('--force-env', '-f', help='Force re-creation of the environment, even if it already exists.', action='store_true')
+    parser.add_argument('--profile', nargs='?', const='cprofile', default=None,
+                        metavar='{cprofile,tracemalloc}',
+                        help=('Run the script under the given profiler (default cprofile), writing the '
+                              'profile and a summary of it to the current directory. Scripts not run '
+                              'with Python are only timed.'))
+    parser.add_argument('--timings', action='store_true',
+                        help=('Report the time taken to start the script, and the resources (CPU time, '
+                              'peak memory, I/O, context switches) it used, on stderr.'))
+    parser.add_argument('--plan', action='store_true',
+                        help=('Rather than executing the script, print (as JSON) whether its environment '
+                              'is ready ("warm"), has packages known without solving ("solve-cached") '
+                              'or must be created ("cold"), and the packages which would be fetched.'))
 
     quiet_or_verbose = parser.add_mutually_exclusive_group()
     quiet_or_verbose.add_argument('--verbose', '-v', help='Turn on verbose output.', action='store_true')
@@ -167,31 +740,50 @@ def main():
 
     # Configure the logging as desired.
     conda_execute.config.setup_logging(log_level)
+    conda_execute.config.cache_conda_settings()
     log.debug('Arguments passed: {}'.format(args))
 
+    if args.profile not in [None, 'cprofile', 'tracemalloc']:
+        # A bare --profile followed by the script, which argparse took as the profiler.
+        if args.path is not None:
+            args.remaining_args.insert(0, args.path)
+        args.path, args.profile = args.profile, 'cprofile'
+
     exit_actions = []
+    spec = None
+    pass_fds = ()
 
     try:
         if args.code:
-            path = _write_code_to_disk(args.code)
-            # Queue the temporary file up for cleaning.
-            exit_actions.append(lambda: os.remove(path))
-        elif args.path:
-            # check to see if `args.path` is a remote path, download whatever
-            # is at that remote location and stash it as args.code.
-            if args.path.startswith('http'):
-                # download code from the remote path and write it to disk
-                code = requests.get(args.path).content.decode()
+            code = ''.join(args.code)
+            spec = extract_spec(code.splitlines(True))
+            in_memory = _write_code_to_memfd(code)
+            if in_memory:
+                path, fd = in_memory
+                pass_fds = (fd, )
+                exit_actions.append(lambda: os.close(fd))
+            else:
                 path = _write_code_to_disk(code)
                 # Queue the temporary file up for cleaning.
                 exit_actions.append(lambda: os.remove(path))
+        elif args.path:
+            # check to see if `args.path` is a remote path, and if so use the
+            # (revalidated) cached copy of whatever is at that remote location.
+            if args.path.startswith('http'):
+                path, spec = _fetch_remote_script(args.path)
             else:
                 path = os.path.abspath(args.path)
         else:
             raise ValueError('Either pass the filename to execute, or pipe with -c.')
 
+        if args.plan:
+            print(json.dumps(plan(path, spec=spec), indent=2, sort_keys=True))
+            exit(0)
+
         exit_actions.append(cleanup_tmp_envs)
-        exit(execute(path, force_env=args.force_env, arguments=args.remaining_args))
+        exit(execute(path, force_env=args.force_env, arguments=args.remaining_args,
+                     spec=spec, pass_fds=pass_fds,
+                     profile=args.profile, timings=args.timings))
     finally:
         for action in exit_actions:
             action()
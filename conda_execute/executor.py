@@ -0,0 +1,336 @@
+"""
+A long-lived, thread-safe, interface to conda execute for services which
+execute many scripts from one process.
+
+An :class:`Executor` keeps the parsed specs of scripts (until they change),
+the locations of their environments (until those are removed) and the
+package indexes of channels (for ``index_max_age`` seconds) across
+executions, so that executing a script whose environment is already built
+costs little more than starting the script::
+
+    executor = Executor(env_dir='/srv/envs', channels=['conda-forge'])
+    code = executor.run('job.py', ['--verbose'])
+
+    # Capture the last 64KB of the output, rather than inheriting it.
+    result = executor.execute('job.py', stdout=RingBuffer(64 * 1024))
+    print(result.code, result.phases, result.resources, result.stdout.getvalue())
+
+"""
+import collections
+import contextlib
+import hashlib
+import os
+import threading
+import time
+
+import conda_execute.config
+import conda_execute.events
+import conda_execute.solver
+import conda_execute.usage
+from conda_execute.execute import (ExecutionResult, RingBuffer, _write_code_to_disk,
+                                   _write_code_to_memfd, extract_spec, run_within_env)
+from conda_execute.tmpenv import (canonical_specs, cleanup_tmp_envs, create_env,
+                                  env_is_complete, find_env, parse_duration, parse_pin,
+                                  recently_verified, register_env_usage, update_retention)
+
+
+# Environments are provisioned while an executor's configuration is applied
+# to conda_execute.config. Executors of the same configuration share it (and
+# so provision concurrently), while one of another configuration waits until
+# it is no longer in use.
+_config_condition = threading.Condition()
+_applied_config = {'config': None, 'users': 0, 'original': None}
+
+
+@contextlib.contextmanager
+def _code_file(source):
+    """
+    Write the source code to an anonymous in-memory file (or, where those
+    aren't supported, a temporary file), yielding its path and the file
+    descriptors to pass on to the process which runs it.
+
+    """
+    in_memory = _write_code_to_memfd(source)
+    if in_memory:
+        path, fd = in_memory
+        try:
+            yield path, (fd, )
+        finally:
+            os.close(fd)
+    else:
+        path = _write_code_to_disk(source)
+        try:
+            yield path, ()
+        finally:
+            os.remove(path)
+
+
+def _code(result):
+    if result.error is not None:
+        raise result.error
+    return result.code
+
+
+class Executor(object):
+    def __init__(self, env_dir=None, pkg_dir=None, channels=(), verify_envs=None,
+                 verify_interval=None, index_max_age=5 * 60, max_cached_specs=1024):
+        """
+        Executes scripts in their temporary environments.
+
+        The env_dir and pkg_dir, and whether (and how often, in seconds) the
+        environments are verified, default to the ``conda-execute`` config.
+        The channels are used, after those of its spec, for every
+        environment. The package index of a set of channels is reused for
+        index_max_age seconds, and the specs of the max_cached_specs most
+        recently executed scripts are kept.
+
+        An env_dir other than the configured one has its own archive
+        directory, script cache and event log (see
+        :func:`conda_execute.config.env_dir_settings`).
+
+        Environments are created concurrently, except by executors of
+        another configuration (env_dir, pkg_dir and verification), which
+        wait until none are being created with this one. The lookup of
+        environments which are already built, and the scripts themselves,
+        are never held up.
+
+        """
+        config = conda_execute.config
+        self._config = config.env_dir_settings(env_dir or config.env_dir)
+        self._config.update({
+            'shared_env_dirs': list(config.shared_env_dirs),
+            'pkg_dir': os.path.normpath(os.path.expanduser(pkg_dir)) if pkg_dir else config.pkg_dir,
+            'verify_envs': config.verify_envs if verify_envs is None else verify_envs,
+            'verify_interval': config.verify_interval if verify_interval is None else verify_interval,
+        })
+        self.channels = list(channels)
+        self.index_max_age = index_max_age
+        self.max_cached_specs = max_cached_specs
+
+        self._lock = threading.Lock()
+        # Specs, least recently used first, keyed by path (or code hash).
+        self._specs = collections.OrderedDict()
+        self._envs = {}
+        self._indexes = {}
+
+    @contextlib.contextmanager
+    def _configured(self):
+        config = conda_execute.config
+        with _config_condition:
+            while _applied_config['users'] and _applied_config['config'] != self._config:
+                _config_condition.wait()
+            if not _applied_config['users']:
+                _applied_config['original'] = dict((name, getattr(config, name))
+                                                   for name in self._config)
+                for name, value in self._config.items():
+                    setattr(config, name, value)
+                _applied_config['config'] = dict(self._config)
+            _applied_config['users'] += 1
+        try:
+            yield
+        finally:
+            with _config_condition:
+                _applied_config['users'] -= 1
+                if not _applied_config['users']:
+                    for name, value in _applied_config['original'].items():
+                        setattr(config, name, value)
+                    _applied_config['config'] = _applied_config['original'] = None
+                    _config_condition.notify_all()
+
+    def _channels(self, channels):
+        combined = []
+        for channel in list(channels) + self.channels:
+            if channel not in combined:
+                combined.append(channel)
+        return combined
+
+    def _cached_spec(self, key, stamp):
+        with self._lock:
+            cached = self._specs.pop(key, None)
+            if cached is None or cached[0] != stamp:
+                return None
+            self._specs[key] = cached
+            return cached[1]
+
+    def _cache_spec(self, key, stamp, spec):
+        with self._lock:
+            self._specs.pop(key, None)
+            self._specs[key] = (stamp, spec)
+            while len(self._specs) > self.max_cached_specs:
+                self._specs.popitem(last=False)
+
+    def _spec(self, path):
+        """The spec of the script at path, parsed again only if it has changed."""
+        stat = os.stat(path)
+        stamp = (stat.st_mtime, stat.st_size)
+        spec = self._cached_spec(path, stamp)
+        if spec is None:
+            with open(path, 'r') as fh:
+                spec = extract_spec(fh)
+            self._cache_spec(path, stamp, spec)
+        return spec
+
+    def _index(self, channels):
+        with self._lock:
+            cached = self._indexes.get(tuple(channels))
+        if cached is not None and time.time() - cached[0] < self.index_max_age:
+            return cached[1]
+        index = conda_execute.solver.get_backend().get_index(channels)
+        with self._lock:
+            self._indexes[tuple(channels)] = (time.time(), index)
+        return index
+
+    def _is_warm(self, env_prefix):
+        return env_is_complete(env_prefix) and recently_verified(
+            env_prefix, self._config['verify_envs'], self._config['verify_interval'])
+
+    def ensure_env(self, spec, channels=()):
+        """
+        Return the prefix of the environment of the given spec (a list of
+        package specifications) and channels, creating it if need be.
+
+        """
+        return self._ensure_env(spec, channels)[0]
+
+    def _ensure_env(self, spec, channels, timings=None):
+        """
+        Return the prefix of the environment, and whether it was already
+        built (rather than being created, restored or repaired).
+
+        """
+        channels = self._channels(channels)
+        key = (canonical_specs(spec), tuple(channels))
+        with self._lock:
+            env_prefix = self._envs.get(key)
+        if env_prefix is not None and self._is_warm(env_prefix):
+            return env_prefix, True
+
+        with self._configured():
+            env_prefix = find_env(spec, channels)
+            hit = self._is_warm(env_prefix)
+            if not hit:
+                # The index is only loaded if the environment must be solved or repaired.
+                env_prefix = create_env(spec, extra_channels=channels, timings=timings,
+                                        load_index=self._index)
+        with self._lock:
+            self._envs[key] = env_prefix
+        return env_prefix, hit
+
+    def execute(self, path, args=(), stdout=None, stderr=None):
+        """
+        Execute the script at the given path, with the given arguments, in
+        its environment, returning an :class:`ExecutionResult`. The output
+        of the script may be captured by giving stdout and stderr (see
+        :func:`conda_execute.execute.run_within_env`).
+
+        """
+        path = os.path.abspath(path)
+        event = {'time': time.time(), 'phases': {}}
+        try:
+            spec = self._spec(path)
+            event['phases']['spec'] = time.time() - event['time']
+            return self._run(path, spec, args, (), stdout, stderr, event)
+        except Exception as exception:
+            event['error'] = type(exception).__name__
+            raise
+        finally:
+            self._record_event(event)
+
+    def execute_code(self, source, args=(), stdout=None, stderr=None):
+        """
+        Execute the given source code (which has a ``# conda execute``
+        header, as a script would), as :meth:`execute` does a script.
+
+        """
+        event = {'time': time.time(), 'phases': {}}
+        try:
+            spec = self._code_spec(source)
+            event['phases']['spec'] = time.time() - event['time']
+            with _code_file(source) as (path, pass_fds):
+                return self._run(path, spec, args, pass_fds, stdout, stderr, event)
+        except Exception as exception:
+            event['error'] = type(exception).__name__
+            raise
+        finally:
+            self._record_event(event)
+
+    def run(self, path, args=()):
+        """
+        Execute the script at the given path, with the given arguments, in
+        its environment, returning its exit code (or raising the error which
+        prevented it from starting).
+
+        """
+        return _code(self.execute(path, args))
+
+    def run_code(self, source, args=()):
+        """
+        Execute the given source code, as :meth:`run` does a script.
+
+        """
+        return _code(self.execute_code(source, args))
+
+    def _code_spec(self, source):
+        """The spec of the source code, cached by its hash."""
+        code_hash = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        spec = self._cached_spec(code_hash, None)
+        if spec is None:
+            spec = extract_spec(source.splitlines(True))
+            self._cache_spec(code_hash, None, spec)
+        return spec
+
+    def _record_event(self, event):
+        # The executor's event log is given, rather than waiting to apply its configuration.
+        conda_execute.events.record_event(event, self._config['event_log'])
+
+    def _env_spec(self, spec):
+        """The environment of the spec, checking that the spec is valid."""
+        env_spec = spec.get('env', [])
+        if not env_spec:
+            raise RuntimeError("No environment was found in the '# conda execute' "
+                               "specification.")
+        if spec.get('keep_for') is not None:
+            # Fail early on a malformed duration.
+            parse_duration(spec['keep_for'])
+        # And pin.
+        parse_pin(spec.get('pin'))
+        return env_spec
+
+    def _record_usage(self, env_prefix, spec):
+        with self._configured():
+            register_env_usage(env_prefix)
+            conda_execute.usage.record_usage(env_prefix, spec['env'],
+                                             self._channels(spec.get('channels', [])))
+            update_retention(env_prefix, spec.get('keep_for'), spec.get('pin'))
+
+    def _run(self, path, spec, args, pass_fds, stdout, stderr, event):
+        env_spec = self._env_spec(spec)
+        phase_start = time.time()
+        env_prefix, event['hit'] = self._ensure_env(env_spec, spec.get('channels', []),
+                                                    timings=event['phases'])
+        event['env'] = os.path.basename(env_prefix)
+        self._record_usage(env_prefix, spec)
+        event['phases']['env'] = time.time() - phase_start
+
+        phase_start = time.time()
+        event['startup'] = phase_start - event['time']
+        cmd = spec['run_with'] + [path] + list(args)
+        result = run_within_env(env_prefix, cmd, pass_fds=pass_fds, stdout=stdout, stderr=stderr,
+                                register_usage=False)
+        event['phases']['run'] = time.time() - phase_start
+        event['resources'] = result.resources
+        if result.error is None:
+            event['code'] = result.code
+        else:
+            event['error'] = type(result.error).__name__
+        result.phases = event['phases']
+        return result
+
+    def cleanup(self):
+        """
+        Remove (or archive) the environments which are no longer in use,
+        as is done after each ``conda execute``.
+
+        """
+        with self._configured():
+            cleanup_tmp_envs()
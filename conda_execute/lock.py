@@ -1,18 +1,72 @@
+import errno
+import logging
 import os
+import re
+import threading
+import time
 
-from conda_execute.conda_interface import Locked as conda_Locked
+import psutil
 
+from conda_execute.utils import atomic_write
 
-class Locked(conda_Locked):
+
+log = logging.getLogger('conda-tmpenv')
+log.addHandler(logging.NullHandler())
+
+
+def _lock_path(directory_to_lock):
+    dirname, basename = os.path.split(directory_to_lock.rstrip(os.pathsep))
+    return os.path.join(dirname, '.conda-lock_' + basename)
+
+
+# The lock files which conda's lock creates within the lock's directory: ".conda_lock-<pid>"
+# before conda 4.2, and "<name>.pid<pid>.conda_lock" since.
+_LOCK_FILE = re.compile(r'(?:\.conda_lock-(\d+)|\.pid(\d+)\.conda_lock)$')
+
+
+def is_locked(directory_to_lock):
+    """
+    Whether a live process holds the :class:`Locked` lock of the directory.
+
+    The lock's directory is left in place once the lock is released (or
+    its holder is killed), so it is the lock files within it, named by the
+    PID of their holder, which are checked. A lock file older than the
+    process of its PID was left by another process (which has since died).
+
+    """
+    path = _lock_path(directory_to_lock)
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return False
+    for name in names:
+        match = _LOCK_FILE.search(name)
+        if match is None:
+            continue
+        pid = int(match.group(1) or match.group(2))
+        try:
+            created = psutil.Process(pid).create_time()
+            locked = os.path.getmtime(os.path.join(path, name))
+        except (OSError, psutil.NoSuchProcess):
+            continue
+        if created <= locked + 1:
+            return True
+    return False
+
+
+class Locked(object):
     def __init__(self, directory_to_lock):
         """
         Lock the given directory for use, unlike conda.lock.Lock which
         locks the directory passed, meaning you have to come up with another
         name for the directory to lock.
 
+        Wraps conda's lock, which is only imported when a lock is needed.
+
         """
-        dirname, basename = os.path.split(directory_to_lock.rstrip(os.pathsep))
-        path = os.path.join(dirname, '.conda-lock_' + basename)
+        from conda_execute.conda_interface import Locked as conda_Locked
+
+        path = _lock_path(directory_to_lock)
 
         # The implementation of conda's Locked from version 4.2 onward doesn't
         # create parent dir anymore as it did before and, not only that, it
@@ -21,4 +75,125 @@ class Locked(conda_Locked):
         if not os.path.isdir(parent_path):
             os.makedirs(parent_path)
 
-        return conda_Locked.__init__(self, path)
+        self._lock = conda_Locked(path)
+
+    def __getattr__(self, name):
+        return getattr(self._lock, name)
+
+    def __enter__(self):
+        return self._lock.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._lock.__exit__(exc_type, exc_value, traceback)
+
+
+class Semaphore(object):
+    def __init__(self, directory, slots, poll_interval=0.5):
+        """
+        A machine-wide counting semaphore of the given number of slots, each
+        slot being a file (recording the holder's PID) in the given directory.
+
+        Waiting processes queue in the order they arrived, and slots held by
+        processes which no longer exist are reclaimed.
+
+        """
+        self.directory = directory
+        self.slots = slots
+        self.poll_interval = poll_interval
+        self.slot_path = None
+
+    @staticmethod
+    def _owner():
+        # The thread distinguishes the owners within a process (e.g. an Executor's threads).
+        ps = psutil.Process()
+        return '{}, {}, {}'.format(ps.pid, int(ps.create_time()), threading.current_thread().ident)
+
+    @staticmethod
+    def _name():
+        """A name unique to the calling thread, for its ticket and staging file."""
+        return '{}-{}'.format(os.getpid(), threading.current_thread().ident)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError as exception:
+            if exception.errno != errno.ENOENT:
+                raise
+
+    @staticmethod
+    def _alive(path):
+        try:
+            with open(path, 'r') as fh:
+                # Slots taken before the thread was recorded have only the pid and creation time.
+                pid, creation_time = fh.read().split(',')[:2]
+            return int(psutil.Process(int(pid)).create_time()) == int(creation_time)
+        except (IOError, OSError, ValueError, psutil.NoSuchProcess):
+            return False
+
+    def _live_entries(self, subdir):
+        directory = os.path.join(self.directory, subdir)
+        entries = []
+        for name in sorted(os.listdir(directory)):
+            if name.startswith('.'):
+                # Entries still being written.
+                continue
+            path = os.path.join(directory, name)
+            if self._alive(path):
+                entries.append(path)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return entries
+
+    def _try_acquire(self):
+        # Write the owner to a temporary file and then hardlink it into place,
+        # so that a slot is never seen without its owner (and taken as stale).
+        tmp_path = os.path.join(self.directory, 'slots', '.tmp_{}'.format(self._name()))
+        with open(tmp_path, 'w') as fh:
+            fh.write(self._owner())
+        try:
+            for slot in range(self.slots):
+                path = os.path.join(self.directory, 'slots', 'slot-{}'.format(slot))
+                try:
+                    os.link(tmp_path, path)
+                except OSError:
+                    continue
+                return path
+        finally:
+            self._remove(tmp_path)
+
+    def __enter__(self):
+        for subdir in ['slots', 'queue']:
+            if not os.path.isdir(os.path.join(self.directory, subdir)):
+                os.makedirs(os.path.join(self.directory, subdir))
+        owner = self._owner()
+        ticket = os.path.join(self.directory, 'queue',
+                              '{:017.6f}-{}'.format(time.time(), self._name()))
+        atomic_write(ticket, owner)
+
+        last_position = None
+        try:
+            while True:
+                # Clearing out stale slots as a side effect.
+                self._live_entries('slots')
+                queue = self._live_entries('queue')
+                position = queue.index(ticket) + 1 if ticket in queue else 1
+                if position <= self.slots:
+                    self.slot_path = self._try_acquire()
+                    if self.slot_path:
+                        return self
+                if position != last_position:
+                    log.info('Waiting for one of {} environment creation slots '
+                             '(position {} in the queue)'.format(self.slots, position))
+                    last_position = position
+                time.sleep(self.poll_interval)
+        finally:
+            self._remove(ticket)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.slot_path and os.path.exists(self.slot_path):
+            os.remove(self.slot_path)
+        self.slot_path = None
@@ -0,0 +1,255 @@
+"""
+Prometheus metrics of the temporary environments and of the executions, in
+the text exposition format (e.g. for node_exporter's textfile collector).
+
+The gauges describe the current state of the env store. The counters and
+histograms are accumulated from the event log (see
+:mod:`conda_execute.events`), which is read incrementally from where the
+previous collection left off, so the counters don't reset when the log is
+rotated. The accumulated totals, and the sizes of the environments and of the
+pkg_dir (which are only recomputed once changed), are kept in
+``<env_dir>/.metrics/state.json``, so that collecting the metrics costs little
+more than reading the execution logs of the environments.
+
+"""
+import json
+import logging
+import os
+import time
+
+import conda_execute.archive
+import conda_execute.config
+import conda_execute.events
+from conda_execute.lock import Locked
+from conda_execute.utils import atomic_write
+
+
+log = logging.getLogger('conda-tmpenv')
+log.addHandler(logging.NullHandler())
+
+
+_STARTUP_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+_SOLVE_BUCKETS = [0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+
+def _state_file():
+    return os.path.join(conda_execute.config.env_dir, '.metrics', 'state.json')
+
+
+def _read_state():
+    try:
+        with open(_state_file(), 'r') as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _observe(state, name, labels, buckets, value):
+    key = json.dumps([name, labels], sort_keys=True)
+    histogram = state['histograms'].setdefault(key, {'buckets': [0] * len(buckets),
+                                                     'sum': 0., 'count': 0})
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            histogram['buckets'][i] += 1
+    histogram['sum'] += value
+    histogram['count'] += 1
+
+
+def _count(state, name, labels, increment=1):
+    key = json.dumps([name, labels], sort_keys=True)
+    state['counters'][key] = state['counters'].get(key, 0) + increment
+
+
+def _accumulate_events(state):
+    """Add the events logged since the last collection to the totals."""
+    state.setdefault('counters', {})
+    state.setdefault('histograms', {})
+    position = state.setdefault('position', {})
+    for event in conda_execute.events.tail_events(position):
+        phases = event.get('phases', {})
+        cache = 'hit' if event.get('hit') else 'miss'
+        _count(state, 'conda_execute_runs_total', {'cache': cache})
+        if event.get('error'):
+            _count(state, 'conda_execute_failures_total', {'reason': 'error'})
+        elif event.get('code'):
+            _count(state, 'conda_execute_failures_total', {'reason': 'exit_code'})
+        if cache == 'miss' and 'env' in event:
+            _count(state, 'conda_execute_env_creations_total', {})
+        if 'solve' in phases:
+            _count(state, 'conda_execute_solves_total', {})
+            _observe(state, 'conda_execute_solve_seconds', {}, _SOLVE_BUCKETS, phases['solve'])
+        if 'startup' in event:
+            _observe(state, 'conda_execute_startup_seconds', {'cache': cache},
+                     _STARTUP_BUCKETS, event['startup'])
+
+
+def _cached_size(cache, key, path, mtime, compute):
+    """The size from the cache, if path hasn't changed since it was computed."""
+    cached = cache.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = [mtime, compute(path)]
+    return cached
+
+
+def _env_size(env_prefix):
+    """
+    The size of the files linked into the environment, as recorded in its
+    manifest (counting each hardlinked file once), or by walking the
+    environment if it has no manifest.
+
+    """
+    from conda_execute.tmpenv import read_manifest
+
+    manifest = read_manifest(env_prefix)
+    if manifest is None:
+        return conda_execute.archive.disk_usage(env_prefix)
+    inodes = {}
+    for record in manifest.values():
+        for path, size, mtime, inode in record['files']:
+            inodes[inode] = size
+    return sum(inodes.values())
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, value)
+                          for name, value in sorted(labels.items())) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def collect():
+    """
+    Collect the metrics, returning them in the Prometheus text format.
+
+    """
+    from conda_execute.tmpenv import (_manifest_file, env_is_being_created,
+                                      envs_and_running_pids)
+
+    with Locked(_state_file()):
+        state = _read_state()
+        _accumulate_events(state)
+
+        env_sizes = {}
+        running = {}
+        being_created = 0
+        for env, env_stats in envs_and_running_pids():
+            name = os.path.basename(env)
+            if env_is_being_created(env):
+                being_created += 1
+            if env_stats is None:
+                continue
+            running[name] = len(env_stats['alive_PIDs'])
+            try:
+                mtime = os.path.getmtime(_manifest_file(env))
+            except OSError:
+                mtime = None
+            env_sizes[name] = _cached_size(state.get('env_sizes', {}), name, env,
+                                           mtime, _env_size)
+        state['env_sizes'] = env_sizes
+
+        pkg_dir = conda_execute.config.pkg_dir
+        if os.path.isdir(pkg_dir):
+            # Extracting (or removing) a package changes the mtime of the pkg_dir.
+            state['pkg_dir_size'] = _cached_size(state, 'pkg_dir_size', pkg_dir,
+                                                 os.path.getmtime(pkg_dir),
+                                                 conda_execute.archive.disk_usage)
+        atomic_write(_state_file(), json.dumps(state, sort_keys=True))
+
+    archives = conda_execute.archive.archived_envs()
+    archive_sizes = [os.path.getsize(archive) for env, archive in archives]
+    slots_dir = os.path.join(conda_execute.config.env_dir, '.creation-slots')
+    slots = queued = 0
+    if os.path.isdir(slots_dir):
+        slots = len([fname for fname in os.listdir(os.path.join(slots_dir, 'slots'))
+                     if not fname.startswith('.')])
+        queued = len([fname for fname in os.listdir(os.path.join(slots_dir, 'queue'))
+                      if not fname.startswith('.')])
+
+    metrics = [
+        ('conda_execute_envs', 'gauge', 'The number of temporary environments.',
+         [({'tier': 'live'}, len(env_sizes)), ({'tier': 'archived'}, len(archives))]),
+        ('conda_execute_env_store_bytes', 'gauge', 'The total size of the temporary environments.',
+         [({'tier': 'live'}, sum(size for _, size in env_sizes.values())),
+          ({'tier': 'archived'}, sum(archive_sizes))]),
+        ('conda_execute_env_bytes', 'gauge', 'The size of each live temporary environment.',
+         [({'env': name}, size) for name, (_, size) in sorted(env_sizes.items())]),
+        ('conda_execute_env_running_pids', 'gauge',
+         'The number of running processes using each temporary environment.',
+         [({'env': name}, count) for name, count in sorted(running.items())]),
+        ('conda_execute_pkg_dir_bytes', 'gauge', 'The size of the package cache.',
+         [({}, state['pkg_dir_size'][1])] if 'pkg_dir_size' in state else []),
+        ('conda_execute_lock_holders', 'gauge',
+         'Processes holding environment creation locks and slots.',
+         [({'lock': 'env'}, being_created), ({'lock': 'creation_slot'}, slots)]),
+        ('conda_execute_creation_queue_length', 'gauge',
+         'Processes waiting for an environment creation slot.', [({}, queued)]),
+    ]
+    lines = []
+    for name, kind, description, samples in metrics:
+        lines.extend(['# HELP {} {}'.format(name, description),
+                      '# TYPE {} {}'.format(name, kind)])
+        lines.extend('{}{} {}'.format(name, _format_labels(labels), _format_value(value))
+                     for labels, value in samples)
+
+    for name, description in [('conda_execute_runs_total', 'Executions, by whether their '
+                                                           'environment was already built.'),
+                              ('conda_execute_failures_total', 'Executions which failed.'),
+                              ('conda_execute_env_creations_total',
+                               'Environments created (or repaired).'),
+                              ('conda_execute_solves_total', 'Specifications solved.')]:
+        lines.extend(['# HELP {} {}'.format(name, description),
+                      '# TYPE {} counter'.format(name)])
+        for key, value in sorted(state['counters'].items()):
+            counter, labels = json.loads(key)
+            if counter == name:
+                lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+
+    for name, description, buckets in [
+            ('conda_execute_startup_seconds', 'Seconds from the start of conda execute to the '
+                                              'start of the script.', _STARTUP_BUCKETS),
+            ('conda_execute_solve_seconds', 'Seconds taken to solve a specification.',
+             _SOLVE_BUCKETS)]:
+        lines.extend(['# HELP {} {}'.format(name, description),
+                      '# TYPE {} histogram'.format(name)])
+        for key, histogram in sorted(state['histograms'].items()):
+            histogram_name, labels = json.loads(key)
+            if histogram_name != name:
+                continue
+            for bound, count in zip(buckets + ['+Inf'],
+                                    histogram['buckets'] + [histogram['count']]):
+                bucket_labels = dict(labels, le=str(bound))
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(bucket_labels), count))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels),
+                                              _format_value(histogram['sum'])))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), histogram['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path):
+    """
+    Collect the metrics and write them, atomically, to the given path.
+
+    """
+    atomic_write(path, collect())
+
+
+def write_textfile_if_due():
+    """
+    Write the metrics to the ``metrics-textfile`` (if configured) if they
+    haven't been written within the last ``metrics-interval`` seconds.
+
+    """
+    path = conda_execute.config.metrics_textfile
+    if not path:
+        return
+    try:
+        if (os.path.exists(path) and
+                time.time() - os.path.getmtime(path) < conda_execute.config.metrics_interval):
+            return
+        write_textfile(path)
+    except (IOError, OSError) as exception:
+        log.debug('Unable to write the metrics to {}: {}'.format(path, exception))
@@ -0,0 +1,194 @@
+"""
+A local cache of remote scripts, revalidated with conditional HTTP requests.
+
+Script content is stored by its sha256 under ``<script-cache-dir>/objects``,
+and each URL has an index entry under ``<script-cache-dir>/urls`` recording
+the ETag and Last-Modified headers, when the URL was last checked, which
+content it resolved to, and the spec extracted from that content. Entries
+unused for ``script-cache-max-age`` days, and the content no entry refers
+to, are removed by :func:`prune_script_cache` (as part of the cleanup after
+each execution).
+
+"""
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import time
+
+import requests
+
+import conda_execute.config
+from conda_execute.utils import atomic_write
+
+
+log = logging.getLogger('conda-execute')
+log.addHandler(logging.NullHandler())
+
+
+# A single session, so that connections are reused within the process.
+_session = None
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def _entry_path(url):
+    url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(conda_execute.config.script_cache_dir, 'urls', url_hash + '.json')
+
+
+def _object_path(content_hash):
+    return os.path.join(conda_execute.config.script_cache_dir, 'objects', content_hash)
+
+
+def read_entry(url):
+    """
+    Return the cache entry for the given URL, or an empty dictionary if the
+    URL hasn't been cached (or its cached content has gone missing).
+
+    """
+    try:
+        with open(_entry_path(url), 'r') as fh:
+            entry = json.load(fh)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not os.path.exists(_object_path(entry.get('content', ''))):
+        return {}
+    return entry
+
+
+def write_entry(url, entry):
+    atomic_write(_entry_path(url), json.dumps(entry, sort_keys=True))
+
+
+def _download(response):
+    """
+    Stream the body of the response into the object store, returning the
+    hash of its content.
+
+    """
+    objects_dir = os.path.dirname(_object_path('x'))
+    if not os.path.isdir(objects_dir):
+        os.makedirs(objects_dir)
+    sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=objects_dir, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                sha.update(chunk)
+                fh.write(chunk)
+        # Make the file executable.
+        os.chmod(tmp_path, stat.S_IREAD | stat.S_IEXEC)
+        content_hash = sha.hexdigest()
+        if os.path.exists(_object_path(content_hash)):
+            os.remove(tmp_path)
+        else:
+            os.rename(tmp_path, _object_path(content_hash))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return content_hash
+
+
+def fetch_script(url, max_age=None):
+    """
+    Return the local path of the given remote script along with its cache
+    entry (which may contain a cached ``spec``).
+
+    A cached script which was checked within ``max_age`` seconds (default
+    ``conda_execute.config.script_max_age``) is used without touching the
+    network. Otherwise it is revalidated with a conditional request, and only
+    downloaded again if it has changed.
+
+    """
+    if max_age is None:
+        max_age = conda_execute.config.script_max_age
+    entry = read_entry(url)
+    now = time.time()
+
+    if entry and now - entry.get('checked', 0) < max_age:
+        log.info('Using cached copy of {}'.format(url))
+        # Mark the entry as used, for prune_script_cache.
+        try:
+            os.utime(_entry_path(url), None)
+        except OSError:
+            pass
+        return _object_path(entry['content']), entry
+
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    try:
+        response = _get_session().get(url, headers=headers, stream=True)
+    except requests.RequestException as exception:
+        if not entry:
+            raise
+        log.warn('Unable to revalidate {} ({}). Using the cached copy.'.format(url, exception))
+        return _object_path(entry['content']), entry
+
+    with response:
+        if response.status_code == 304 and entry:
+            log.info('Cached copy of {} is up to date'.format(url))
+        else:
+            response.raise_for_status()
+            log.info('Downloading {}'.format(url))
+            content_hash = _download(response)
+            if content_hash != entry.get('content'):
+                # The spec belongs to the old content.
+                entry = {'content': content_hash}
+            entry['etag'] = response.headers.get('ETag')
+            entry['last_modified'] = response.headers.get('Last-Modified')
+    entry['url'] = url
+    entry['checked'] = now
+    write_entry(url, entry)
+    return _object_path(entry['content']), entry
+
+
+# Seconds for which content which no entry refers to is kept, as it may be
+# a download whose entry is yet to be written.
+_UNREFERENCED_GRACE = 60 * 60
+
+
+def prune_script_cache(max_age=None):
+    """
+    Remove the entries of the URLs which haven't been used for max_age days
+    (default ``script-cache-max-age`` config), and the cached content which
+    no remaining entry refers to.
+
+    """
+    if max_age is None:
+        max_age = conda_execute.config.script_cache_max_age
+    urls_dir = os.path.dirname(_entry_path(''))
+    objects_dir = os.path.dirname(_object_path('x'))
+    now = time.time()
+    referenced = set()
+    for fname in (os.listdir(urls_dir) if os.path.isdir(urls_dir) else []):
+        path = os.path.join(urls_dir, fname)
+        try:
+            if now - os.path.getmtime(path) > max_age * 24 * 60 * 60:
+                log.info('Removing the unused cached script entry {}.'.format(path))
+                os.remove(path)
+                continue
+            with open(path, 'r') as fh:
+                referenced.add(json.load(fh).get('content'))
+        except (IOError, OSError, ValueError) as exception:
+            log.debug('Unable to check the cached script entry {}: {}'.format(path, exception))
+    for fname in (os.listdir(objects_dir) if os.path.isdir(objects_dir) else []):
+        path = os.path.join(objects_dir, fname)
+        try:
+            if fname not in referenced and now - os.path.getmtime(path) > _UNREFERENCED_GRACE:
+                log.info('Removing the unreferenced cached script {}.'.format(path))
+                os.remove(path)
+        except OSError as exception:
+            log.debug('Unable to remove the cached script {}: {}'.format(path, exception))
@@ -0,0 +1,502 @@
+"""
+Backends which load the package index of channels, solve specifications
+and install the solved packages into prefixes. The backend is chosen with
+the ``solver`` config:
+
+ * ``conda`` (the default): conda's classic ``Resolve``, and the install
+   machinery of the installed version of conda.
+ * ``libmamba``: the solver of the ``conda-libmamba-solver`` plugin, with
+   conda's install machinery (conda >= 4.4).
+ * ``micromamba``: a ``micromamba`` executable (see the ``micromamba``
+   config), which solves and installs without importing conda.
+
+Each backend has the same interface:
+
+ * ``get_index(channels)``: the package index of the channels. It is opaque
+   to the callers, other than that it maps the solved packages to records
+   (with a size, where known) once they have been solved.
+ * ``solve(index, specs)``: the sorted list of solved packages, whose
+   ``str`` is their (optionally ``channel::`` prefixed) name-version-build.
+ * ``dist_from_str(dist_str)``: the package from its ``str``.
+ * ``fetch(index, packages)``: fetch and extract the packages into the
+   pkg_dir, without linking them anywhere.
+ * ``link(prefix, index, packages)``: install the packages into the prefix
+   (which may already have other packages linked).
+
+Callers solve with :func:`solve`, which runs the backend's solve in a worker
+process, limited in the time and memory it may take.
+
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows.
+    resource = None
+
+import conda_execute.config
+from conda_execute.lock import Locked
+from conda_execute.utils import atomic_write
+
+
+log = logging.getLogger('conda-tmpenv')
+log.addHandler(logging.NullHandler())
+
+
+def _create_env_conda_42(prefix, index, full_list_of_packages):
+    from conda_execute.conda_interface import CONDA_VERSION_MAJOR_MINOR
+    assert CONDA_VERSION_MAJOR_MINOR < (4, 3)
+    from conda.install import is_extracted, is_fetched, extract, link
+    from conda.fetch import fetch_pkg
+
+    for tar_name in full_list_of_packages:
+        pkg_info = index[tar_name]
+        dist_name = tar_name[:-len('.tar.bz2')]
+        log.info('Resolved package: {}'.format(tar_name))
+        # We force a lock on retrieving anything which needs access to a distribution of this
+        # name. If other requests come in to get the exact same package they will have to wait
+        # for this to finish (good). If conda itself it fetching these pacakges then there is
+        # the potential for a race condition (bad) - there is no solution to this unless
+        # conda/conda is updated to be more precise with its locks.
+        lock_name = os.path.join(conda_execute.config.pkg_dir, dist_name)
+        with Locked(lock_name):
+            if not is_extracted(dist_name):
+                if not is_fetched(dist_name):
+                    log.info('Fetching {}'.format(dist_name))
+                    fetch_pkg(pkg_info, conda_execute.config.pkg_dir)
+                extract(dist_name)
+            link(prefix, dist_name)
+
+
+def _create_env_conda_43(prefix, index, full_list_of_packages):
+    from conda_execute.conda_interface import CONDA_VERSION_MAJOR_MINOR
+    assert CONDA_VERSION_MAJOR_MINOR >= (4, 3)
+    from conda.core.package_cache import ProgressiveFetchExtract
+    from conda.core.link import UnlinkLinkTransaction
+    from conda.gateways.disk.create import mkdir_p
+
+    pfe = ProgressiveFetchExtract(index, full_list_of_packages)
+    pfe.execute()
+    mkdir_p(prefix)
+    txn = UnlinkLinkTransaction.create_from_dists(index, prefix, (), full_list_of_packages)
+    txn.execute()
+
+def _create_env_conda_44(prefix, full_list_of_packages):
+    from conda_execute.conda_interface import CONDA_VERSION_MAJOR_MINOR
+    assert CONDA_VERSION_MAJOR_MINOR >= (4, 4)
+    from conda.models.match_spec import MatchSpec
+    from conda.core.solve import Solver
+
+    matched_list_of_packages = (MatchSpec(d) for d in full_list_of_packages)
+    m = Solver(prefix, (), specs_to_add=matched_list_of_packages)
+    txn = m.solve_for_transaction()
+    txn.execute()
+
+
+def _exact_spec(dist_str):
+    """The match spec (name=version=build) of the given package string."""
+    channel, _, dist_name = dist_str.rpartition('::')
+    name, version, build = dist_name.rsplit('-', 2)
+    spec = '{}={}={}'.format(name, version, build)
+    return '{}::{}'.format(channel, spec) if channel else spec
+
+
+class _Index(dict):
+    def __init__(self, channels):
+        """
+        The index of a backend which solves against the channels directly:
+        the records of the packages it has solved, keyed by their ``str``.
+
+        """
+        dict.__init__(self)
+        self.channels = list(channels)
+
+
+class CondaBackend(object):
+    name = 'conda'
+
+    def get_index(self, channels):
+        from conda_execute.conda_interface import get_index
+        return get_index(list(channels))
+
+    def solve(self, index, specs):
+        from conda_execute.conda_interface import Resolve
+        return sorted(Resolve(index).solve(list(specs)))
+
+    def dist_from_str(self, dist_str):
+        from conda_execute.conda_interface import CONDA_VERSION_MAJOR_MINOR
+        if CONDA_VERSION_MAJOR_MINOR >= (4, 3):
+            from conda.models.dist import Dist
+            return Dist(dist_str)
+        return dist_str
+
+    def fetch(self, index, packages):
+        from conda_execute.conda_interface import CONDA_VERSION_MAJOR_MINOR
+        if CONDA_VERSION_MAJOR_MINOR >= (4, 4):
+            from conda.core.package_cache import ProgressiveFetchExtract
+            ProgressiveFetchExtract([index[dist] for dist in packages]).execute()
+        elif CONDA_VERSION_MAJOR_MINOR >= (4, 3):
+            from conda.core.package_cache import ProgressiveFetchExtract
+            ProgressiveFetchExtract(index, packages).execute()
+        else:
+            from conda.install import is_extracted, is_fetched, extract
+            from conda.fetch import fetch_pkg
+            for tar_name in packages:
+                dist_name = tar_name[:-len('.tar.bz2')]
+                with Locked(os.path.join(conda_execute.config.pkg_dir, dist_name)):
+                    if not is_extracted(dist_name):
+                        if not is_fetched(dist_name):
+                            log.info('Fetching {}'.format(dist_name))
+                            fetch_pkg(index[tar_name], conda_execute.config.pkg_dir)
+                        extract(dist_name)
+
+    def link(self, prefix, index, packages):
+        from conda_execute.conda_interface import CONDA_VERSION_MAJOR_MINOR, Resolve
+        if CONDA_VERSION_MAJOR_MINOR >= (4, 4):
+            _create_env_conda_44(prefix, packages)
+        elif CONDA_VERSION_MAJOR_MINOR >= (4, 3):
+            resolve = Resolve(index)
+            sorted_list_of_packages = resolve.dependency_sort({d.name: d for d in packages})
+            _create_env_conda_43(prefix, index, sorted_list_of_packages)
+        else:
+            _create_env_conda_42(prefix, index, packages)
+
+
+class LibMambaBackend(object):
+    name = 'libmamba'
+
+    def _solver(self, prefix, channels, specs):
+        from conda.base.context import context
+        from conda.models.match_spec import MatchSpec
+        from conda_libmamba_solver.solver import LibMambaSolver
+
+        return LibMambaSolver(prefix, channels, context.subdirs,
+                              specs_to_add=[MatchSpec(spec) for spec in specs])
+
+    def get_index(self, channels):
+        return _Index(channels)
+
+    def solve(self, index, specs):
+        # Solved for a prefix which doesn't exist, so with nothing installed.
+        prefix = os.path.join(tempfile.gettempdir(), 'conda-execute-solve')
+        records = self._solver(prefix, index.channels, specs).solve_final_state()
+        for record in records:
+            index[record.dist_str()] = record
+        return sorted(record.dist_str() for record in records)
+
+    def dist_from_str(self, dist_str):
+        return dist_str
+
+    def _records(self, index, packages):
+        """
+        The records of the packages. Those which the index lacks (e.g. when
+        resuming a creation which was solved by an earlier process) are
+        found by solving their exact specs.
+
+        """
+        missing = [dist for dist in packages if dist not in index]
+        if missing:
+            self.solve(index, [_exact_spec(dist) for dist in missing])
+        return [index[dist] for dist in packages]
+
+    def fetch(self, index, packages):
+        from conda.core.package_cache import ProgressiveFetchExtract
+        ProgressiveFetchExtract(self._records(index, packages)).execute()
+
+    def link(self, prefix, index, packages):
+        # The transaction is made from the solved records, in dependency order, rather than
+        # solving their exact specs again.
+        from conda.core.link import PrefixSetup, UnlinkLinkTransaction
+        from conda.models.match_spec import MatchSpec
+        from conda.models.prefix_graph import PrefixGraph
+
+        records = tuple(PrefixGraph(self._records(index, packages)).graph)
+        specs = tuple(MatchSpec(_exact_spec(dist)) for dist in packages)
+        setup = PrefixSetup(prefix, (), records, (), specs, ())
+        UnlinkLinkTransaction(setup).execute()
+
+
+class MicromambaBackend(object):
+    name = 'micromamba'
+
+    def _run(self, command, prefix, channels, specs):
+        cmd = [conda_execute.config.micromamba, command, '--yes', '--json',
+               '--root-prefix', os.path.join(conda_execute.config.env_dir, '.micromamba'),
+               '--prefix', prefix]
+        for channel in channels:
+            cmd.extend(['--channel', channel])
+        environ = dict(os.environ, CONDA_PKGS_DIRS=conda_execute.config.pkg_dir)
+        log.debug('Running command: {}'.format(cmd + list(specs)))
+        output = subprocess.check_output(cmd + list(specs), env=environ)
+        return json.loads(output.decode('utf-8'))
+
+    def get_index(self, channels):
+        return _Index(channels)
+
+    def solve(self, index, specs):
+        prefix = os.path.join(tempfile.gettempdir(), 'conda-execute-solve')
+        result = self._run('create', prefix, index.channels, ['--dry-run'] + list(specs))
+        packages = []
+        for record in result.get('actions', {}).get('LINK', []):
+            dist = '{}-{}-{}'.format(record['name'], record['version'], record['build_string'])
+            index[dist] = record
+            packages.append(dist)
+        return sorted(packages)
+
+    def dist_from_str(self, dist_str):
+        return dist_str
+
+    def fetch(self, index, packages):
+        # Micromamba fetches (into the pkg_dir) as it links.
+        pass
+
+    def link(self, prefix, index, packages):
+        command = 'install' if os.path.isdir(os.path.join(prefix, 'conda-meta')) else 'create'
+        self._run(command, prefix, index.channels, [_exact_spec(dist) for dist in packages])
+
+
+_BACKENDS = dict((backend.name, backend)
+                 for backend in [CondaBackend, LibMambaBackend, MicromambaBackend])
+
+
+def get_backend(name=None):
+    """
+    The backend of the given name, or of the ``solver`` config.
+
+    """
+    name = name or conda_execute.config.solver
+    try:
+        return _BACKENDS[name]()
+    except KeyError:
+        raise ValueError('Unknown solver {!r}; expected one of {}.'.format(
+            name, ', '.join(sorted(_BACKENDS))))
+
+
+class SolveFailure(RuntimeError):
+    """A solve which timed out or ran out of memory (or did so recently)."""
+
+
+# The config which a worker process needs to solve as this process would.
+_WORKER_CONFIG = ['env_dir', 'pkg_dir', 'micromamba']
+
+
+def _worker_main(conn, max_memory):
+    """
+    Solve the requests received on the connection, one at a time, replying
+    with the solved packages (and, for backends which solve against the
+    channels directly, their records) or the exception raised.
+
+    Each request carries the index to solve against, or None to solve
+    against the index of the previous request (which the worker keeps), so
+    the worker never loads an index itself.
+
+    """
+    # Interrupts are for the parent process, which stops the worker.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if max_memory and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+    index = None
+    while True:
+        try:
+            backend, specs, config, sent_index = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        for name, value in config.items():
+            setattr(conda_execute.config, name, value)
+        if sent_index is not None:
+            index = sent_index
+        try:
+            packages = [str(dist) for dist in backend.solve(index, specs)]
+            records = {}
+            if isinstance(index, _Index):
+                records = dict((dist, index[dist]) for dist in packages if dist in index)
+            reply = ('solved', packages, records)
+        except MemoryError:
+            # Drop the index, to leave the worker as much memory as possible.
+            index = None
+            reply = ('memory', None, None)
+        except BaseException as exception:
+            # Including the SystemExit of older versions of conda on an unsatisfiable spec.
+            reply = ('error', exception, None)
+        try:
+            conn.send(reply)
+        except Exception:
+            # The exception can't be pickled.
+            conn.send(('error', RuntimeError('{}: {}'.format(type(reply[1]).__name__, reply[1])),
+                       None))
+
+
+def _context():
+    """
+    The multiprocessing context of the workers. They aren't forked from
+    this (possibly multithreaded) process, where a lock held by another
+    thread (e.g. of logging) would never be released in the worker, but
+    from a fork server (or spawned, where there is none).
+
+    """
+    if not hasattr(multiprocessing, 'get_context'):
+        # Python 2, which can only fork.
+        return multiprocessing
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class _Worker(object):
+    def __init__(self, max_memory):
+        """A solver process, whose address space is capped at max_memory bytes."""
+        self.max_memory = max_memory
+        # The index which the worker has been sent (and keeps).
+        self.index = None
+        context = _context()
+        self.conn, worker_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(worker_conn, max_memory))
+        self.process.daemon = True
+        self.process.start()
+        worker_conn.close()
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+_idle_workers = []
+_idle_workers_lock = threading.Lock()
+
+
+def _take_worker(max_memory):
+    with _idle_workers_lock:
+        while _idle_workers:
+            worker = _idle_workers.pop()
+            if worker.max_memory == max_memory and worker.process.is_alive():
+                return worker
+            worker.stop()
+    return _Worker(max_memory)
+
+
+def _release_worker(worker):
+    with _idle_workers_lock:
+        if len(_idle_workers) < conda_execute.config.solver_workers:
+            _idle_workers.append(worker)
+            return
+    worker.stop()
+
+
+def stop_workers():
+    """
+    Stop the idle solver processes (which are otherwise kept, with their
+    indexes loaded, for the next solve).
+
+    """
+    with _idle_workers_lock:
+        workers = list(_idle_workers)
+        del _idle_workers[:]
+    for worker in workers:
+        worker.stop()
+
+
+def _failure_file(backend, specs, channels):
+    key = json.dumps([backend.name, list(specs), list(channels)])
+    name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:20]
+    return os.path.join(conda_execute.config.env_dir, '.solve-failures', name + '.json')
+
+
+def _record_failure(path, specs, channels, reason):
+    failure = {'spec': list(specs), 'channels': list(channels), 'reason': reason,
+               'time': time.time()}
+    try:
+        atomic_write(path, json.dumps(failure, sort_keys=True))
+    except (IOError, OSError) as exception:
+        log.debug('Unable to record the failed solve: {}'.format(exception))
+
+
+def solve(backend, index, specs, channels=()):
+    """
+    Solve the specs with the backend, in a worker process which is stopped
+    if it takes longer than ``solve-timeout`` seconds, and whose address
+    space is capped at ``solve-max-memory-bytes``, raising a
+    :class:`SolveFailure` if it does either. A spec which failed so is
+    recorded, and fails fast for the ``solve-failure-cooldown`` seconds
+    after.
+
+    The worker solves against the given index, which is sent to it (unless
+    it was sent the same index for an earlier solve), rather than loading
+    its own. Idle workers (up to ``solver-workers``) are kept, with the last
+    index they were sent, for the solves which follow in this process.
+    Where the timeout is zero (or this process can't have children), the
+    spec is solved in this process.
+
+    """
+    failure_file = _failure_file(backend, specs, channels)
+    try:
+        with open(failure_file, 'r') as fh:
+            failure = json.load(fh)
+    except (IOError, OSError, ValueError):
+        failure = None
+    if failure is not None:
+        age = time.time() - failure['time']
+        if age < conda_execute.config.solve_failure_cooldown:
+            raise SolveFailure('Solving {} failed ({}) {:.0f}s ago; not retrying for another '
+                               '{:.0f}s.'.format(', '.join(specs), failure['reason'], age,
+                                                 conda_execute.config.solve_failure_cooldown - age))
+
+    timeout = conda_execute.config.solve_timeout
+    if not timeout or multiprocessing.current_process().daemon:
+        # Daemonic processes (e.g. the workers of conda tmpenv prewarm) can't have children.
+        return backend.solve(index, specs)
+
+    worker = _take_worker(conda_execute.config.solve_max_memory_bytes)
+    try:
+        config = dict((name, getattr(conda_execute.config, name)) for name in _WORKER_CONFIG)
+        sent_index = None if worker.index is index else index
+        worker.conn.send((backend, list(specs), config, sent_index))
+        worker.index = index
+        if not worker.conn.poll(timeout):
+            raise SolveFailure('Solving {} took longer than {}s.'.format(', '.join(specs),
+                                                                         timeout))
+        status, result, records = worker.conn.recv()
+    except SolveFailure:
+        worker.stop()
+        _record_failure(failure_file, specs, channels, 'timeout')
+        raise
+    except (EOFError, IOError, OSError):
+        # The worker died (e.g. was killed by the kernel's out of memory killer, or ran out of
+        # memory unpickling the index), either before it was sent the request or as it solved.
+        worker.stop()
+        _record_failure(failure_file, specs, channels, 'died')
+        raise SolveFailure('The process solving {} died.'.format(', '.join(specs)))
+    except BaseException:
+        worker.stop()
+        raise
+    if status == 'memory':
+        # The worker has dropped the index.
+        worker.index = None
+    _release_worker(worker)
+
+    if status == 'memory':
+        _record_failure(failure_file, specs, channels, 'memory')
+        raise SolveFailure('Solving {} needed more than {} bytes of memory.'.format(
+            ', '.join(specs), conda_execute.config.solve_max_memory_bytes))
+    elif status == 'error':
+        raise result
+    if failure is not None:
+        # The spec has solved since it failed.
+        try:
+            os.remove(failure_file)
+        except OSError:
+            pass
+    if isinstance(index, _Index):
+        index.update(records)
+    return [backend.dist_from_str(dist) for dist in result]
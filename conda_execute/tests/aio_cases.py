@@ -0,0 +1,119 @@
+"""
+The tests of conda_execute.aio, which (as the module itself) use syntax
+of Python 3.5+, imported by test_aio only where it is available.
+
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import psutil
+
+import conda_execute.config
+import conda_execute.events
+from conda_execute.aio import AsyncExecutor
+from conda_execute.executor import Executor
+from conda_execute.tmpenv import find_env
+
+
+SCRIPT = """\
+# conda execute
+# env:
+#  - python
+# run_with: {}
+import os, sys, time
+print(os.getpid())
+sys.stdout.flush()
+sys.stderr.write('warning\\n')
+time.sleep(float(sys.argv[1]))
+sys.exit(3)
+"""
+
+
+class Test_AsyncExecutor(unittest.TestCase):
+    def setUp(self):
+        self.orig_config = conda_execute.config.env_dir, conda_execute.config.event_log
+        self.tmp_dir = tempfile.mkdtemp()
+        conda_execute.config.env_dir = os.path.join(self.tmp_dir, 'envs')
+        conda_execute.config.event_log = os.path.join(self.tmp_dir, 'events.jsonl')
+        env = find_env(['python'])
+        os.makedirs(os.path.join(env, 'conda-meta'))
+        open(os.path.join(env, 'conda-meta', 'execution.log'), 'w').close()
+        self.script = os.path.join(self.tmp_dir, 'script.py')
+        with open(self.script, 'w') as fh:
+            fh.write(SCRIPT.format(sys.executable))
+        self.executor = AsyncExecutor(Executor(), terminate_timeout=1)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        conda_execute.config.env_dir, conda_execute.config.event_log = self.orig_config
+        shutil.rmtree(self.tmp_dir)
+
+    def test_streamed_output(self):
+        stdout, stderr = [], []
+
+        async def on_stderr(line):
+            stderr.append(line)
+
+        code = self.loop.run_until_complete(
+            self.executor.run(self.script, ['0'], stdout=stdout.append, stderr=on_stderr))
+        self.assertEqual(code, 3)
+        self.assertEqual(len(stdout), 1)
+        self.assertEqual(stderr, [b'warning\n'])
+
+    def test_resources_recorded(self):
+        self.loop.run_until_complete(self.executor.run(self.script, ['0'], stdout=lambda line: None))
+        event, = conda_execute.events.read_events()
+        self.assertEqual(event['code'], 3)
+        self.assertIn('wall', event['resources'])
+        if hasattr(os, 'wait4'):
+            self.assertGreater(event['resources']['max_rss'], 0)
+            self.assertGreater(event['resources']['user'] + event['resources']['system'], 0)
+
+    def test_cancellation_terminates_script(self):
+        pids = []
+
+        async def cancel_once_started():
+            started = asyncio.Event()
+
+            def on_stdout(line):
+                pids.append(int(line))
+                started.set()
+
+            task = asyncio.ensure_future(self.executor.run(self.script, ['60'], stdout=on_stdout))
+            await started.wait()
+            task.cancel()
+            await task
+
+        start = time.time()
+        with self.assertRaises(asyncio.CancelledError):
+            self.loop.run_until_complete(cancel_once_started())
+        self.assertLess(time.time() - start, 30)
+        self.assertFalse(psutil.pid_exists(pids[0]))
+        event, = conda_execute.events.read_events()
+        self.assertEqual(event['error'], 'CancelledError')
+
+    def test_builds_are_coalesced(self):
+        calls = []
+        ensure_env = self.executor.executor._ensure_env
+
+        def slow_ensure_env(*args):
+            calls.append(threading.current_thread())
+            time.sleep(0.2)
+            return ensure_env(*args)
+
+        self.executor.executor._ensure_env = slow_ensure_env
+
+        async def ensure_envs():
+            return await asyncio.gather(*[self.executor.ensure_env(['python'])
+                                          for _ in range(5)])
+
+        prefixes = self.loop.run_until_complete(ensure_envs())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(set(prefixes), set([find_env(['python'])]))
@@ -0,0 +1,14 @@
+import sys
+import unittest
+
+
+if sys.version_info >= (3, 5):
+    from conda_execute.tests.aio_cases import Test_AsyncExecutor
+else:
+    @unittest.skip('conda_execute.aio requires Python 3.5+.')
+    class Test_AsyncExecutor(unittest.TestCase):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
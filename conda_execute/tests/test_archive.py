@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import conda_execute.archive
+import conda_execute.config
+
+
+class Test_archive_env(unittest.TestCase):
+    def setUp(self):
+        self.orig_dirs = (conda_execute.config.env_dir, conda_execute.config.archive_dir,
+                          conda_execute.config.pkg_dir)
+        self.tmp_dir = tempfile.mkdtemp()
+        conda_execute.config.env_dir = os.path.join(self.tmp_dir, 'tmp_envs')
+        conda_execute.config.archive_dir = os.path.join(self.tmp_dir, 'tmp_envs_archive')
+        conda_execute.config.pkg_dir = os.path.join(self.tmp_dir, 'pkgs')
+        self.env = os.path.join(conda_execute.config.env_dir, 'a' * 20)
+        os.makedirs(os.path.join(self.env, 'bin'))
+        with open(os.path.join(self.env, 'bin', 'tool'), 'w') as fh:
+            fh.write('#!{}/bin/python\n'.format(self.env))
+        os.chmod(os.path.join(self.env, 'bin', 'tool'), 0o755)
+        os.symlink('tool', os.path.join(self.env, 'bin', 'tool-link'))
+
+    def tearDown(self):
+        (conda_execute.config.env_dir, conda_execute.config.archive_dir,
+         conda_execute.config.pkg_dir) = self.orig_dirs
+        shutil.rmtree(self.tmp_dir)
+
+    def test_roundtrip(self):
+        archive = conda_execute.archive.archive_env(self.env, last_used=1000000000)
+        self.assertFalse(os.path.exists(self.env))
+        self.assertEqual(os.path.getmtime(archive), 1000000000)
+        self.assertEqual(conda_execute.archive.archived_envs(), [(self.env, archive)])
+
+        self.assertTrue(conda_execute.archive.restore_env(self.env))
+        self.assertFalse(os.path.exists(archive))
+        tool = os.path.join(self.env, 'bin', 'tool')
+        with open(tool) as fh:
+            self.assertEqual(fh.read(), '#!{}/bin/python\n'.format(self.env))
+        self.assertTrue(os.access(tool, os.X_OK))
+        self.assertEqual(os.readlink(os.path.join(self.env, 'bin', 'tool-link')), 'tool')
+
+    def test_pkg_dir_hardlinks_restored(self):
+        pkg_file = os.path.join(conda_execute.config.pkg_dir, 'foo-1.0-0', 'lib', 'foo.so')
+        os.makedirs(os.path.dirname(pkg_file))
+        with open(pkg_file, 'w') as fh:
+            fh.write('library')
+        os.makedirs(os.path.join(self.env, 'lib'))
+        os.link(pkg_file, os.path.join(self.env, 'lib', 'foo.so'))
+        os.makedirs(os.path.join(self.env, 'conda-meta'))
+        with open(os.path.join(self.env, 'conda-meta', 'foo-1.0-0.json'), 'w') as fh:
+            json.dump({'files': ['lib/foo.so']}, fh)
+
+        conda_execute.archive.archive_env(self.env)
+        self.assertTrue(conda_execute.archive.restore_env(self.env))
+        self.assertEqual(os.stat(os.path.join(self.env, 'lib', 'foo.so')).st_ino,
+                         os.stat(pkg_file).st_ino)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.env, 'conda-meta'))),
+                         ['foo-1.0-0.json'])
+
+    def test_restore_without_archive(self):
+        self.assertFalse(conda_execute.archive.restore_env(self.env + 'b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import conda_execute.catalog
+import conda_execute.config
+import conda_execute.tmpenv
+
+
+class Test_catalog(unittest.TestCase):
+    def setUp(self):
+        self.orig_env_dir = conda_execute.config.env_dir
+        self.env_dir = conda_execute.config.env_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        conda_execute.config.env_dir = self.orig_env_dir
+        shutil.rmtree(self.env_dir)
+
+    def make_env(self, env_prefix):
+        os.makedirs(os.path.join(env_prefix, 'conda-meta'))
+        return env_prefix
+
+    def test_env_path_is_sharded(self):
+        self.assertEqual(conda_execute.catalog.env_path('abcdef'),
+                         os.path.join(self.env_dir, 'ab', 'abcdef'))
+
+    def test_add_and_remove(self):
+        self.assertEqual(conda_execute.catalog.envs(), [])
+        env = self.make_env(conda_execute.catalog.env_path('a' * 20))
+        conda_execute.catalog.add(env)
+        conda_execute.catalog.add(env)
+        # The catalog is read, rather than the store being walked.
+        self.make_env(conda_execute.catalog.env_path('b' * 20))
+        self.assertEqual(conda_execute.catalog.envs(), [env])
+        conda_execute.catalog.remove(env)
+        self.assertEqual(conda_execute.catalog.envs(), [])
+
+    def test_reindex(self):
+        sharded = self.make_env(conda_execute.catalog.env_path('a' * 20))
+        unsharded = self.make_env(os.path.join(self.env_dir, 'b' * 20))
+        self.make_env(os.path.join(self.env_dir, '.usage', 'c' * 20))
+        os.makedirs(os.path.join(self.env_dir, 'dd', 'not-an-env'))
+        self.assertEqual(conda_execute.catalog.reindex(),
+                         set([os.path.relpath(sharded, self.env_dir), 'b' * 20]))
+        self.assertEqual(conda_execute.tmpenv.tmp_envs(), [sharded, unsharded])
+
+    def test_unsharded_env_still_found(self):
+        env_locn = conda_execute.tmpenv.name_env(['python'])
+        self.assertEqual(conda_execute.tmpenv.find_env(['python']), env_locn)
+        unsharded = self.make_env(os.path.join(self.env_dir, os.path.basename(env_locn)))
+        self.assertEqual(conda_execute.tmpenv.find_env(['python']), unsharded)
+
+    def test_cleanup_drops_missing_envs(self):
+        env = conda_execute.catalog.env_path('a' * 20)
+        conda_execute.catalog.add(env)
+        conda_execute.tmpenv.cleanup_tmp_envs()
+        self.assertEqual(conda_execute.catalog.envs(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import conda_execute.config
+import conda_execute.events
+
+
+class Test_event_log(unittest.TestCase):
+    def setUp(self):
+        self.orig_config = (conda_execute.config.event_log,
+                            conda_execute.config.event_log_max_bytes,
+                            conda_execute.config.event_log_backups)
+        self.tmp_dir = tempfile.mkdtemp()
+        conda_execute.config.event_log = os.path.join(self.tmp_dir, 'events', 'events.jsonl')
+
+    def tearDown(self):
+        (conda_execute.config.event_log,
+         conda_execute.config.event_log_max_bytes,
+         conda_execute.config.event_log_backups) = self.orig_config
+        shutil.rmtree(self.tmp_dir)
+
+    def test_roundtrip(self):
+        for n in range(3):
+            conda_execute.events.record_event({'time': n, 'env': 'a' * 20, 'hit': True})
+        with open(conda_execute.config.event_log, 'a') as fh:
+            fh.write('{"time": 3, "env"')
+        events = list(conda_execute.events.read_events())
+        self.assertEqual([event['time'] for event in events], [0, 1, 2])
+        self.assertEqual([event['time'] for event in conda_execute.events.read_events(since=1)],
+                         [1, 2])
+
+    def test_rotation(self):
+        conda_execute.config.event_log_max_bytes = 100
+        conda_execute.config.event_log_backups = 2
+        for n in range(50):
+            conda_execute.events.record_event({'time': n, 'env': 'a' * 20})
+        log_dir = os.path.dirname(conda_execute.config.event_log)
+        self.assertEqual(sorted(fname for fname in os.listdir(log_dir) if not fname.startswith('.')),
+                         ['events.jsonl', 'events.jsonl.1', 'events.jsonl.2'])
+        times = [event['time'] for event in conda_execute.events.read_events()]
+        self.assertEqual(times, sorted(times))
+        self.assertEqual(times[-1], 49)
+        self.assertLess(len(times), 50)
+
+    def test_disabled(self):
+        conda_execute.config.event_log = None
+        conda_execute.events.record_event({'time': 0})
+        self.assertEqual(list(conda_execute.events.read_events()), [])
+
+
+class Test_Histogram(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = conda_execute.events.Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        for n in range(1, 1001):
+            histogram.add(n / 100.)
+        self.assertEqual(histogram.count, 1000)
+        self.assertEqual(histogram.max, 10)
+        for percent in [50, 95, 99]:
+            self.assertAlmostEqual(histogram.percentile(percent), percent / 10., delta=percent / 10. * 0.02)
+        self.assertEqual(histogram.percentile(100), 10)
+        # The number of buckets is bounded by the range of the values, not their number.
+        self.assertLess(len(histogram.buckets), 400)
+
+
+class Test_Stats(unittest.TestCase):
+    def test_aggregation(self):
+        stats = conda_execute.events.Stats()
+        for event in [{'time': 1, 'env': 'a', 'hit': False, 'code': 0, 'phases': {'env': 30}},
+                      {'time': 2, 'env': 'a', 'hit': True, 'code': 1, 'phases': {'env': 0.1}},
+                      {'time': 3, 'env': 'b', 'hit': False, 'code': 0, 'phases': {'env': 10}},
+                      {'time': 4, 'env': 'b', 'hit': False, 'code': 0, 'phases': {'env': 40}},
+                      {'time': 5, 'error': 'RuntimeError', 'phases': {}}]:
+            stats.add(event)
+        self.assertEqual((stats.runs, stats.hits, stats.failures), (5, 1, 2))
+        self.assertEqual((stats.first, stats.last), (1, 5))
+        self.assertEqual(stats.top_envs(1, 'created'), [('b', 2, 2, 50)])
+        self.assertEqual(sorted(stats.top_envs(5, 'runs')), [('a', 2, 1, 30), ('b', 2, 2, 50)])
+
+    def test_resources_compared_to_previous_build(self):
+        stats = conda_execute.events.Stats()
+        for env, hit, cpu, max_rss in [('a', False, 1, 100), ('a', True, 3, 200),
+                                       ('a', False, 4, 500), ('a', True, 4, 300),
+                                       ('b', False, 1, 1000), ('b', True, 1, 1000)]:
+            stats.add({'env': env, 'hit': hit, 'code': 0,
+                       'resources': {'wall': cpu, 'user': cpu, 'system': 0, 'max_rss': max_rss}})
+        # Runs without resources (e.g. on Windows) are ignored.
+        stats.add({'env': 'c', 'hit': False, 'code': 0, 'resources': {'wall': 1}})
+        self.assertEqual(stats.top_resources(5), [('a', 2, 4, 500, 2, 2.5),
+                                                  ('b', 2, 1, 1000, None, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,14 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
 import unittest
 
+import yaml
+
 from conda_execute.tests import tmp_script
 from conda_execute import execute
 
@@ -15,6 +24,197 @@ class Test_execute(unittest.TestCase):
                 execute.execute(fname)
 
 
+class Test_plan(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_warm_without_importing_conda(self):
+        script = os.path.join(self.tmp_dir, 'script.py')
+        with open(script, 'w') as fh:
+            fh.write('# conda execute\n# env:\n#  - python\n# run_with: {}\n'.format(sys.executable))
+        code = textwrap.dedent("""
+            import json, os, sys
+            import conda_execute.config
+            conda_execute.config.cache_conda_settings()
+            conda_execute.config.env_dir = {env_dir!r}
+            from conda_execute import execute, tmpenv
+            env = tmpenv.find_env(['python'])
+            if not os.path.isdir(os.path.join(env, 'conda-meta')):
+                os.makedirs(os.path.join(env, 'conda-meta'))
+                open(os.path.join(env, 'conda-meta', 'execution.log'), 'w').close()
+            plan = execute.plan({script!r})
+            # The warm execution, and the cleanup which follows it.
+            code = execute.execute({script!r})
+            tmpenv.cleanup_tmp_envs()
+            conda_modules = [name for name in sys.modules if name.split('.')[0] == 'conda']
+            print(json.dumps([plan, env, code, len(conda_modules)]))
+            """).format(env_dir=os.path.join(self.tmp_dir, 'tmp_envs'), script=script)
+        environ = dict(os.environ, HOME=self.tmp_dir)
+        # Merely importing the config doesn't cache the settings.
+        subprocess.check_call([sys.executable, '-c', 'import conda_execute.config'], env=environ)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, '.conda',
+                                                     'conda-execute-settings.json')))
+        # The first run imports conda to find (and cache) its settings.
+        for _ in range(2):
+            output = subprocess.check_output([sys.executable, '-c', code], env=environ)
+        plan, env, code, conda_modules = json.loads(output.decode('utf-8'))
+        self.assertEqual(plan, {'outcome': 'warm', 'prefix': env, 'spec': ['python'],
+                                'channels': []})
+        self.assertEqual(code, 0)
+        self.assertEqual(conda_modules, 0)
+
+    def test_settings_key_includes_condarc_d(self):
+        condarc_d = os.path.join(self.tmp_dir, '.config', 'conda', 'condarc.d')
+        os.makedirs(condarc_d)
+        code = textwrap.dedent("""
+            import conda_execute.config
+            print(conda_execute.config._conda_key)
+            """)
+        environ = dict(os.environ, HOME=self.tmp_dir)
+        environ.pop('XDG_CONFIG_HOME', None)
+        keys = [subprocess.check_output([sys.executable, '-c', code], env=environ)]
+        with open(os.path.join(condarc_d, 'channels.yml'), 'w') as fh:
+            fh.write('channels: [conda-forge]\n')
+        keys.append(subprocess.check_output([sys.executable, '-c', code], env=environ))
+        self.assertNotEqual(keys[0], keys[1])
+
+
+class Test_execute_within_env(unittest.TestCase):
+    def setUp(self):
+        if not hasattr(os, 'wait4'):
+            self.skipTest('Resource usage is only collected on Unix.')
+        self.env_prefix = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.env_prefix)
+
+    def test_resources(self):
+        resources = {}
+        code = execute.execute_within_env(
+            self.env_prefix, [sys.executable, '-c', 'import sys; data = bytearray(64 * 2 ** 20); '
+                                                    'sys.exit(3)'],
+            resources=resources)
+        self.assertEqual(code, 3)
+        self.assertGreater(resources['max_rss'], 64 * 2 ** 20)
+        self.assertGreater(resources['user'] + resources['system'], 0)
+        self.assertGreaterEqual(resources['wall'], resources['user'])
+        for key in ['blocks_in', 'blocks_out', 'voluntary_switches', 'involuntary_switches']:
+            self.assertGreaterEqual(resources[key], 0)
+        self.assertIn('Peak resident set size', execute.format_resources(resources))
+
+    def test_killed_by_signal(self):
+        code = execute.execute_within_env(
+            self.env_prefix, [sys.executable, '-c', 'import os; os.kill(os.getpid(), 9)'])
+        self.assertEqual(code, -9)
+
+
+class Test_run_within_env(unittest.TestCase):
+    def setUp(self):
+        self.env_prefix = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.env_prefix)
+
+    def run_python(self, code, **kwargs):
+        return execute.run_within_env(self.env_prefix, [sys.executable, '-c', code], **kwargs)
+
+    def test_capture(self):
+        lines = []
+        with open(os.path.join(self.env_prefix, 'stderr'), 'wb') as fh:
+            result = self.run_python('import sys; print("one"); print("two"); '
+                                     'sys.stderr.write("error"); sys.exit(2)',
+                                     stdout=lines.append, stderr=fh)
+        self.assertEqual((result.code, result.error), (2, None))
+        self.assertEqual(lines, [b'one\n', b'two\n'])
+        with open(os.path.join(self.env_prefix, 'stderr'), 'rb') as fh:
+            self.assertEqual(fh.read(), b'error')
+        self.assertIn('wall', result.resources)
+
+    def test_ring_buffer_keeps_the_end(self):
+        result = self.run_python('for n in range(100000): print(n)',
+                                 stdout=execute.RingBuffer(1024))
+        self.assertEqual(result.code, 0)
+        output = result.stdout.getvalue()
+        self.assertEqual(len(output), 1024)
+        self.assertTrue(output.endswith(b'99998\n99999\n'))
+        self.assertEqual(result.stdout.discarded, sum(len(str(n)) + 1 for n in range(100000)) - 1024)
+
+    def test_failing_callback_raised(self):
+        def callback(line):
+            raise ValueError(line)
+
+        # The output is drained, so the command still runs to completion.
+        with self.assertRaises(ValueError):
+            self.run_python('for n in range(100000): print(n)', stdout=callback)
+
+    def test_launch_error(self):
+        result = execute.run_within_env(self.env_prefix, ['conda-execute-no-such-command'])
+        self.assertIsNone(result.code)
+        self.assertIsInstance(result.error, OSError)
+        self.assertEqual(execute.execute_within_env(self.env_prefix,
+                                                    ['conda-execute-no-such-command']), 42)
+
+
+class Test__profile_command(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmp_dir, 'script.py')
+        with open(self.script, 'w') as fh:
+            fh.write('import sys\n'
+                     'def busy_function():\n'
+                     '    return [str(n) for n in range(10000)]\n'
+                     'data = busy_function()\n'
+                     'sys.exit(int(sys.argv[1]))\n')
+        self.output = os.path.join(self.tmp_dir, 'profile')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_profiled(self, profiler):
+        cmd = execute._profile_command([sys.executable], self.script, ['3'], profiler, self.output)
+        self.assertEqual(subprocess.call(cmd), 3)
+        with open(self.output + '.txt') as fh:
+            return fh.read()
+
+    def test_cprofile(self):
+        self.assertIn('busy_function', self.run_profiled('cprofile'))
+        self.assertTrue(os.path.exists(self.output + '.pstats'))
+
+    def test_tracemalloc(self):
+        self.assertIn('script.py:3', self.run_profiled('tracemalloc'))
+        self.assertTrue(os.path.exists(self.output + '.tracemalloc'))
+
+    def test_env_shebang(self):
+        # The run_with of a "#!/usr/bin/env python" script.
+        cmd = execute._profile_command(['/usr/bin/env', 'python'], self.script, ['3'], 'cprofile',
+                                       self.output)
+        self.assertEqual(cmd[:3], ['/usr/bin/env', 'python', '-c'])
+        self.assertIsNotNone(execute._profile_command(
+            ['/usr/bin/env', '-u', 'PYTHONPATH', 'FOO=1', 'python3.6', '-u'], self.script, [],
+            'cprofile', self.output))
+        self.assertIsNone(execute._profile_command(['/usr/bin/env', 'bash'], self.script, [],
+                                                   'cprofile', self.output))
+        self.assertIsNone(execute._profile_command(['/usr/bin/env'], self.script, [],
+                                                   'cprofile', self.output))
+        if os.path.exists('/usr/bin/env'):
+            cmd = execute._profile_command(['/usr/bin/env', sys.executable], self.script, ['3'],
+                                           'cprofile', self.output)
+            self.assertEqual(subprocess.call(cmd), 3)
+            with open(self.output + '.txt') as fh:
+                self.assertIn('busy_function', fh.read())
+
+    def test_not_python(self):
+        self.assertIsNone(execute._profile_command(['bash'], self.script, [], 'cprofile',
+                                                   self.output))
+        self.assertIsNone(execute._profile_command(['python', '-m', 'pytest'], self.script, [],
+                                                   'cprofile', self.output))
+        self.assertIsNotNone(execute._profile_command(['python3.6', '-u'], self.script, [],
+                                                      'cprofile', self.output))
+
+
 class Test_extract_spec(unittest.TestCase):
     def get_spec(self, script):
         with tmp_script(script) as fname:
@@ -93,5 +293,46 @@ class Test_extract_spec(unittest.TestCase):
         spec = self.get_spec(script)
         self.assertEqual(spec, {'run_with': ['python']})
 
+    def test_header_beyond_line_budget(self):
+        script = 'echo\n' * 10 + '# conda execute\n# env: [python]'
+        with tmp_script(script) as fname:
+            with open(fname, 'r') as fh:
+                self.assertEqual(execute.extract_spec(fh, max_lines=5),
+                                 {'run_with': ['/bin/sh', '-c']})
+            with open(fname, 'r') as fh:
+                self.assertEqual(execute.extract_spec(fh, max_lines=50),
+                                 {'env': ['python'], 'run_with': ['/bin/sh', '-c']})
+
+
+class Test_parse_spec(unittest.TestCase):
+    def assertParsesLikeYAML(self, lines):
+        self.assertEqual(execute.parse_spec(lines), yaml.safe_load('\n'.join(lines)) or {})
+
+    def test_simple_forms(self):
+        lines = ['channels:', '- conda-forge', 'env:', '- python >=3', '- "numpy 1.10*"',
+                 'run_with: [python, "-u"]']
+        self.assertIsNotNone(execute._parse_simple_spec(lines))
+        self.assertParsesLikeYAML(lines)
+
+    def test_complex_forms_fall_back_to_yaml(self):
+        for lines in [['env:', '- 1.10'], ['pin: true'], ['run_with: {a: b}'],
+                      ['env: [a, [b]]'], ['env:', '- a: b']]:
+            self.assertIsNone(execute._parse_simple_spec(lines))
+            self.assertParsesLikeYAML(lines)
+
+
+class Test__write_code_to_memfd(unittest.TestCase):
+    def test_executable_by_child(self):
+        in_memory = execute._write_code_to_memfd('echo hello\n')
+        if in_memory is None:
+            self.skipTest('Anonymous files are not supported on this platform.')
+        path, fd = in_memory
+        try:
+            output = subprocess.check_output(['/bin/sh', path], pass_fds=(fd, ))
+        finally:
+            os.close(fd)
+        self.assertEqual(output.strip(), b'hello')
+
+
 if __name__ == '__main__':
     unittest.main()
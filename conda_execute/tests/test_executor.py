@@ -0,0 +1,158 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import conda_execute.archive
+import conda_execute.config
+import conda_execute.events
+import conda_execute.usage
+from conda_execute import execute
+from conda_execute.executor import Executor
+from conda_execute.tmpenv import find_env
+
+
+SCRIPT = """\
+# conda execute
+# env:
+#  - python
+# run_with: {}
+import sys
+sys.exit(int(sys.argv[1]) + {})
+"""
+
+
+class Test_Executor(unittest.TestCase):
+    def setUp(self):
+        self.orig_event_log = conda_execute.config.event_log
+        self.tmp_dir = tempfile.mkdtemp()
+        conda_execute.config.event_log = os.path.join(self.tmp_dir, 'events.jsonl')
+        self.env_dir = os.path.join(self.tmp_dir, 'envs')
+        self.executor = Executor(env_dir=self.env_dir)
+        self.env = self.make_env(['python'])
+        self.script = os.path.join(self.tmp_dir, 'script.py')
+        self.write_script(self.script, 0)
+
+    def tearDown(self):
+        conda_execute.config.event_log = self.orig_event_log
+        shutil.rmtree(self.tmp_dir)
+
+    def make_env(self, spec):
+        orig_env_dir = conda_execute.config.env_dir
+        conda_execute.config.env_dir = self.env_dir
+        try:
+            env = find_env(spec)
+        finally:
+            conda_execute.config.env_dir = orig_env_dir
+        os.makedirs(os.path.join(env, 'conda-meta'))
+        open(os.path.join(env, 'conda-meta', 'execution.log'), 'w').close()
+        return env
+
+    def write_script(self, path, offset):
+        with open(path, 'w') as fh:
+            fh.write(SCRIPT.format(sys.executable, offset))
+
+    def test_run_in_explicit_env_dir(self):
+        orig_env_dir = conda_execute.config.env_dir
+        self.assertEqual(self.executor.ensure_env(['python']), self.env)
+        self.assertEqual(self.executor.run(self.script, ['3']), 3)
+        self.assertEqual(conda_execute.config.env_dir, orig_env_dir)
+        self.assertTrue(os.path.isdir(os.path.join(self.env_dir, '.usage')))
+        # The env_dir has its own event log.
+        self.assertEqual(list(conda_execute.events.read_events()), [])
+        with self.executor._configured():
+            event, = conda_execute.events.read_events()
+        self.assertEqual((event['env'], event['hit'], event['code']),
+                         (os.path.basename(self.env), True, 3))
+
+    def test_spec_parsed_again_once_changed(self):
+        self.assertEqual(self.executor.run(self.script, ['3']), 3)
+        self.assertEqual(list(self.executor._specs), [self.script])
+        self.write_script(self.script, 10)
+        os.utime(self.script, (0, 0))
+        self.assertEqual(self.executor.run(self.script, ['3']), 13)
+
+    def test_execute_captures_output(self):
+        with open(self.script, 'w') as fh:
+            fh.write('# conda execute\n# env:\n#  - python\n# run_with: {}\n'
+                     'print("output")\n'.format(sys.executable))
+        result = self.executor.execute(self.script, stdout=execute.RingBuffer())
+        self.assertEqual((result.code, result.error), (0, None))
+        self.assertEqual(result.stdout.getvalue(), b'output\n')
+        self.assertIn('run', result.phases)
+        self.assertIn('wall', result.resources)
+
+    def test_launch_error_raised(self):
+        with open(self.script, 'w') as fh:
+            fh.write('# conda execute\n# env:\n#  - python\n# run_with: no-such-command\n')
+        result = self.executor.execute(self.script)
+        self.assertIsInstance(result.error, OSError)
+        with self.assertRaises(OSError):
+            self.executor.run(self.script)
+
+    def test_run_code(self):
+        with open(self.script, 'r') as fh:
+            source = fh.read()
+        self.assertEqual(self.executor.run_code(source, ['4']), 4)
+        self.assertEqual(self.executor.run_code(source, ['5']), 5)
+
+    def test_concurrent_runs(self):
+        results = {}
+
+        def run(n):
+            results[n] = self.executor.run(self.script, [str(n)])
+
+        threads = [threading.Thread(target=run, args=(n, )) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, dict((n, n) for n in range(8)))
+
+    def test_archives_kept_apart(self):
+        other = Executor(env_dir=os.path.join(self.tmp_dir, 'other_envs'))
+        self.assertNotEqual(self.executor._config['archive_dir'], other._config['archive_dir'])
+        with self.executor._configured():
+            archive = conda_execute.archive.archive_env(self.env)
+        self.assertTrue(archive.startswith(self.env_dir + '_archive' + os.sep))
+        # The other tree neither sees, nor restores, the archive of this one.
+        with other._configured():
+            other_env = find_env(['python'])
+            self.assertIsNone(conda_execute.archive.archive_path(other_env))
+        with self.executor._configured():
+            self.assertEqual(conda_execute.archive.archive_path(self.env), archive)
+
+    def test_verification_without_loading_index(self):
+        executor = Executor(env_dir=self.env_dir, verify_envs=True, verify_interval=0)
+        loaded = []
+        executor._index = lambda channels: loaded.append(channels)
+        self.assertEqual(executor.ensure_env(['python']), self.env)
+        self.assertEqual(loaded, [])
+
+    def test_configuration_shared_by_identical_executors(self):
+        same = Executor(env_dir=self.env_dir)
+        other = Executor(env_dir=os.path.join(self.tmp_dir, 'other_envs'))
+        entered = []
+
+        def configure(executor):
+            with executor._configured():
+                entered.append(conda_execute.config.env_dir)
+
+        with self.executor._configured():
+            thread = threading.Thread(target=configure, args=(same, ))
+            thread.start()
+            thread.join(5)
+            self.assertEqual(entered, [self.env_dir])
+            thread = threading.Thread(target=configure, args=(other, ))
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+        thread.join(5)
+        self.assertEqual(entered, [self.env_dir, other._config['env_dir']])
+        self.assertNotEqual(conda_execute.config.env_dir, other._config['env_dir'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,14 @@
 
 import os
+import shutil
+import subprocess
+import sys
 import tempfile
+import threading
 import unittest
 import uuid
 
-from conda_execute.lock import Locked
+from conda_execute.lock import Locked, Semaphore, is_locked
 
 
 class Test_Locked(unittest.TestCase):
@@ -16,5 +20,89 @@ class Test_Locked(unittest.TestCase):
             assert os.path.isdir(locked.directory_path)
 
 
+class Test_is_locked(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.env = os.path.join(self.directory, 'a' * 20)
+        self.lock_dir = os.path.join(self.directory, '.conda-lock_' + 'a' * 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def lock_file(self, pid):
+        path = os.path.join(self.lock_dir, '.conda-lock_{}.pid{}.conda_lock'.format('a' * 20, pid))
+        open(path, 'w').close()
+        return path
+
+    def test_released_lock_dir_left_behind(self):
+        self.assertFalse(is_locked(self.env))
+        os.makedirs(self.lock_dir)
+        self.assertFalse(is_locked(self.env))
+
+    def test_live_and_dead_holders(self):
+        os.makedirs(self.lock_dir)
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        self.lock_file(process.pid)
+        self.assertFalse(is_locked(self.env))
+        self.lock_file(os.getpid())
+        self.assertTrue(is_locked(self.env))
+
+
+class Test_Semaphore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def slots_held(self):
+        return sorted(os.listdir(os.path.join(self.directory, 'slots')))
+
+    def test_slots(self):
+        with Semaphore(self.directory, 2):
+            with Semaphore(self.directory, 2):
+                self.assertEqual(self.slots_held(), ['slot-0', 'slot-1'])
+            self.assertEqual(self.slots_held(), ['slot-0'])
+        self.assertEqual(self.slots_held(), [])
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'queue')), [])
+
+    def test_stale_slot_reclaimed(self):
+        # A slot held by a process which has since exited.
+        proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+        proc.wait()
+        os.makedirs(os.path.join(self.directory, 'slots'))
+        with open(os.path.join(self.directory, 'slots', 'slot-0'), 'w') as fh:
+            fh.write('{}, 0'.format(proc.pid))
+        with Semaphore(self.directory, 1, poll_interval=0.01):
+            with open(os.path.join(self.directory, 'slots', 'slot-0')) as fh:
+                self.assertEqual(int(fh.read().split(',')[0]), os.getpid())
+
+    def test_threads_contending_for_a_slot(self):
+        held, errors = [], []
+        lock = threading.Lock()
+
+        def create():
+            try:
+                for _ in range(20):
+                    with Semaphore(self.directory, 2, poll_interval=0.001):
+                        with lock:
+                            held.append(threading.current_thread().ident)
+                            self.assertLessEqual(len(held), 2)
+                        with lock:
+                            held.remove(threading.current_thread().ident)
+            except Exception as exception:
+                errors.append(exception)
+
+        threads = [threading.Thread(target=create) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.slots_held(), [])
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'queue')), [])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import conda_execute.catalog
+import conda_execute.config
+import conda_execute.events
+import conda_execute.metrics
+
+
+class Test_metrics(unittest.TestCase):
+    def setUp(self):
+        self.orig_config = (conda_execute.config.env_dir, conda_execute.config.pkg_dir,
+                            conda_execute.config.archive_dir, conda_execute.config.event_log,
+                            conda_execute.config.event_log_max_bytes)
+        self.tmp_dir = tempfile.mkdtemp()
+        conda_execute.config.env_dir = os.path.join(self.tmp_dir, 'tmp_envs')
+        conda_execute.config.pkg_dir = os.path.join(self.tmp_dir, 'pkgs')
+        conda_execute.config.archive_dir = os.path.join(self.tmp_dir, 'tmp_envs_archive')
+        conda_execute.config.event_log = os.path.join(self.tmp_dir, 'events.jsonl')
+        os.makedirs(conda_execute.config.pkg_dir)
+        with open(os.path.join(conda_execute.config.pkg_dir, 'package.tar.bz2'), 'w') as fh:
+            fh.write('x' * 100)
+
+        self.env = conda_execute.catalog.env_path('a' * 20)
+        os.makedirs(os.path.join(self.env, 'conda-meta'))
+        with open(os.path.join(self.env, 'conda-meta', 'execution.log'), 'w') as fh:
+            fh.write('{}, {}\n'.format(os.getpid(), 0))
+        with open(os.path.join(self.env, 'file'), 'w') as fh:
+            fh.write('x' * 10)
+        conda_execute.catalog.add(self.env)
+
+    def tearDown(self):
+        (conda_execute.config.env_dir, conda_execute.config.pkg_dir,
+         conda_execute.config.archive_dir, conda_execute.config.event_log,
+         conda_execute.config.event_log_max_bytes) = self.orig_config
+        shutil.rmtree(self.tmp_dir)
+
+    def samples(self):
+        return dict(line.rsplit(' ', 1) for line in conda_execute.metrics.collect().splitlines()
+                    if not line.startswith('#'))
+
+    def test_collect(self):
+        conda_execute.events.record_event({'env': 'a' * 20, 'hit': False, 'code': 0, 'startup': 40,
+                                           'phases': {'env': 39, 'solve': 7}})
+        conda_execute.events.record_event({'env': 'a' * 20, 'hit': True, 'code': 2, 'startup': 0.2,
+                                           'phases': {'env': 0.01}})
+        samples = self.samples()
+        self.assertEqual(samples['conda_execute_envs{tier="live"}'], '1')
+        self.assertEqual(samples['conda_execute_env_bytes{env="aaaaaaaaaaaaaaaaaaaa"}'],
+                         str(conda_execute.archive.disk_usage(self.env)))
+        self.assertEqual(samples['conda_execute_env_running_pids{env="aaaaaaaaaaaaaaaaaaaa"}'], '0')
+        self.assertEqual(samples['conda_execute_pkg_dir_bytes'],
+                         str(conda_execute.archive.disk_usage(conda_execute.config.pkg_dir)))
+        self.assertEqual(samples['conda_execute_runs_total{cache="hit"}'], '1')
+        self.assertEqual(samples['conda_execute_runs_total{cache="miss"}'], '1')
+        self.assertEqual(samples['conda_execute_failures_total{reason="exit_code"}'], '1')
+        self.assertEqual(samples['conda_execute_solves_total'], '1')
+        self.assertEqual(samples['conda_execute_solve_seconds_bucket{le="10"}'], '1')
+        self.assertEqual(samples['conda_execute_solve_seconds_bucket{le="5"}'], '0')
+        self.assertEqual(samples['conda_execute_startup_seconds_count{cache="miss"}'], '1')
+        self.assertEqual(samples['conda_execute_startup_seconds_bucket{cache="hit",le="0.25"}'], '1')
+
+    def test_counters_survive_rotation(self):
+        conda_execute.config.event_log_max_bytes = 150
+        conda_execute.events.record_event({'env': 'a' * 20, 'hit': True, 'code': 0})
+        self.assertEqual(self.samples()['conda_execute_runs_total{cache="hit"}'], '1')
+        for _ in range(5):
+            conda_execute.events.record_event({'env': 'a' * 20, 'hit': True, 'code': 0})
+        self.assertTrue(os.path.exists(conda_execute.config.event_log + '.1'))
+        self.assertEqual(self.samples()['conda_execute_runs_total{cache="hit"}'], '6')
+        self.assertEqual(self.samples()['conda_execute_runs_total{cache="hit"}'], '6')
+
+    def test_write_textfile(self):
+        path = os.path.join(self.tmp_dir, 'textfile', 'conda_execute.prom')
+        conda_execute.metrics.write_textfile(path)
+        with open(path) as fh:
+            self.assertIn('# TYPE conda_execute_envs gauge\n', fh.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+import conda_execute.config
+import conda_execute.remote
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    requests_seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_response(self, code, *args):
+        self.requests_seen.append(code)
+        SimpleHTTPRequestHandler.send_response(self, code, *args)
+
+
+class Test_fetch_script(unittest.TestCase):
+    def setUp(self):
+        self.orig_cache_dir = conda_execute.config.script_cache_dir
+        self.cache_dir = conda_execute.config.script_cache_dir = tempfile.mkdtemp()
+        self.serve_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.serve_dir, 'script.sh'), 'w') as fh:
+            fh.write('echo hello\n')
+        self.orig_cwd = os.getcwd()
+        os.chdir(self.serve_dir)
+        QuietHandler.requests_seen = []
+        self.server = HTTPServer(('127.0.0.1', 0), QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}/script.sh'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.orig_cwd)
+        conda_execute.config.script_cache_dir = self.orig_cache_dir
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.serve_dir)
+
+    def test_download_then_revalidate(self):
+        path, entry = conda_execute.remote.fetch_script(self.url, max_age=0)
+        with open(path) as fh:
+            self.assertEqual(fh.read(), 'echo hello\n')
+        entry['spec'] = {'env': ['python']}
+        conda_execute.remote.write_entry(self.url, entry)
+
+        path2, entry2 = conda_execute.remote.fetch_script(self.url, max_age=0)
+        self.assertEqual(path, path2)
+        self.assertEqual(entry2['spec'], {'env': ['python']})
+        self.assertEqual(QuietHandler.requests_seen, [200, 304])
+
+    def test_max_age_avoids_network(self):
+        conda_execute.remote.fetch_script(self.url, max_age=0)
+        conda_execute.remote.fetch_script(self.url, max_age=3600)
+        self.assertEqual(QuietHandler.requests_seen, [200])
+
+    def test_prune_script_cache(self):
+        path, _ = conda_execute.remote.fetch_script(self.url, max_age=0)
+        orphan = conda_execute.remote._object_path('0' * 64)
+        with open(orphan, 'w') as fh:
+            fh.write('echo old\n')
+        conda_execute.remote.prune_script_cache()
+        # The orphan may still be a download in progress.
+        self.assertTrue(os.path.exists(orphan))
+        os.utime(orphan, (0, 0))
+        conda_execute.remote.prune_script_cache()
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(path))
+        os.utime(conda_execute.remote._entry_path(self.url), (0, 0))
+        os.utime(path, (0, 0))
+        conda_execute.remote.prune_script_cache()
+        self.assertEqual(conda_execute.remote.read_entry(self.url), {})
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
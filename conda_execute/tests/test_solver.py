@@ -0,0 +1,271 @@
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import types
+import unittest
+
+import psutil
+
+import conda_execute.config
+import conda_execute.solver
+
+
+FAKE_MICROMAMBA = """\
+#!{}
+import json, os, sys
+with open(os.path.join(os.path.dirname(sys.argv[0]), 'calls'), 'a') as fh:
+    fh.write(json.dumps([os.environ['CONDA_PKGS_DIRS']] + sys.argv[1:]) + '\\n')
+link = []
+if '--dry-run' in sys.argv:
+    link = [{{'name': 'python', 'version': '3.6.0', 'build_string': '0', 'size': 100}},
+            {{'name': 'openssl', 'version': '1.0.2', 'build_string': 'h1_0', 'size': 10}}]
+print(json.dumps({{'success': True, 'actions': {{'LINK': link}}}}))
+"""
+
+
+class Test_get_backend(unittest.TestCase):
+    def setUp(self):
+        self.orig_solver = conda_execute.config.solver
+
+    def tearDown(self):
+        conda_execute.config.solver = self.orig_solver
+
+    def test_from_config(self):
+        self.assertEqual(conda_execute.solver.get_backend().name, 'conda')
+        conda_execute.config.solver = 'micromamba'
+        self.assertIsInstance(conda_execute.solver.get_backend(),
+                              conda_execute.solver.MicromambaBackend)
+        self.assertEqual(conda_execute.solver.get_backend('libmamba').name, 'libmamba')
+
+    def test_unknown(self):
+        with self.assertRaisesRegexp(ValueError, 'Unknown solver .*mamba'):
+            conda_execute.solver.get_backend('mamba')
+
+
+class Test_MicromambaBackend(unittest.TestCase):
+    def setUp(self):
+        self.orig_config = (conda_execute.config.micromamba, conda_execute.config.env_dir,
+                            conda_execute.config.pkg_dir)
+        self.tmp_dir = tempfile.mkdtemp()
+        conda_execute.config.micromamba = os.path.join(self.tmp_dir, 'micromamba')
+        conda_execute.config.env_dir = os.path.join(self.tmp_dir, 'envs')
+        conda_execute.config.pkg_dir = os.path.join(self.tmp_dir, 'pkgs')
+        with open(conda_execute.config.micromamba, 'w') as fh:
+            fh.write(FAKE_MICROMAMBA.format(sys.executable))
+        os.chmod(conda_execute.config.micromamba, stat.S_IRWXU)
+        self.backend = conda_execute.solver.MicromambaBackend()
+
+    def tearDown(self):
+        (conda_execute.config.micromamba, conda_execute.config.env_dir,
+         conda_execute.config.pkg_dir) = self.orig_config
+        shutil.rmtree(self.tmp_dir)
+
+    def calls(self):
+        with open(os.path.join(self.tmp_dir, 'calls')) as fh:
+            return [json.loads(line) for line in fh]
+
+    def test_solve_and_link(self):
+        index = self.backend.get_index(['conda-forge'])
+        packages = self.backend.solve(index, ['python 3.6*'])
+        self.assertEqual(packages, ['openssl-1.0.2-h1_0', 'python-3.6.0-0'])
+        self.assertEqual(index['python-3.6.0-0']['size'], 100)
+
+        prefix = os.path.join(self.tmp_dir, 'env')
+        self.backend.link(prefix, index, packages)
+        os.makedirs(os.path.join(prefix, 'conda-meta'))
+        self.backend.link(prefix, index, ['conda-forge::six-1.10.0-py36_0'])
+
+        solve, create, install = self.calls()
+        self.assertEqual(solve[0], conda_execute.config.pkg_dir)
+        self.assertEqual(solve[1], 'create')
+        self.assertEqual(solve[-4:], ['--channel', 'conda-forge', '--dry-run', 'python 3.6*'])
+        self.assertEqual(create[1], 'create')
+        self.assertEqual(create[-2:], ['openssl=1.0.2=h1_0', 'python=3.6.0=0'])
+        self.assertEqual(install[1], 'install')
+        self.assertEqual(install[install.index('--prefix') + 1], prefix)
+        self.assertEqual(install[-1], 'conda-forge::six=1.10.0=py36_0')
+
+
+class FakeRecord(object):
+    def __init__(self, dist_str):
+        self._dist_str = dist_str
+
+    def dist_str(self):
+        return self._dist_str
+
+
+class Test_LibMambaBackend(unittest.TestCase):
+    def test_records_of_resumed_creation(self):
+        solves = []
+
+        class FakeSolver(object):
+            def __init__(self, specs):
+                self.specs = specs
+
+            def solve_final_state(self):
+                solves.append(self.specs)
+                return [FakeRecord('conda-forge::python-3.6.0-0'),
+                        FakeRecord('conda-forge::openssl-1.0.2-h1_0')]
+
+        backend = conda_execute.solver.LibMambaBackend()
+        backend._solver = lambda prefix, channels, specs: FakeSolver(specs)
+        # A fresh index, as a process resuming a creation from its journal has.
+        index = backend.get_index(['conda-forge'])
+        records = backend._records(index, ['conda-forge::python-3.6.0-0'])
+        self.assertEqual([record.dist_str() for record in records],
+                         ['conda-forge::python-3.6.0-0'])
+        self.assertEqual(solves, [['conda-forge::python=3.6.0=0']])
+        # The records which the index has are used as they are.
+        backend._records(index, ['conda-forge::openssl-1.0.2-h1_0'])
+        self.assertEqual(len(solves), 1)
+
+
+    def test_link_without_solving(self):
+        transactions = []
+
+        class FakeTransaction(object):
+            def __init__(self, *setups):
+                self.setups = setups
+
+            def execute(self):
+                transactions.append(self.setups)
+
+        modules = {
+            'conda.core': types.ModuleType('conda.core'),
+            'conda.core.link': types.ModuleType('conda.core.link'),
+            'conda.models': types.ModuleType('conda.models'),
+            'conda.models.match_spec': types.ModuleType('conda.models.match_spec'),
+            'conda.models.prefix_graph': types.ModuleType('conda.models.prefix_graph'),
+        }
+        modules['conda.core.link'].PrefixSetup = lambda *args: args
+        modules['conda.core.link'].UnlinkLinkTransaction = FakeTransaction
+        modules['conda.models.match_spec'].MatchSpec = str
+        # Dependency order, as the graph would give it.
+        modules['conda.models.prefix_graph'].PrefixGraph = lambda records: type(
+            'Graph', (), {'graph': sorted(records, key=lambda record: record.dist_str())})
+        for name, module in modules.items():
+            if name in sys.modules:
+                self.addCleanup(sys.modules.__setitem__, name, sys.modules[name])
+            else:
+                self.addCleanup(sys.modules.pop, name, None)
+            sys.modules[name] = module
+
+        backend = conda_execute.solver.LibMambaBackend()
+        backend.solve = lambda index, specs: self.fail('Solved again.')
+        index = backend.get_index(['conda-forge'])
+        packages = ['python-3.6.0-0', 'openssl-1.0.2-h1_0']
+        for dist in packages:
+            index[dist] = FakeRecord(dist)
+        backend.link('/prefix', index, packages)
+        (setup, ), = transactions
+        prefix, unlink, link, remove, update, neutered = setup
+        self.assertEqual(prefix, '/prefix')
+        self.assertEqual([record.dist_str() for record in link], sorted(packages))
+        self.assertEqual(update, ('python=3.6.0=0', 'openssl=1.0.2=h1_0'))
+
+
+class FakeBackend(object):
+    """Solves to the pid of the solving process (slowly, or greedily, if asked)."""
+    name = 'fake'
+
+    def get_index(self, channels):
+        return conda_execute.solver._Index(channels)
+
+    def solve(self, index, specs):
+        if 'slow' in specs:
+            time.sleep(60)
+        if 'greedy' in specs:
+            memory = bytearray(1024 ** 3)
+        if 'channels' in specs:
+            return ['-'.join(index.channels + ['0', '0'])]
+        dist = 'pid-{}-0'.format(os.getpid())
+        index[dist] = {'size': 0}
+        return [dist]
+
+    def dist_from_str(self, dist_str):
+        return dist_str
+
+
+conda_execute.solver._BACKENDS['fake'] = FakeBackend
+
+
+class Test_solve(unittest.TestCase):
+    def setUp(self):
+        self.orig_config = (conda_execute.config.env_dir, conda_execute.config.solve_timeout,
+                            conda_execute.config.solve_max_memory_bytes)
+        self.tmp_dir = tempfile.mkdtemp()
+        conda_execute.config.env_dir = self.tmp_dir
+        conda_execute.config.solve_timeout = 2
+        self.backend = FakeBackend()
+        self.index = self.backend.get_index([])
+
+    def tearDown(self):
+        conda_execute.solver.stop_workers()
+        (conda_execute.config.env_dir, conda_execute.config.solve_timeout,
+         conda_execute.config.solve_max_memory_bytes) = self.orig_config
+        shutil.rmtree(self.tmp_dir)
+
+    def solve(self, specs):
+        return conda_execute.solver.solve(self.backend, self.index, specs)
+
+    def test_worker_reused(self):
+        packages = self.solve(['python'])
+        self.assertEqual(self.solve(['numpy']), packages)
+        self.assertNotEqual(packages, ['pid-{}-0'.format(os.getpid())])
+        self.assertIn(packages[0], self.index)
+
+    def test_worker_solves_against_given_index(self):
+        index = self.backend.get_index(['loaded', 'by', 'parent'])
+        packages = conda_execute.solver.solve(self.backend, index, ['channels'])
+        self.assertEqual(packages, ['loaded-by-parent-0-0'])
+
+    def test_worker_died_before_receiving_index(self):
+        worker = conda_execute.solver._Worker(0)
+        worker.process.terminate()
+        worker.process.join()
+        take_worker = conda_execute.solver._take_worker
+        conda_execute.solver._take_worker = lambda max_memory: worker
+        self.addCleanup(setattr, conda_execute.solver, '_take_worker', take_worker)
+        index = self.backend.get_index(['x' * 1024 ** 2])
+        with self.assertRaisesRegexp(conda_execute.solver.SolveFailure, 'died'):
+            conda_execute.solver.solve(self.backend, index, ['python'])
+        with self.assertRaisesRegexp(conda_execute.solver.SolveFailure, r'failed \(died\)'):
+            self.solve(['python'])
+
+    @unittest.skipIf(not hasattr(conda_execute.solver.multiprocessing, 'get_context'),
+                     'Python 2 can only fork.')
+    def test_workers_not_forked(self):
+        self.assertNotEqual(conda_execute.solver._context().get_start_method(), 'fork')
+
+    def test_in_process_without_timeout(self):
+        conda_execute.config.solve_timeout = 0
+        self.assertEqual(self.solve(['python']), ['pid-{}-0'.format(os.getpid())])
+
+    def test_timeout_fails_fast(self):
+        start = time.time()
+        with self.assertRaisesRegexp(conda_execute.solver.SolveFailure, 'longer than 2s'):
+            self.solve(['slow'])
+        self.assertLess(time.time() - start, 30)
+        with self.assertRaisesRegexp(conda_execute.solver.SolveFailure, r'failed \(timeout\)'):
+            self.solve(['slow'])
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp_dir, '.solve-failures'))), 1)
+        # Other specs are unaffected.
+        self.solve(['python'])
+
+    @unittest.skipIf(conda_execute.solver.resource is None, 'Memory limits are unsupported.')
+    def test_memory_limit(self):
+        conda_execute.config.solve_max_memory_bytes = (psutil.Process().memory_info().vms +
+                                                       200 * 1024 ** 2)
+        with self.assertRaisesRegexp(conda_execute.solver.SolveFailure, 'more than'):
+            self.solve(['greedy'])
+        with self.assertRaisesRegexp(conda_execute.solver.SolveFailure, r'failed \(memory\)'):
+            self.solve(['greedy'])
+        self.solve(['python'])
+
+
+if __name__ == '__main__':
+    unittest.main()
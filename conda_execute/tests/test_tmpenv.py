@@ -1,9 +1,21 @@
+import argparse
+import json
 import logging
+import marshal
 import os
+import shutil
+import tempfile
+import time
 import unittest
 
+import yaml
+
+import conda_execute.archive
+import conda_execute.config
 import conda_execute.execute
+import conda_execute.solver
 import conda_execute.tmpenv
+import conda_execute.utils
 
 from conda_execute.tests import tmp_script
 
@@ -30,5 +42,385 @@ class Test_tmpenv(unittest.TestCase):
             conda_execute.tmpenv.cleanup_tmp_envs()
 
 
+class Test_envs_and_running_pids(unittest.TestCase):
+    def setUp(self):
+        self.orig_env_dir = conda_execute.config.env_dir
+        self.env_dir = conda_execute.config.env_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        conda_execute.config.env_dir = self.orig_env_dir
+        shutil.rmtree(self.env_dir)
+
+    def test_idle_env_has_stats(self):
+        # An environment with no running processes must still report its
+        # last usage, otherwise it would be cleaned up regardless of age.
+        env = os.path.join(self.env_dir, 'a' * 20)
+        os.makedirs(os.path.join(env, 'conda-meta'))
+        conda_execute.tmpenv.touch_env_usage(env)
+        [(found_env, stats)] = list(conda_execute.tmpenv.envs_and_running_pids())
+        self.assertEqual(found_env, env)
+        self.assertEqual(stats['alive_PIDs'], [])
+        conda_execute.tmpenv.cleanup_tmp_envs()
+        self.assertTrue(os.path.isdir(env))
+
+    def make_idle_env(self, name, hours_idle):
+        env = os.path.join(self.env_dir, name * 20)
+        os.makedirs(os.path.join(env, 'conda-meta'))
+        conda_execute.tmpenv.touch_env_usage(env)
+        last_used = time.time() - hours_idle * 60 * 60
+        os.utime(os.path.join(env, 'conda-meta', 'execution.log'), (last_used, last_used))
+        return env
+
+    def test_retention(self):
+        expired = self.make_idle_env('a', 48)
+        kept = self.make_idle_env('b', 48)
+        conda_execute.tmpenv.update_retention(kept, keep_for='1w')
+        pinned = self.make_idle_env('c', 48)
+        conda_execute.tmpenv.update_retention(pinned, pin=True)
+        fresh = self.make_idle_env('d', 20)
+        conda_execute.tmpenv.cleanup_tmp_envs(min_age=1)
+        self.assertFalse(os.path.exists(expired))
+        self.assertTrue(os.path.isdir(kept))
+        self.assertTrue(os.path.isdir(pinned))
+        self.assertTrue(os.path.isdir(fresh))
+
+    def test_archive_idle_envs(self):
+        orig_archive_dir = conda_execute.config.archive_dir
+        conda_execute.config.archive_dir = self.env_dir + '_archive'
+        self.addCleanup(setattr, conda_execute.config, 'archive_dir', orig_archive_dir)
+        self.addCleanup(shutil.rmtree, conda_execute.config.archive_dir, True)
+        idle = self.make_idle_env('a', 3)
+        pinned = self.make_idle_env('b', 3)
+        conda_execute.tmpenv.update_retention(pinned, pin=True)
+        recent = self.make_idle_env('c', 1)
+        # Cleaning up doesn't archive.
+        conda_execute.tmpenv.cleanup_tmp_envs()
+        self.assertTrue(os.path.isdir(idle))
+        self.assertEqual(conda_execute.tmpenv.archive_idle_envs(min_age=2), [idle])
+        self.assertFalse(os.path.exists(idle))
+        self.assertTrue(conda_execute.archive.archive_path(idle))
+        self.assertTrue(os.path.isdir(pinned))
+        self.assertTrue(os.path.isdir(recent))
+
+    def test_header_retention_authoritative(self):
+        env = self.make_idle_env('a', 48)
+        conda_execute.tmpenv.update_retention(env, keep_for='1w', pin=True)
+        conda_execute.tmpenv.update_retention(env, keep_for='1h')
+        self.assertEqual(conda_execute.tmpenv.read_env_info(env), {'keep_for': 1})
+        conda_execute.tmpenv.update_retention(env)
+        self.assertEqual(conda_execute.tmpenv.read_env_info(env), {})
+        # A quoted "false" doesn't pin the environment.
+        conda_execute.tmpenv.update_retention(env, pin='false')
+        self.assertEqual(conda_execute.tmpenv.read_env_info(env), {})
+
+    def test_interrupted_env_kept_for_resumption(self):
+        env = os.path.join(self.env_dir, 'a' * 20)
+        conda_execute.tmpenv._write_journal(env, {'spec': ['python'], 'solved': [],
+                                                  'steps': ['solved']})
+        conda_execute.tmpenv.cleanup_tmp_envs(min_age=1)
+        self.assertTrue(os.path.isdir(env))
+        conda_execute.tmpenv.cleanup_tmp_envs(min_age=0)
+        self.assertFalse(os.path.exists(env))
+
+    def test_valid_journal(self):
+        env = self.make_idle_env('a', 0)
+        with open(os.path.join(env, 'conda-meta', 'python-3.6.0-0.json'), 'w') as fh:
+            json.dump({'files': []}, fh)
+        journal = {'spec': ['python'], 'solved': ['python-3.6.0-0.tar.bz2', 'zlib-1.2-0.tar.bz2'],
+                   'steps': ['solved', 'fetched']}
+        valid = conda_execute.tmpenv._valid_journal
+        self.assertTrue(valid(env, journal, ('python', )))
+        self.assertFalse(valid(env, journal, ('python', 'numpy')))
+        journal['solved'] = ['zlib-1.2-0.tar.bz2']
+        self.assertFalse(valid(env, journal, ('python', )))
+
+    def test_parse_duration(self):
+        parse_duration = conda_execute.tmpenv.parse_duration
+        self.assertEqual(parse_duration(12), 12)
+        self.assertEqual(parse_duration('30m'), 0.5)
+        self.assertEqual(parse_duration('2d'), 48)
+        self.assertEqual(parse_duration('1w'), 168)
+        with self.assertRaises(ValueError):
+            parse_duration('soon')
+
+    def test_parse_pin(self):
+        parse_pin = conda_execute.tmpenv.parse_pin
+        self.assertTrue(parse_pin(True))
+        self.assertTrue(parse_pin('yes'))
+        self.assertFalse(parse_pin(None))
+        self.assertFalse(parse_pin('false'))
+        self.assertFalse(parse_pin('No'))
+        with self.assertRaises(ValueError):
+            parse_pin('forever')
+
+
+class FakeEnvs(object):
+    """A mixin providing a fake environment of two packages at self.source."""
+    def setUp(self):
+        self.env_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.env_dir, 'a' * 20)
+        self.target = os.path.join(self.env_dir, 'b' * 20)
+        os.makedirs(os.path.join(self.source, 'conda-meta'))
+        os.makedirs(os.path.join(self.source, 'bin'))
+        for dist, fname in [('foo-1.0-0', 'bin/foo'), ('bar-2.0-0', 'bin/bar')]:
+            paths = [{'_path': fname, 'path_type': 'hardlink',
+                      'prefix_placeholder': '/opt/placeholder', 'file_mode': 'text'}]
+            with open(os.path.join(self.source, 'conda-meta', dist + '.json'), 'w') as fh:
+                json.dump({'files': [fname], 'paths_data': {'paths': paths}}, fh)
+            with open(os.path.join(self.source, fname), 'w') as fh:
+                fh.write('#!{}/bin/python\n'.format(self.source))
+
+    def tearDown(self):
+        shutil.rmtree(self.env_dir)
+
+
+class Test_derive(FakeEnvs, unittest.TestCase):
+    def test_clone_replaces_prefix(self):
+        conda_execute.tmpenv._clone_env(self.source, self.target)
+        with open(os.path.join(self.target, 'bin', 'foo')) as fh:
+            self.assertEqual(fh.read(), '#!{}/bin/python\n'.format(self.target))
+        # The source must be untouched.
+        with open(os.path.join(self.source, 'bin', 'foo')) as fh:
+            self.assertEqual(fh.read(), '#!{}/bin/python\n'.format(self.source))
+
+    def test_clone_only_rewrites_files_with_prefix(self):
+        with open(os.path.join(self.source, 'bin', 'baz'), 'w') as fh:
+            fh.write(self.source)
+        conda_execute.tmpenv._clone_env(self.source, self.target)
+        with open(os.path.join(self.target, 'bin', 'baz')) as fh:
+            self.assertEqual(fh.read(), self.source)
+        self.assertEqual(os.stat(os.path.join(self.target, 'bin', 'baz')).st_ino,
+                         os.stat(os.path.join(self.source, 'bin', 'baz')).st_ino)
+
+    def test_clone_to_different_length_prefix(self):
+        with self.assertRaises(ValueError):
+            conda_execute.tmpenv._clone_env(self.source, self.target + 'c')
+        self.assertFalse(os.path.exists(self.target + 'c'))
+
+    def test_unlink_dist(self):
+        conda_execute.tmpenv._clone_env(self.source, self.target)
+        conda_execute.tmpenv._unlink_dist(self.target, 'foo-1.0-0')
+        self.assertEqual(conda_execute.tmpenv.installed_dists(self.target),
+                         set(['bar-2.0-0']))
+        self.assertFalse(os.path.exists(os.path.join(self.target, 'bin', 'foo')))
+        self.assertTrue(os.path.exists(os.path.join(self.source, 'bin', 'foo')))
+
+
+class Test_broken_dists(FakeEnvs, unittest.TestCase):
+    def test_detects_changed_and_missing_files(self):
+        tmpenv = conda_execute.tmpenv
+        self.assertIsNone(tmpenv.broken_dists(self.source))
+        tmpenv._write_manifest(self.source, ['foo-1.0-0.tar.bz2', 'bar-2.0-0.tar.bz2'])
+        self.assertEqual(tmpenv.broken_dists(self.source), [])
+
+        with open(os.path.join(self.source, 'bin', 'foo'), 'a') as fh:
+            fh.write('# modified\n')
+        self.assertEqual(tmpenv.broken_dists(self.source), ['foo-1.0-0'])
+
+        os.remove(os.path.join(self.source, 'bin', 'bar'))
+        self.assertEqual(tmpenv.broken_dists(self.source), ['bar-2.0-0', 'foo-1.0-0'])
+
+
+class Test_import_bundle(FakeEnvs, unittest.TestCase):
+    def make_bundle(self, old_prefix):
+        with open(os.path.join(self.source, 'bin', 'foo'), 'w') as fh:
+            fh.write('#!{}/bin/python\n'.format(old_prefix))
+        with open(os.path.join(self.source, 'bin', 'bar'), 'wb') as fh:
+            fh.write(b'\x7fELF\0' + old_prefix.encode('utf-8') + b'/lib\0tail')
+        paths = [{'_path': 'bin/bar', 'path_type': 'hardlink',
+                  'prefix_placeholder': '/opt/placeholder', 'file_mode': 'binary'}]
+        with open(os.path.join(self.source, 'conda-meta', 'bar-2.0-0.json'), 'w') as fh:
+            json.dump({'files': ['bin/bar'], 'paths_data': {'paths': paths}}, fh)
+        metadata = {'prefix': old_prefix, 'spec': ['foo'], 'channels': [],
+                    'subdir': conda_execute.config.subdir}
+        bundle = os.path.join(self.env_dir, 'bundle.tar.gz')
+        conda_execute.archive.pack(self.source, bundle, arcname='prefix', extra={
+            conda_execute.tmpenv._BUNDLE_METADATA: yaml.safe_dump(metadata).encode('utf-8')})
+        return bundle
+
+    def test_relocation_to_longer_prefix(self):
+        orig_env_dir = conda_execute.config.env_dir
+        conda_execute.config.env_dir = self.env_dir
+        self.addCleanup(setattr, conda_execute.config, 'env_dir', orig_env_dir)
+        with self.assertRaises(ValueError):
+            conda_execute.tmpenv.import_bundle(self.make_bundle('/short'))
+        self.assertFalse(os.path.exists(conda_execute.tmpenv.name_env(['foo'])))
+
+    def test_relocation(self):
+        tmpenv = conda_execute.tmpenv
+        orig_env_dir = conda_execute.config.env_dir
+        conda_execute.config.env_dir = self.env_dir
+        self.addCleanup(setattr, conda_execute.config, 'env_dir', orig_env_dir)
+
+        old_prefix = '/a/much/longer/prefix/than/the/temporary/one/' + 'c' * 20
+        code = compile('pass', old_prefix + '/lib/mod.py', 'exec')
+        with open(os.path.join(self.source, 'bin', 'mod.pyc'), 'wb') as fh:
+            fh.write(marshal.dumps(code))
+        bundle = self.make_bundle(old_prefix)
+
+        env = tmpenv.import_bundle(bundle)
+        self.assertEqual(env, tmpenv.name_env(['foo']))
+        self.assertTrue(tmpenv.env_is_complete(env))
+        with open(os.path.join(env, 'bin', 'foo')) as fh:
+            self.assertEqual(fh.read(), '#!{}/bin/python\n'.format(env))
+        with open(os.path.join(env, 'bin', 'bar'), 'rb') as fh:
+            data = fh.read()
+        expected = b'\x7fELF\0' + env.encode('utf-8') + b'/lib'
+        self.assertEqual(len(data), len(b'\x7fELF\0' + old_prefix.encode('utf-8') + b'/lib\0tail'))
+        self.assertTrue(data.startswith(expected + b'\0'))
+        self.assertTrue(data.endswith(b'\0tail'))
+        # Files which conda doesn't record as containing the prefix are untouched.
+        with open(os.path.join(env, 'bin', 'mod.pyc'), 'rb') as fh:
+            self.assertEqual(marshal.loads(fh.read()).co_filename, old_prefix + '/lib/mod.py')
+
+
+class LoggingBackend(object):
+    """A backend which logs its solves, and links empty packages."""
+    name = 'logging'
+    solve_log = None
+
+    def get_index(self, channels):
+        return {}
+
+    def solve(self, index, specs):
+        with open(self.solve_log, 'a') as fh:
+            fh.write(' '.join(specs) + '\n')
+        return sorted('{}-1.0-0'.format(spec) for spec in specs)
+
+    def dist_from_str(self, dist_str):
+        return dist_str
+
+    def fetch(self, index, packages):
+        pass
+
+    def link(self, prefix, index, packages):
+        for dist in packages:
+            conda_execute.utils.atomic_write(
+                os.path.join(prefix, 'conda-meta', dist + '.json'), json.dumps({'files': []}))
+
+
+conda_execute.solver._BACKENDS['logging'] = LoggingBackend
+
+
+class Test_prewarm(unittest.TestCase):
+    def setUp(self):
+        self.orig_config = (conda_execute.config.env_dir, conda_execute.config.solver,
+                            conda_execute.config.solve_timeout,
+                            conda_execute.config.derive_max_distance)
+        self.tmp_dir = tempfile.mkdtemp()
+        conda_execute.config.env_dir = os.path.join(self.tmp_dir, 'envs')
+        conda_execute.config.solver = 'logging'
+        conda_execute.config.solve_timeout = 0
+        conda_execute.config.derive_max_distance = 0
+        LoggingBackend.solve_log = os.path.join(self.tmp_dir, 'solves')
+
+    def tearDown(self):
+        (conda_execute.config.env_dir, conda_execute.config.solver,
+         conda_execute.config.solve_timeout,
+         conda_execute.config.derive_max_distance) = self.orig_config
+        shutil.rmtree(self.tmp_dir)
+
+    def test_each_env_solved_once(self):
+        scripts = os.path.join(self.tmp_dir, 'scripts')
+        os.makedirs(scripts)
+        for name, env in [('a.py', 'python'), ('b.py', 'numpy'), ('c.py', 'numpy')]:
+            with open(os.path.join(scripts, name), 'w') as fh:
+                fh.write('# conda execute\n# env:\n#  - {}\n'.format(env))
+        args = argparse.Namespace(paths=[scripts], jobs=2)
+        self.assertEqual(conda_execute.tmpenv.subcommand_prewarm(args), 0)
+        with open(LoggingBackend.solve_log) as fh:
+            self.assertEqual(sorted(fh.read().splitlines()), ['numpy', 'python'])
+        for spec in [['python'], ['numpy']]:
+            env = conda_execute.tmpenv.find_env(spec)
+            self.assertTrue(conda_execute.tmpenv.env_is_complete(env))
+            self.assertEqual(conda_execute.tmpenv.installed_dists(env),
+                             set([spec[0] + '-1.0-0']))
+
+
+class Test_shared_env_dirs(unittest.TestCase):
+    def setUp(self):
+        self.orig_dirs = conda_execute.config.env_dir, conda_execute.config.shared_env_dirs
+        self.tmp_dir = tempfile.mkdtemp()
+        conda_execute.config.env_dir = os.path.join(self.tmp_dir, 'local')
+        conda_execute.config.shared_env_dirs = [os.path.join(self.tmp_dir, 'shared')]
+
+    def tearDown(self):
+        conda_execute.config.env_dir, conda_execute.config.shared_env_dirs = self.orig_dirs
+        shutil.rmtree(self.tmp_dir)
+
+    def test_shared_env_found_first_and_not_written(self):
+        tmpenv = conda_execute.tmpenv
+        local = tmpenv.name_env(['python'])
+        self.assertEqual(tmpenv.find_env(['python']), local)
+
+        shared = os.path.join(self.tmp_dir, 'shared',
+                              os.path.relpath(local, conda_execute.config.env_dir))
+        os.makedirs(os.path.join(shared, 'conda-meta'))
+        with open(os.path.join(shared, 'conda-meta', 'execution.log'), 'w'):
+            pass
+        self.assertEqual(tmpenv.find_env(['python']), shared)
+        self.assertEqual(tmpenv.create_env(['python']), shared)
+
+        tmpenv.register_env_usage(shared)
+        tmpenv.update_retention(shared, pin=True)
+        tmpenv.touch_env_usage(shared)
+        self.assertEqual(os.path.getsize(os.path.join(shared, 'conda-meta', 'execution.log')), 0)
+        self.assertEqual(os.listdir(self.tmp_dir), ['shared'])
+        tmpenv.cleanup_tmp_envs(min_age=0)
+        self.assertTrue(os.path.isdir(shared))
+
+        # An environment re-created locally (e.g. with --force-env) is preferred.
+        os.makedirs(os.path.join(local, 'conda-meta'))
+        tmpenv.touch_env_usage(local)
+        self.assertEqual(tmpenv.find_env(['python']), local)
+
+
+class Test_canonical_spec(unittest.TestCase):
+    def test_whitespace(self):
+        for spec in ['numpy>=1.10', 'numpy >=1.10', 'numpy  >= 1.10', 'NumPy >=1.10 ']:
+            self.assertEqual(conda_execute.tmpenv.canonical_spec(spec), 'numpy >=1.10')
+
+    def test_multiple_constraints(self):
+        self.assertEqual(conda_execute.tmpenv.canonical_spec('python >= 2.7 , < 3'),
+                         'python >=2.7,<3')
+
+    def test_equals_form(self):
+        self.assertEqual(conda_execute.tmpenv.canonical_spec('numpy=1.10=py27_0'),
+                         'numpy 1.10* py27_0')
+
+    def test_bracket_keys_kept(self):
+        canonical_spec = conda_execute.tmpenv.canonical_spec
+        self.assertEqual(canonical_spec("NumPy[version='>=1.10']"), "numpy[version='>=1.10']")
+        self.assertEqual(canonical_spec("numpy >= 1.10[build=py36*]"), 'numpy >=1.10[build=py36*]')
+
+    def test_strip_specs_as_written(self):
+        self.assertEqual(conda_execute.tmpenv.strip_specs(
+                             ["numpy[version='>=1.10']  # comment\n", '', 'python=3', 'python=3']),
+                         ("numpy[version='>=1.10']", 'python=3'))
+
+    def test_legacy_env_found_from_raw_specs(self):
+        tmpenv = conda_execute.tmpenv
+        orig_env_dir = conda_execute.config.env_dir
+        conda_execute.config.env_dir = tempfile.mkdtemp()
+        self.addCleanup(setattr, conda_execute.config, 'env_dir', orig_env_dir)
+        self.addCleanup(shutil.rmtree, conda_execute.config.env_dir)
+        legacy = tmpenv._legacy_name_env(['python=3', 'numpy >=1.10'])
+        os.makedirs(os.path.join(legacy, 'conda-meta'))
+        self.assertEqual(tmpenv.find_env(tmpenv.strip_specs(['numpy >=1.10', 'python=3'])),
+                         legacy)
+
+    def test_comments_and_blanks(self):
+        self.assertIsNone(conda_execute.tmpenv.canonical_spec('   '))
+        self.assertIsNone(conda_execute.tmpenv.canonical_spec('# just a comment'))
+        self.assertEqual(conda_execute.tmpenv.canonical_spec('numpy  # trailing comment\n'),
+                         'numpy')
+
+    def test_name_env_equivalence(self):
+        name_env = conda_execute.tmpenv.name_env
+        self.assertEqual(name_env(['numpy>=1.10', 'python']),
+                         name_env(['python', 'numpy  >= 1.10', '', 'python']))
+        self.assertNotEqual(name_env(['numpy']), name_env(['numpy'], channels=['conda-forge']))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import conda_execute.config
+import conda_execute.usage
+
+
+class Test_ranked_envs(unittest.TestCase):
+    def setUp(self):
+        self.orig_env_dir = conda_execute.config.env_dir
+        self.env_dir = conda_execute.config.env_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        conda_execute.config.env_dir = self.orig_env_dir
+        shutil.rmtree(self.env_dir)
+
+    def test_most_used_first(self):
+        popular = os.path.join(self.env_dir, 'a' * 20)
+        unpopular = os.path.join(self.env_dir, 'b' * 20)
+        conda_execute.usage.record_usage(unpopular, ['numpy'])
+        for _ in range(3):
+            conda_execute.usage.record_usage(popular, ['python'], ['conda-forge'])
+
+        ranked = conda_execute.usage.ranked_envs()
+        self.assertEqual([env for env, _ in ranked], [popular, unpopular])
+        self.assertEqual(ranked[0][1]['count'], 3)
+        self.assertEqual(ranked[0][1]['channels'], ['conda-forge'])
+        self.assertEqual(conda_execute.usage.env_ranks(), {popular: 1, unpopular: 2})
+        self.assertEqual(conda_execute.usage.hot_envs(1), [popular])
+        self.assertEqual(conda_execute.usage.hot_envs(0), [])
+
+    def test_prune_usage(self):
+        removed = os.path.join(self.env_dir, 'a' * 20)
+        existing = os.path.join(self.env_dir, 'b' * 20)
+        os.makedirs(existing)
+        for env in [removed, existing]:
+            conda_execute.usage.record_usage(env, ['python'])
+        conda_execute.usage.prune_usage()
+        self.assertEqual(len(conda_execute.usage.ranked_envs()), 2)
+        conda_execute.usage.prune_usage(max_age=-1)
+        self.assertEqual([env for env, _ in conda_execute.usage.ranked_envs()], [existing])
+
+    def test_maintain_if_due(self):
+        env = os.path.join(self.env_dir, 'a' * 20)
+        conda_execute.usage.record_usage(env, ['python'])
+        orig_config = conda_execute.config.forget_usage_after
+        conda_execute.config.forget_usage_after = -1
+        self.addCleanup(setattr, conda_execute.config, 'forget_usage_after', orig_config)
+        conda_execute.usage.maintain_if_due()
+        self.assertEqual(conda_execute.usage.ranked_envs(), [])
+        # Not again until the usage-interval has passed.
+        conda_execute.usage.record_usage(env, ['python'])
+        conda_execute.usage.maintain_if_due()
+        self.assertEqual(len(conda_execute.usage.ranked_envs()), 1)
+
+    def test_warm_standby_rebuilt_in_env_dir(self):
+        from conda_execute.tmpenv import find_env
+        conda_execute.usage.record_usage(find_env(['python']), ['python'])
+        orig_keep_warm = conda_execute.config.keep_warm
+        conda_execute.config.keep_warm = 1
+        self.addCleanup(setattr, conda_execute.config, 'keep_warm', orig_keep_warm)
+        commands = []
+
+        class FakeSubprocess(object):
+            @staticmethod
+            def Popen(cmd, **kwargs):
+                commands.append(cmd)
+
+        self.addCleanup(setattr, conda_execute.usage, 'subprocess', conda_execute.usage.subprocess)
+        conda_execute.usage.subprocess = FakeSubprocess
+        conda_execute.usage.ensure_warm_standby()
+        cmd, = commands
+        self.assertEqual(cmd[cmd.index('--env-dir') + 1], self.env_dir)
+        self.assertEqual(cmd[cmd.index('--pkg-dir') + 1], conda_execute.config.pkg_dir)
+        self.assertEqual(cmd[-1], 'python')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,103 +4,559 @@ import argparse
 import calendar
 import datetime
 import hashlib
+import json
 import logging
 import os
+import re
+import shlex
 import shutil
 import time
 
 import psutil
 import yaml
 
-from conda_execute.conda_interface import CONDA_VERSION_MAJOR_MINOR
+import conda_execute.archive
+import conda_execute.catalog
 import conda_execute.config
-from conda_execute.lock import Locked
+import conda_execute.events
+import conda_execute.metrics
+import conda_execute.remote
+import conda_execute.solver
+from conda_execute.lock import Locked, Semaphore, is_locked
+import conda_execute.usage
+from conda_execute.utils import atomic_write
 
 
 log = logging.getLogger('conda-tmpenv')
 log.addHandler(logging.NullHandler())
 
+def is_shared_env(env_prefix):
+    """
+    Whether the environment is in one of the read-only shared stores, which
+    must never be written to (or cleaned up).
+
+    """
+    return any(env_prefix.startswith(shared_dir + os.sep)
+               for shared_dir in conda_execute.config.shared_env_dirs)
+
+
 def register_env_usage(env_prefix):
     """
     Register the usage of this environment (so that other processes could garbage
-    collect when we are done).
+    collect when we are done). Environments in the shared stores are never
+    cleaned up from here, so their usage isn't registered.
 
     """
+    if is_shared_env(env_prefix):
+        return
     ps = psutil.Process()
     info_file = os.path.join(env_prefix, 'conda-meta', 'execution.log')
 
     # Some problems around race conditions meant that the conda-meta wasn't being created properly.
     # Travis-CI run: https://travis-ci.org/pelson/conda-execute/jobs/86982714
     if not os.path.exists(os.path.dirname(info_file)):
-        os.mkdir(os.path.dirname(info_file))
+        os.makedirs(os.path.dirname(info_file))
     with open(info_file, 'a') as fh:
         fh.write('{}, {}\n'.format(ps.pid, int(ps.create_time())))
 
 
-def name_env(spec):
+def canonical_spec(spec):
+    """
+    Normalise a single package specification into a canonical match-spec
+    string of the form ``name[ version[ build]]``, such that equivalent
+    specifications (e.g. ``numpy>=1.10``, ``numpy >=1.10`` and
+    ``numpy  >= 1.10``) compare equal. Any bracketed match-spec keys (e.g.
+    ``numpy[version='>=1.10']``) are kept as they are.
+
+    The canonical form names the environment; the specifications are solved
+    as they were written (see :func:`strip_specs`).
+
+    Returns None for blank lines and comments.
+
+    """
+    spec = spec.split('#', 1)[0].strip()
+    if not spec:
+        return None
+    spec, brackets = re.match(r'([^\[]*)(\[.*)?$', spec).groups()
+    if brackets:
+        return (canonical_spec(spec) or '') + brackets
+    match = re.match(r'([^\s=<>!~]*)\s*(.*)$', spec)
+    name, rest = match.group(1).lower(), match.group(2)
+    # Remove whitespace around version separators and after operators.
+    rest = re.sub(r'\s*([,|])\s*', r'\1', rest)
+    rest = re.sub(r'(==|!=|<=|>=|~=|<|>)\s+', r'\1', rest)
+    if rest.startswith('=') and not rest.startswith('=='):
+        # The "name=version=build" form, where "=version" is a prefix match.
+        parts = rest[1:].split('=', 1)
+        if not parts[0].endswith('*'):
+            parts[0] += '*'
+        rest = ' '.join(parts)
+    return ' '.join([name] + rest.split())
+
+
+def canonical_specs(specs):
+    """
+    Normalise the given package specifications (see :func:`canonical_spec`),
+    dropping blanks and comments and removing duplicates.
+
+    """
+    specs = set(canonical_spec(spec) for spec in specs)
+    specs.discard(None)
+    return tuple(sorted(specs))
+
+
+def strip_specs(specs):
+    """
+    The given package specifications, otherwise as written, without blank
+    lines, comments or duplicates.
+
+    """
+    stripped = []
+    for spec in specs:
+        spec = spec.split('#', 1)[0].strip()
+        if spec and spec not in stripped:
+            stripped.append(spec)
+    return tuple(stripped)
+
+
+def _legacy_name_env(spec):
+    """
+    The environment location for the given raw specification as it was named
+    before specifications were normalised.
+
+    """
     spec = tuple(sorted(spec))
+    hash = hashlib.sha256(u'\n'.join(spec).encode('utf-8')).hexdigest()[:20]
+    return os.path.join(conda_execute.config.env_dir, hash)
+
+
+def name_env(spec, channels=()):
+    """
+    The location of the temporary environment for the given specification.
+    The name is a hash of the canonical specification, the channels (in
+    priority order) and the platform subdir.
+
+    """
+    key = list(canonical_specs(spec))
+    seen_channels = []
+    for channel in channels:
+        if channel not in seen_channels:
+            seen_channels.append(channel)
+    key.append(u'channels: ' + u', '.join(seen_channels))
+    key.append(u'subdir: ' + conda_execute.config.subdir)
     # Use the first 20 hex characters of the sha256 to make the SHA somewhat legible. This could extend
     # in the future if we have sufficient need.
-    hash = hashlib.sha256(u'\n'.join(spec).encode('utf-8')).hexdigest()[:20]
-    env_locn = os.path.join(conda_execute.config.env_dir, hash)
+    hash = hashlib.sha256(u'\n'.join(key).encode('utf-8')).hexdigest()[:20]
+    env_locn = conda_execute.catalog.env_path(hash)
     return env_locn
 
 
-def _create_env_conda_42(prefix, index, full_list_of_packages):
-    assert CONDA_VERSION_MAJOR_MINOR < (4, 3)
-    from conda.install import is_extracted, is_fetched, extract, link
-    from conda.fetch import fetch_pkg
-
-    for tar_name in full_list_of_packages:
-        pkg_info = index[tar_name]
-        dist_name = tar_name[:-len('.tar.bz2')]
-        log.info('Resolved package: {}'.format(tar_name))
-        # We force a lock on retrieving anything which needs access to a distribution of this
-        # name. If other requests come in to get the exact same package they will have to wait
-        # for this to finish (good). If conda itself it fetching these pacakges then there is
-        # the potential for a race condition (bad) - there is no solution to this unless
-        # conda/conda is updated to be more precise with its locks.
-        lock_name = os.path.join(conda_execute.config.pkg_dir, dist_name)
-        with Locked(lock_name):
-            if not is_extracted(dist_name):
-                if not is_fetched(dist_name):
-                    log.info('Fetching {}'.format(dist_name))
-                    fetch_pkg(pkg_info, conda_execute.config.pkg_dir)
-                extract(dist_name)
-            link(prefix, dist_name)
-
-
-def _create_env_conda_43(prefix, index, full_list_of_packages):
-    assert CONDA_VERSION_MAJOR_MINOR >= (4, 3)
-    from conda.core.package_cache import ProgressiveFetchExtract
-    from conda.core.link import UnlinkLinkTransaction
-    from conda.gateways.disk.create import mkdir_p
-
-    pfe = ProgressiveFetchExtract(index, full_list_of_packages)
-    pfe.execute()
-    mkdir_p(prefix)
-    txn = UnlinkLinkTransaction.create_from_dists(index, prefix, (), full_list_of_packages)
-    txn.execute()
-
-def _create_env_conda_44(prefix, full_list_of_packages):
-    assert CONDA_VERSION_MAJOR_MINOR >= (4, 4)
-    from conda.models.match_spec import MatchSpec
-    from conda.core.solve import Solver
-
-    matched_list_of_packages = (MatchSpec(d) for d in full_list_of_packages)
-    m = Solver(prefix, (), specs_to_add=matched_list_of_packages)
-    txn = m.solve_for_transaction()
-    txn.execute()
-    
-def create_env(spec, force_recreation=False, extra_channels=()):
+def find_env(spec, channels=()):
     """
-    Create a temporary environment from the given specification.
+    The location of the temporary environment for the given specification:
+    a complete environment in the local store if there is one (e.g. a shared
+    environment which has been re-created locally), then a complete
+    environment in one of the shared stores, otherwise the location in the
+    local store (falling back to an existing
+    environment from before the store was sharded, or named under the
+    legacy, un-normalised, scheme so that such environments continue to be
+    used).
 
     """
-    from conda_execute.conda_interface import Resolve, get_index
+    env_locn = name_env(spec, channels)
+    if env_is_complete(env_locn):
+        return env_locn
+    # Search the read-only stores next. They are never written to, so need no locks.
+    relative_locn = os.path.relpath(env_locn, conda_execute.config.env_dir)
+    for shared_dir in conda_execute.config.shared_env_dirs:
+        shared_locn = os.path.join(shared_dir, relative_locn)
+        if env_is_complete(shared_locn):
+            return shared_locn
+    if not os.path.exists(env_locn) and not conda_execute.archive.archive_path(env_locn):
+        unsharded_locn = os.path.join(conda_execute.config.env_dir, os.path.basename(env_locn))
+        for old_locn in [unsharded_locn, _legacy_name_env(spec)]:
+            if (os.path.isdir(os.path.join(old_locn, 'conda-meta')) or
+                    conda_execute.archive.archive_path(old_locn)):
+                return old_locn
+    return env_locn
 
-    spec = tuple(sorted(spec))
-    env_locn = name_env(spec)
+
+def _env_info_file(env_prefix):
+    # Not a .json file, as conda treats those in conda-meta as package records.
+    return os.path.join(env_prefix, 'conda-meta', 'conda-execute.yml')
+
+
+def read_env_info(env_prefix):
+    """
+    Return the conda-execute metadata (e.g. retention policy) stored with
+    the given environment.
+
+    """
+    try:
+        with open(_env_info_file(env_prefix), 'r') as fh:
+            return yaml.safe_load(fh) or {}
+    except (IOError, OSError, yaml.YAMLError):
+        return {}
+
+
+_DURATION_UNITS = {'m': 1. / 60, 'h': 1, 'd': 24, 'w': 24 * 7}
+
+
+def parse_duration(value):
+    """
+    Parse a duration, either a number of hours or a string such as "30m",
+    "12h", "2d" or "1w", into a number of hours.
+
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = re.match(r'^\s*(\d+(?:\.\d*)?)\s*([mhdw]?)\s*$', str(value))
+    if match is None:
+        raise ValueError('Unable to interpret {!r} as a duration (e.g. 30m, 12h, 2d '
+                         'or 1w).'.format(value))
+    number, unit = match.groups()
+    return float(number) * _DURATION_UNITS[unit or 'h']
+
+
+_PIN_VALUES = {'true': True, 'yes': True, 'on': True, '1': True,
+               'false': False, 'no': False, 'off': False, '0': False, '': False}
+
+
+def parse_pin(value):
+    """
+    Parse the ``pin`` of a script's header: a boolean, or a string such as
+    "true", "yes", "false" or "no" (as a quoted YAML value would be).
+
+    """
+    if value is None:
+        return False
+    if isinstance(value, bool):
+        return value
+    try:
+        return _PIN_VALUES[str(value).strip().lower()]
+    except KeyError:
+        raise ValueError('Unable to interpret {!r} as a pin (e.g. true or false).'.format(value))
+
+
+def update_retention(env_prefix, keep_for=None, pin=False):
+    """
+    Record a script's retention policy against its environment, replacing
+    any previous policy: the header of the script executed most recently is
+    authoritative, so removing ``keep_for`` or ``pin`` from it returns the
+    environment to the default retention. Environments in the shared stores
+    aren't cleaned up, so have no policy.
+
+    """
+    if is_shared_env(env_prefix):
+        return
+    env_info = read_env_info(env_prefix)
+    policy = dict((key, value) for key, value in env_info.items()
+                  if key not in ['keep_for', 'pin'])
+    if parse_pin(pin):
+        policy['pin'] = True
+    if keep_for is not None:
+        policy['keep_for'] = parse_duration(keep_for)
+    if policy != env_info:
+        atomic_write(_env_info_file(env_prefix),
+                     yaml.safe_dump(policy, default_flow_style=False))
+
+
+def _dist_name(dist):
+    """
+    Return the ``name-version-build`` string of a solved package, whichever
+    form (a tarball name or a Dist) this version of conda's solver returned.
+
+    """
+    dist_name = getattr(dist, 'dist_name', None) or str(dist)
+    dist_name = dist_name.split('::')[-1]
+    if dist_name.endswith('.tar.bz2'):
+        dist_name = dist_name[:-len('.tar.bz2')]
+    return dist_name
+
+
+def installed_dists(env_prefix):
+    """
+    The set of ``name-version-build`` packages linked into the given prefix.
+
+    """
+    meta_dir = os.path.join(env_prefix, 'conda-meta')
+    if not os.path.isdir(meta_dir):
+        return set()
+    return set(fname[:-len('.json')] for fname in os.listdir(meta_dir)
+               if fname.endswith('.json'))
+
+
+def nearest_env(dists, exclude=(), prefix_length=None):
+    """
+    Find the temporary environment whose installed packages are closest to the
+    given set of solved packages, measured as the size of the symmetric
+    difference of the two sets. If prefix_length is given, only environments
+    with prefixes of that length (which can be cloned byte-for-byte to the
+    new prefix) are considered.
+
+    Returns a tuple of (env_prefix, distance), or (None, None) if no
+    environment shares a package with the given set.
+
+    """
+    best_env, best_distance = None, None
+    for env in tmp_envs():
+        if env in exclude or not env_is_complete(env):
+            continue
+        if prefix_length is not None and len(env) != prefix_length:
+            continue
+        env_dists = installed_dists(env)
+        if not env_dists & dists:
+            continue
+        distance = len(env_dists ^ dists)
+        if best_distance is None or distance < best_distance:
+            best_env, best_distance = env, distance
+    return best_env, best_distance
+
+
+def _binary_replace(data, old_prefix, new_prefix):
+    """
+    Replace the old prefix with a new one no longer than it in binary data,
+    padding each null-terminated string containing it with nulls so that
+    the length (and hence all offsets) of the data is unchanged.
+
+    """
+    def replace(match):
+        occurrences = match.group().count(old_prefix)
+        padding = (len(old_prefix) - len(new_prefix)) * occurrences
+        if padding < 0:
+            raise ValueError('Unable to relocate a binary file to a longer prefix.')
+        return match.group().replace(old_prefix, new_prefix) + b'\0' * padding
+
+    pattern = re.compile(re.escape(old_prefix) + b'([^\0]*?)\0')
+    return pattern.sub(replace, data)
+
+
+def _has_prefix(record, dist_name):
+    """
+    The (path, file mode) of the files of a linked package which conda
+    records as containing the prefix: from the package's record in
+    conda-meta (conda >= 4.3), or otherwise from the ``info/has_prefix`` of
+    the package it was linked from.
+
+    """
+    if 'paths_data' in record:
+        for path in record['paths_data'].get('paths', []):
+            if path.get('prefix_placeholder'):
+                yield path['_path'], path.get('file_mode') or 'text'
+            elif path.get('path_type', '').endswith('entry_point'):
+                # Entry points are written at link time, with the prefix in their shebang.
+                yield path['_path'], 'text'
+        return
+    source = (record.get('link') or {}).get('source') or os.path.join(
+        conda_execute.config.pkg_dir, dist_name)
+    try:
+        with open(os.path.join(source, 'info', 'has_prefix'), 'r') as fh:
+            lines = fh.readlines()
+    except (IOError, OSError):
+        return
+    for line in lines:
+        parts = shlex.split(line)
+        if len(parts) == 1:
+            yield parts[0], 'text'
+        elif len(parts) == 3:
+            yield parts[2], parts[1]
+
+
+def _prefix_files(env_prefix):
+    """
+    The files of the environment, relative to the prefix, which contain the
+    prefix, mapped to their file mode (``text`` or ``binary``).
+
+    """
+    meta_dir = os.path.join(env_prefix, 'conda-meta')
+    prefix_files = {}
+    for dist_name in installed_dists(env_prefix):
+        with open(os.path.join(meta_dir, dist_name + '.json'), 'r') as fh:
+            record = json.load(fh)
+        for path, mode in _has_prefix(record, dist_name):
+            prefix_files[os.path.normpath(path)] = mode
+    return prefix_files
+
+
+def _replace_prefix(path, old_prefix, new_prefix, mode='text'):
+    """
+    Replace the old prefix with the new one in the given file, of the given
+    file mode (``text`` or ``binary``, as conda records it). The file is
+    written anew, rather than modified in place, so that any hardlink to the
+    original is broken.
+
+    Prefixes of equal length are replaced byte-for-byte. Otherwise text
+    files are simply rewritten, and binary files have their strings padded
+    (see :func:`_binary_replace`).
+
+    """
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    if old_prefix not in data:
+        return
+    if len(old_prefix) == len(new_prefix) or mode != 'binary':
+        data = data.replace(old_prefix, new_prefix)
+    else:
+        data = _binary_replace(data, old_prefix, new_prefix)
+    tmp_path = path + '.conda-execute-tmp'
+    with open(tmp_path, 'wb') as fh:
+        fh.write(data)
+    shutil.copymode(path, tmp_path)
+    os.rename(tmp_path, path)
+
+
+def _env_records(env_prefix):
+    """
+    The paths, relative to the prefix, of the records which belong to a
+    particular environment (its usage, retention, creation and verification
+    records and history), rather than to its packages.
+
+    """
+    return set(os.path.relpath(path, env_prefix) for path in [
+                   os.path.join(env_prefix, 'conda-meta', 'execution.log'),
+                   os.path.join(env_prefix, 'conda-meta', 'history'),
+                   _env_info_file(env_prefix), _journal_file(env_prefix),
+                   _manifest_file(env_prefix), _verified_file(env_prefix)])
+
+
+def _clone_env(source, target):
+    """
+    Clone the source prefix to the target prefix, hardlinking files where
+    possible (and copying them otherwise).
+
+    Temporary environment prefixes all have the same length (the env_dir plus
+    a fixed length hash), so the references to the source prefix, textual or
+    binary, in the files which conda records as containing it can be
+    replaced byte-for-byte with the target prefix.
+
+    """
+    old_prefix = source.encode('utf-8')
+    new_prefix = target.encode('utf-8')
+    if len(old_prefix) != len(new_prefix):
+        raise ValueError('Unable to clone {} to {}, a prefix of a different '
+                         'length.'.format(source, target))
+    skip = _env_records(source)
+    prefix_files = _prefix_files(source)
+
+    for root, dirs, files in os.walk(source):
+        dest_root = os.path.normpath(os.path.join(target, os.path.relpath(root, source)))
+        if not os.path.isdir(dest_root):
+            os.makedirs(dest_root)
+        for name in dirs + files:
+            src = os.path.join(root, name)
+            dest = os.path.join(dest_root, name)
+            if os.path.relpath(src, source) in skip:
+                continue
+            if os.path.islink(src):
+                link_target = os.readlink(src)
+                if link_target.startswith(source):
+                    link_target = target + link_target[len(source):]
+                os.symlink(link_target, dest)
+            elif name in files:
+                try:
+                    os.link(src, dest)
+                except OSError:
+                    shutil.copy2(src, dest)
+                if os.path.relpath(src, source) in prefix_files:
+                    _replace_prefix(dest, old_prefix, new_prefix)
+
+
+def relocate_env(env_prefix, old_prefix):
+    """
+    Rewrite the symlinks of an environment which has been moved from
+    old_prefix to env_prefix, and the files which conda records as
+    containing the prefix (in their recorded file mode). Other files, e.g.
+    byte-compiled modules, are left as they are.
+
+    Binary files can't be relocated to a longer prefix, in which case a
+    ValueError is raised before anything is changed.
+
+    """
+    old = old_prefix.encode('utf-8')
+    new = env_prefix.encode('utf-8')
+    prefix_files = _prefix_files(env_prefix)
+    if len(new) > len(old) and 'binary' in prefix_files.values():
+        raise ValueError('Unable to relocate {} to {}, a longer prefix, as it has binary files '
+                         'containing the prefix.'.format(old_prefix, env_prefix))
+    for root, dirs, files in os.walk(env_prefix):
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                link_target = os.readlink(path)
+                if link_target.startswith(old_prefix):
+                    os.remove(path)
+                    os.symlink(env_prefix + link_target[len(old_prefix):], path)
+    for path, mode in sorted(prefix_files.items()):
+        path = os.path.join(env_prefix, path)
+        if os.path.isfile(path) and not os.path.islink(path):
+            _replace_prefix(path, old, new, mode)
+
+
+def _unlink_dist(prefix, dist_name):
+    """
+    Remove a package's files (as recorded in its conda-meta record) from the
+    given prefix.
+
+    """
+    meta_file = os.path.join(prefix, 'conda-meta', dist_name + '.json')
+    with open(meta_file, 'r') as fh:
+        files = json.load(fh).get('files', [])
+    dirs = set()
+    for path in files:
+        full_path = os.path.join(prefix, path)
+        if os.path.lexists(full_path):
+            os.remove(full_path)
+        dirs.add(os.path.dirname(full_path))
+    os.remove(meta_file)
+    # Prune any directories which the package leaves empty, deepest first.
+    for directory in sorted(dirs, key=len, reverse=True):
+        while directory.startswith(prefix + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+
+def _derive_env(base_env, prefix, full_list_of_packages):
+    """
+    Create the prefix as a clone of the base environment, then unlink the
+    packages that aren't wanted. The missing packages are left to be linked
+    in as for any other environment.
+
+    """
+    # Hold the tmp_envs lock so that the base env isn't cleaned up under our feet.
+    with Locked(conda_execute.config.env_dir):
+        _clone_env(base_env, prefix)
+    wanted = set(_dist_name(dist) for dist in full_list_of_packages)
+    for dist_name in sorted(installed_dists(prefix) - wanted):
+        log.info('Unlinking package: {}'.format(dist_name))
+        _unlink_dist(prefix, dist_name)
+
+
+def create_env(spec, force_recreation=False, extra_channels=(), timings=None, load_index=None):
+    """
+    Create a temporary environment from the given specification.
+
+    Where an existing temporary environment shares most of its packages with
+    the solved specification, the new environment is derived from it rather
+    than being built from nothing (see the ``derive-max-distance`` config).
+
+    If a timings dictionary is given, the seconds taken to solve the
+    specification (if it needed solving) are stored in it as ``solve``. The
+    package index of the channels is loaded, only if it is needed, by
+    load_index (a function of the channels, e.g. one which returns an index
+    that has already been loaded) or else by the backend.
+
+    """
+    spec = strip_specs(spec)
+    env_locn = find_env(spec, extra_channels)
+    if is_shared_env(env_locn):
+        if not force_recreation:
+            log.info('Using shared environment {}'.format(env_locn))
+            return env_locn
+        # The shared stores are read-only, so re-create the environment locally.
+        env_locn = name_env(spec, extra_channels)
 
     # We lock the specific environment we are wanting to create. If other requests come in for the
     # exact same environment, they will have to wait for this to finish (good).
@@ -110,59 +566,455 @@ def create_env(spec, force_recreation=False, extra_channels=()):
         if force_recreation and os.path.exists(env_locn):
             log.info("Clearing up existing environment at {} for re-creation".format(env_locn))
             shutil.rmtree(env_locn)
+        archive = conda_execute.archive.archive_path(env_locn)
+        if force_recreation and archive:
+            os.remove(archive)
+        elif archive and not env_is_complete(env_locn):
+            conda_execute.archive.restore_env(env_locn)
+            _refresh_manifest(env_locn)
 
-        if not os.path.exists(env_locn):
-            index = get_index(extra_channels)
-            # Ditto re the quietness.
-            r = Resolve(index)
-            full_list_of_packages = sorted(r.solve(list(spec)))
-
-            # Put out a newline. Conda's solve doesn't do it for us.
-            log.info('\n')
-            if CONDA_VERSION_MAJOR_MINOR >= (4, 4):
-                _create_env_conda_44(env_locn, full_list_of_packages)
-            elif CONDA_VERSION_MAJOR_MINOR >= (4, 3):
-                sorted_list_of_packages = r.dependency_sort({d.name: d for d in full_list_of_packages})
-                _create_env_conda_43(env_locn, index, sorted_list_of_packages)
-            else:
-                _create_env_conda_42(env_locn, index, full_list_of_packages)
-
-            # Attach an execution.log file.
-            with open(os.path.join(env_locn, 'conda-meta', 'execution.log'), 'a'):
-                pass
+        if not env_is_complete(env_locn):
+            conda_execute.catalog.add(env_locn)
+            with creation_slot():
+                _create_env(env_locn, spec, extra_channels, timings, load_index)
+        elif not recently_verified(env_locn):
+            verify_env(env_locn, extra_channels, load_index)
 
     return env_locn
 
 
+def _record_size(record):
+    size = getattr(record, 'size', None)
+    if size is None:
+        try:
+            size = record['size']
+        except (KeyError, TypeError):
+            pass
+    return size
+
+
+def _fetch_plan(index, packages):
+    """
+    Split the given solved packages into those which must be fetched (with
+    their size, from the index) and those already in the pkg_dir.
+
+    """
+    fetch, cached = [], []
+    for dist in packages:
+        dist_name = _dist_name(dist)
+        if any(os.path.exists(os.path.join(conda_execute.config.pkg_dir, dist_name + extension))
+               for extension in ['', '.tar.bz2', '.conda']):
+            cached.append(dist_name)
+        else:
+            fetch.append({'package': dist_name, 'bytes': _record_size(index.get(dist))})
+    return {'fetch': fetch, 'fetch_bytes': sum(package['bytes'] or 0 for package in fetch),
+            'cached': cached}
+
+
+def plan_env(spec, channels=(), env_prefix=None):
+    """
+    Predict what :func:`create_env` would need to do for the given spec,
+    without doing it. Returns a JSON serialisable dictionary whose
+    ``outcome`` is one of:
+
+     * ``warm``: the environment is complete (and verified), and is used as
+       it is. This is determined without importing conda.
+     * ``solve-cached``: the environment's packages are known without
+       solving, but it must be verified, restored from its archive or its
+       interrupted creation resumed (the ``action``).
+     * ``cold``: the spec must be solved and the environment created
+       (derived from an existing environment, if it would be).
+
+    Unless warm, the packages still to be linked are listed as those which
+    must be fetched (with their size in bytes, from the index) and those
+    already in the pkg_dir.
+
+    """
+    spec = strip_specs(spec)
+    if env_prefix is None:
+        env_prefix = find_env(spec, channels)
+    plan = {'prefix': env_prefix, 'spec': list(spec), 'channels': list(channels)}
+    if env_is_complete(env_prefix):
+        if recently_verified(env_prefix):
+            plan['outcome'] = 'warm'
+        else:
+            plan.update(outcome='solve-cached', action='verify')
+        return plan
+    archive = conda_execute.archive.archive_path(env_prefix)
+    if archive:
+        plan.update(outcome='solve-cached', action='restore',
+                    archive_bytes=os.path.getsize(archive))
+        return plan
+
+    backend = conda_execute.solver.get_backend()
+    index = backend.get_index(channels)
+    journal = read_journal(env_prefix)
+    if journal is not None and _valid_journal(env_prefix, journal, canonical_specs(spec)):
+        plan.update(outcome='solve-cached', action='resume')
+        packages = [backend.dist_from_str(dist) for dist in journal['solved']]
+        installed = installed_dists(env_prefix)
+    else:
+        plan.update(outcome='cold', action='create')
+        packages = conda_execute.solver.solve(backend, index, spec, channels)
+        installed = set()
+        if conda_execute.config.derive_max_distance > 0:
+            wanted = set(_dist_name(dist) for dist in packages)
+            base_env, distance = nearest_env(wanted, exclude=[env_prefix],
+                                             prefix_length=len(env_prefix))
+            if base_env is not None and distance <= conda_execute.config.derive_max_distance:
+                plan['derive_from'] = base_env
+                installed = installed_dists(base_env)
+    plan['packages'] = len(packages)
+    plan.update(_fetch_plan(index, [dist for dist in packages
+                                    if _dist_name(dist) not in installed]))
+    return plan
+
+
+class _NoLimit(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+def creation_slot():
+    """
+    A context manager holding one of the machine-wide environment creation
+    slots (see the ``max-concurrent-creations`` config).
+
+    """
+    slots = conda_execute.config.max_concurrent_creations
+    if slots <= 0:
+        return _NoLimit()
+    return Semaphore(os.path.join(conda_execute.config.env_dir, '.creation-slots'), slots)
+
+
+def env_is_complete(env_prefix):
+    """
+    Whether the environment has been completely created. (The execution.log
+    is attached as the last step of creation.)
+
+    """
+    return os.path.exists(os.path.join(env_prefix, 'conda-meta', 'execution.log'))
+
+
+def env_is_being_created(env_prefix):
+    """
+    Whether a process holds the creation lock of the environment.
+
+    """
+    return is_locked(env_prefix)
+
+
+def _journal_file(env_prefix):
+    return os.path.join(env_prefix, 'conda-meta', 'conda-execute-journal.yml')
+
+
+def read_journal(env_prefix):
+    try:
+        with open(_journal_file(env_prefix), 'r') as fh:
+            return yaml.safe_load(fh)
+    except (IOError, OSError, yaml.YAMLError):
+        return None
+
+
+def _write_journal(env_prefix, journal):
+    atomic_write(_journal_file(env_prefix), yaml.safe_dump(journal, default_flow_style=False))
+
+
+def _valid_journal(env_prefix, journal, spec):
+    """
+    Check that the journal describes the creation of the given (canonical)
+    spec, and
+    that the packages already linked into the prefix are consistent with it.
+
+    """
+    if not isinstance(journal, dict) or journal.get('spec') != list(spec):
+        return False
+    solved = set(_dist_name(dist) for dist in journal.get('solved', []))
+    return installed_dists(env_prefix).issubset(solved)
+
+
+def _write_solved_journal(env_locn, spec, packages):
+    """
+    Start the creation journal of the environment, from the solved packages
+    of its spec (and the nearest environment to derive it from, if any).
+
+    """
+    journal = {'spec': list(canonical_specs(spec)),
+               'solved': [str(dist) for dist in packages], 'steps': ['solved']}
+    base_env, distance = None, None
+    if conda_execute.config.derive_max_distance > 0:
+        wanted = set(_dist_name(dist) for dist in packages)
+        base_env, distance = nearest_env(wanted, exclude=[env_locn],
+                                         prefix_length=len(env_locn))
+    if base_env is not None and distance <= conda_execute.config.derive_max_distance:
+        journal['base'] = base_env
+    _write_journal(env_locn, journal)
+    return journal
+
+
+def _create_env(env_locn, spec, extra_channels, timings=None, load_index=None):
+    """
+    Solve the specification and build the environment at env_locn, either
+    by deriving it from the nearest existing environment or from scratch.
+
+    Progress is recorded in a journal within the prefix, so that an
+    interrupted creation is resumed from its last completed step rather
+    than being started over.
+
+    The packages are solved, fetched and linked by the backend of the
+    ``solver`` config (see :mod:`conda_execute.solver`).
+
+    """
+    backend = conda_execute.solver.get_backend()
+    journal = read_journal(env_locn)
+    if journal is not None and not _valid_journal(env_locn, journal, canonical_specs(spec)):
+        log.warn('Discarding the inconsistent creation journal of {}'.format(env_locn))
+        journal = None
+    if journal is None and os.path.exists(env_locn):
+        log.warn('Removing incomplete environment {} (with no creation journal)'.format(env_locn))
+        shutil.rmtree(env_locn)
+
+    index = (load_index or backend.get_index)(extra_channels)
+
+    if journal is None:
+        solve_start = time.time()
+        full_list_of_packages = conda_execute.solver.solve(backend, index, list(spec),
+                                                              extra_channels)
+        if timings is not None:
+            timings['solve'] = time.time() - solve_start
+        # Put out a newline. Conda's solve doesn't do it for us.
+        log.info('\n')
+        journal = _write_solved_journal(env_locn, spec, full_list_of_packages)
+    else:
+        log.info('Resuming the creation of {} after "{}"'.format(env_locn, journal['steps'][-1]))
+        full_list_of_packages = [backend.dist_from_str(dist) for dist in journal['solved']]
+
+    if 'base' in journal and 'derived' not in journal['steps']:
+        # A derivation which didn't complete can't be resumed; it's quicker to start again.
+        base_env = journal.pop('base')
+        if installed_dists(env_locn):
+            log.info('Discarding the partial derivation of {}'.format(env_locn))
+            shutil.rmtree(env_locn)
+            _write_journal(env_locn, journal)
+        log.info('Deriving environment from {}'.format(base_env))
+        try:
+            _derive_env(base_env, env_locn, full_list_of_packages)
+            journal['base'] = base_env
+            journal['steps'].append('derived')
+            _write_journal(env_locn, journal)
+        except Exception as exception:
+            log.warn('Unable to derive environment from {} ({}: {}). '
+                     'Creating it from scratch.'.format(base_env, type(exception).__name__,
+                                                        exception))
+            shutil.rmtree(env_locn, ignore_errors=True)
+            _write_journal(env_locn, journal)
+
+    installed = installed_dists(env_locn)
+    missing = [dist for dist in full_list_of_packages if _dist_name(dist) not in installed]
+    if 'fetched' not in journal['steps']:
+        backend.fetch(index, missing)
+        journal['steps'].append('fetched')
+        _write_journal(env_locn, journal)
+    if missing:
+        backend.link(env_locn, index, missing)
+    journal['steps'].append('linked')
+    _write_journal(env_locn, journal)
+
+    _write_manifest(env_locn, full_list_of_packages)
+
+    # Attach an execution.log file, marking the environment as complete.
+    with open(os.path.join(env_locn, 'conda-meta', 'execution.log'), 'a'):
+        pass
+    os.remove(_journal_file(env_locn))
+
+
+def _manifest_file(env_prefix):
+    return os.path.join(env_prefix, 'conda-meta', 'conda-execute.manifest')
+
+
+def _file_stats(env_prefix, dist_name):
+    """
+    The (path, size, mtime, inode) of each file of the given linked package.
+
+    """
+    with open(os.path.join(env_prefix, 'conda-meta', dist_name + '.json'), 'r') as fh:
+        files = json.load(fh).get('files', [])
+    stats = []
+    for path in files:
+        try:
+            stat = os.lstat(os.path.join(env_prefix, path))
+        except OSError:
+            continue
+        stats.append([path, stat.st_size, int(stat.st_mtime), stat.st_ino])
+    return stats
+
+
+def read_manifest(env_prefix):
+    try:
+        with open(_manifest_file(env_prefix), 'r') as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write_manifest(env_prefix, packages, manifest=None):
+    """
+    Record the stat metadata of the files of the given packages (adding to
+    an existing manifest, if given), against which the integrity of the
+    environment can later be verified.
+
+    """
+    manifest = manifest or {}
+    for dist in packages:
+        dist_name = _dist_name(dist)
+        manifest[dist_name] = {'dist': str(dist), 'files': _file_stats(env_prefix, dist_name)}
+    atomic_write(_manifest_file(env_prefix), json.dumps(manifest))
+
+
+def _refresh_manifest(env_prefix):
+    """
+    Record the stat metadata of the files of an environment which has been
+    unpacked (or relocated), which changes it, in its manifest.
+
+    """
+    manifest = read_manifest(env_prefix)
+    if manifest is not None:
+        _write_manifest(env_prefix, [record['dist'] for record in manifest.values()])
+
+
+def broken_dists(env_prefix):
+    """
+    Return the names of the packages whose files no longer match the
+    manifest written when the environment was created (missing, or with a
+    changed size, mtime or inode), or None if the environment has no
+    manifest.
+
+    """
+    manifest = read_manifest(env_prefix)
+    if manifest is None:
+        return None
+    installed = installed_dists(env_prefix)
+    broken = []
+    for dist_name, record in sorted(manifest.items()):
+        if dist_name not in installed:
+            broken.append(dist_name)
+            continue
+        for path, size, mtime, inode in record['files']:
+            try:
+                stat = os.lstat(os.path.join(env_prefix, path))
+            except OSError:
+                broken.append(dist_name)
+                break
+            if (stat.st_size, int(stat.st_mtime), stat.st_ino) != (size, mtime, inode):
+                broken.append(dist_name)
+                break
+    return broken
+
+
+def _verified_file(env_prefix):
+    return os.path.join(env_prefix, 'conda-meta', 'conda-execute.verified')
+
+
+def recently_verified(env_prefix, verify_envs=None, verify_interval=None):
+    """
+    Whether the environment needn't be verified again, either because
+    verification is disabled or because it was verified within the
+    ``verify-interval``. Either config may be overridden.
+
+    """
+    if verify_envs is None:
+        verify_envs = conda_execute.config.verify_envs
+    if verify_interval is None:
+        verify_interval = conda_execute.config.verify_interval
+    if not verify_envs or is_shared_env(env_prefix):
+        # Shared environments can't be repaired from here.
+        return True
+    try:
+        verified = os.path.getmtime(_verified_file(env_prefix))
+    except OSError:
+        return False
+    return time.time() - verified < verify_interval
+
+
+def verify_env(env_prefix, extra_channels=(), load_index=None):
+    """
+    Check the environment's files against its manifest, re-linking any
+    packages that have been damaged. Returns the names of the repaired
+    packages. The package index of the channels is loaded (by load_index,
+    if given, as for :func:`create_env`) only if there are packages to
+    repair.
+
+    """
+    backend = conda_execute.solver.get_backend()
+    broken = broken_dists(env_prefix)
+    if broken is None:
+        log.debug('No manifest for {}; unable to verify it.'.format(env_prefix))
+    elif broken:
+        log.warn('Repairing damaged packages in {}: {}'.format(env_prefix, ', '.join(broken)))
+        manifest = read_manifest(env_prefix)
+        packages = [backend.dist_from_str(manifest[dist_name]['dist']) for dist_name in broken]
+        installed = installed_dists(env_prefix)
+        for dist_name in broken:
+            if dist_name in installed:
+                _unlink_dist(env_prefix, dist_name)
+        index = (load_index or backend.get_index)(extra_channels)
+        backend.link(env_prefix, index, packages)
+        _write_manifest(env_prefix, packages, manifest)
+    with open(_verified_file(env_prefix), 'a'):
+        os.utime(_verified_file(env_prefix), None)
+    return broken or []
+
+
+def _format_size(n_bytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if n_bytes < 1024:
+            break
+        n_bytes /= 1024.
+    else:
+        unit = 'TB'
+    return '{:.1f}{}'.format(n_bytes, unit)
+
+
 def subcommand_list(args):
     """
     The function which handles the list subcommand.
 
     """
+    ranks = conda_execute.usage.env_ranks()
+    hot = set(conda_execute.usage.hot_envs())
     for env, env_stats in envs_and_running_pids():
         if env_stats is None:
             continue
         last_pid_dt = datetime.datetime.fromtimestamp(env_stats['latest_creation_time'])
         age = datetime.datetime.now() - last_pid_dt
-        old = age > datetime.timedelta(conda_execute.config.min_age)
         PIDs = env_stats['alive_PIDs']
         if PIDs:
             running_pids = '(running PIDs {})'.format(', '.join(map(str, env_stats['alive_PIDs'])))
         else:
             running_pids = ''
+        rank = 'rank {}{}'.format(ranks.get(env, '-'), ', kept warm' if env in hot else '')
+        env_info = read_env_info(env)
+        if env_info.get('pin'):
+            rank += ', pinned'
+        elif 'keep_for' in env_info:
+            rank += ', kept for {}h'.format(env_info['keep_for'])
+        footprint = 'live, {}'.format(_format_size(conda_execute.archive.disk_usage(env)))
         # TODO Use pretty timedelta printing. e.g. 1 hour 30 mins, or 2 weeks, 6 days and 4 hours etc.
-        print('{} processes (newest created {} ago) using {} {}'.format(
-                len(PIDs), age, env, running_pids))
+        print('{} processes (newest created {} ago) using {} [{}] [{}] {}'.format(
+                len(PIDs), age, env, footprint, rank, running_pids))
+
+    for env, archive in conda_execute.archive.archived_envs():
+        age = datetime.datetime.now() - datetime.datetime.fromtimestamp(os.path.getmtime(archive))
+        footprint = 'archived, {}'.format(_format_size(conda_execute.archive.disk_usage(archive)))
+        print('0 processes (newest created {} ago) using {} [{}] [rank {}]'.format(
+                age, env, footprint, ranks.get(env, '-')))
 
 
 def tmp_envs():
-    if not os.path.exists(conda_execute.config.env_dir):
-        return []
-    envs = [os.path.join(conda_execute.config.env_dir, prefix)
-            for prefix in os.listdir(conda_execute.config.env_dir)]
-    envs = [prefix for prefix in envs
-            if os.path.isdir(os.path.join(prefix, 'conda-meta'))]
-    return envs
+    return conda_execute.catalog.envs()
 
 
 def envs_and_running_pids():
@@ -174,87 +1026,485 @@ def envs_and_running_pids():
     with Locked(conda_execute.config.env_dir):
         running_pids = set(psutil.pids())
         for env in tmp_envs():
-            env_stats = None
-            exe_log = os.path.join(env, 'conda-meta', 'execution.log')
-            execution_pids = []
-            if os.path.exists(exe_log):
-                with open(exe_log, 'r') as fh:
-                    for line in fh:
-                        execution_pids.append(line.strip().split(','))
-                alive_pids = []
-                newest_pid_time = os.path.getmtime(exe_log)
-                # Iterate backwards, as we are more likely to hit newer ones first in that order.
-                for pid, creation_time in execution_pids[::-1]:
-                    pid = int(pid)
-                    # Trim off the decimals to simplify comparisson with pid.create_time().
-                    creation_time = int(float(creation_time))
-
-                    if creation_time > newest_pid_time:
-                        newest_pid_time = creation_time
-
-                    # Check if the process is still running.
-                    try:
-                        alive = (pid in running_pids and
-                                 int(psutil.Process(pid).create_time()) == creation_time)
-                    except psutil.NoSuchProcess:
-                        alive = False
-
-                    if alive:
-                        alive_pids.append(pid)
-                        env_stats = {'alive_PIDs': alive_pids, 'latest_creation_time': newest_pid_time}
-            yield env, env_stats
+            yield env, _env_stats(env, running_pids)
 
 
-def subcommand_name(args):
+def _env_stats(env, running_pids):
+    """
+    The running processes of the environment, and when it was last used,
+    from its execution log (or None if it has none).
+
+    """
+    exe_log = os.path.join(env, 'conda-meta', 'execution.log')
+    execution_pids = []
+    if not os.path.exists(exe_log):
+        return None
+    with open(exe_log, 'r') as fh:
+        for line in fh:
+            execution_pids.append(line.strip().split(','))
+    alive_pids = []
+    newest_pid_time = os.path.getmtime(exe_log)
+    # Iterate backwards, as we are more likely to hit newer ones first in that order.
+    for pid, creation_time in execution_pids[::-1]:
+        pid = int(pid)
+        # Trim off the decimals to simplify comparisson with pid.create_time().
+        creation_time = int(float(creation_time))
+
+        if creation_time > newest_pid_time:
+            newest_pid_time = creation_time
+
+        # Check if the process is still running.
+        try:
+            alive = (pid in running_pids and
+                     int(psutil.Process(pid).create_time()) == creation_time)
+        except psutil.NoSuchProcess:
+            alive = False
+
+        if alive:
+            alive_pids.append(pid)
+    return {'alive_PIDs': alive_pids, 'latest_creation_time': newest_pid_time}
+
+
+def _specs_from_args(args):
     specs = list(args.specs)
     for fname in args.file:
         with open(fname) as fh:
-            specs.extend([line.strip() for line in fh])
-    print(name_env(args.specs))
+            specs.extend(fh.readlines())
+    return strip_specs(specs)
+
+
+def subcommand_name(args):
+    print(find_env(_specs_from_args(args), args.channel))
     return 0
 
 
 def subcommand_create(args):
-    specs = list(args.specs)
-    for fname in args.file:
-        with open(fname) as fh:
-            specs.extend([line.strip() for line in fh])
+    specs = _specs_from_args(args)
     if not specs:
         import sys
         print("Error: no packages to install, must supply command line package specs or --file.", file=sys.stderr)
         return 1
     log.info('Creating an environment with {}'.format(specs))
-    r = create_env(specs, force_recreation=args.force)
+    r = create_env(specs, force_recreation=args.force, extra_channels=args.channel)
     # Output the created environment name
     print(r)
     return 0
 
 
+def touch_env_usage(env_prefix):
+    """
+    Mark the environment as used now, without registering a process against
+    it, so that it isn't considered for removal for another min_age.
+
+    """
+    if is_shared_env(env_prefix):
+        return
+    exe_log = os.path.join(env_prefix, 'conda-meta', 'execution.log')
+    if not os.path.isdir(os.path.dirname(exe_log)):
+        os.makedirs(os.path.dirname(exe_log))
+    with open(exe_log, 'a'):
+        os.utime(exe_log, None)
+
+
+def _script_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+                for fname in sorted(files):
+                    yield os.path.join(root, fname)
+        else:
+            yield path
+
+
+def _prewarm_env(env_spec, channels):
+    """
+    Build the given environment, returning the time taken and any error
+    message. Run in a worker process by :func:`subcommand_prewarm`.
+
+    """
+    start = time.time()
+    try:
+        create_env(env_spec, extra_channels=channels)
+    except Exception as exception:
+        return time.time() - start, '{}: {}'.format(type(exception).__name__, exception)
+    return time.time() - start, None
+
+
+def subcommand_prewarm(args):
+    """
+    Build the environments of the given scripts (or directories of scripts)
+    ahead of time.
+
+    """
+    import multiprocessing
+    from conda_execute.execute import extract_spec
+
+    # Deduplicate the scripts by the environment they need.
+    targets = {}
+    for path in _script_paths(args.paths):
+        try:
+            with open(path, 'r') as fh:
+                spec = extract_spec(fh)
+        except (IOError, OSError, ValueError, yaml.YAMLError) as exception:
+            log.warn('Skipping {}: {}'.format(path, exception))
+            continue
+        env_spec = strip_specs(spec.get('env', []))
+        if not env_spec:
+            log.info('Skipping {}: no environment specified'.format(path))
+            continue
+        channels = tuple(spec.get('channels', []))
+        env_locn = find_env(env_spec, channels)
+        targets.setdefault(env_locn, (env_spec, channels, []))[2].append(path)
+
+    to_build = {}
+    for env_locn, (env_spec, channels, paths) in sorted(targets.items()):
+        if env_is_complete(env_locn):
+            touch_env_usage(env_locn)
+            print('warm    {} ({})'.format(env_locn, ', '.join(paths)))
+        else:
+            to_build[env_locn] = (env_spec, channels)
+
+    if not to_build:
+        return 0
+
+    # Solve each environment, and fetch the union of the packages, once. The solved (and
+    # fetched) packages are journaled, so that the parallel builds resume from there and only link.
+    backend = conda_execute.solver.get_backend()
+    failed = 0
+    indices = {}
+    solved = {}
+    for env_locn, (env_spec, channels) in sorted(to_build.items()):
+        if channels not in indices:
+            indices[channels] = (backend.get_index(channels), set())
+        index, packages = indices[channels]
+        try:
+            solved[env_locn] = conda_execute.solver.solve(backend, index, list(env_spec),
+                                                          channels)
+            packages.update(solved[env_locn])
+        except (Exception, SystemExit) as exception:
+            # Older conda versions exit when a spec can't be satisfied.
+            failed += 1
+            print('failed  {}: {}: {}'.format(env_locn, type(exception).__name__, exception))
+            del to_build[env_locn]
+    for index, packages in indices.values():
+        log.info('Fetching {} packages'.format(len(packages)))
+        backend.fetch(index, sorted(packages))
+    for env_locn, (env_spec, channels) in to_build.items():
+        with Locked(env_locn):
+            # Leave any environment which is (partially) there to create_env.
+            if not os.path.exists(env_locn):
+                journal = _write_solved_journal(env_locn, env_spec, solved[env_locn])
+                journal['steps'].append('fetched')
+                _write_journal(env_locn, journal)
+
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        results = dict((env_locn, pool.apply_async(_prewarm_env, spec_and_channels))
+                       for env_locn, spec_and_channels in to_build.items())
+        for env_locn, result in sorted(results.items()):
+            duration, error = result.get()
+            if error:
+                failed += 1
+                print('failed  {} after {:.1f}s: {}'.format(env_locn, duration, error))
+            else:
+                touch_env_usage(env_locn)
+                print('built   {} in {:.1f}s'.format(env_locn, duration))
+    finally:
+        pool.close()
+        pool.join()
+    return 1 if failed else 0
+
+
+_BUNDLE_METADATA = 'conda-execute-bundle.yml'
+
+
+def export_bundle(spec, path, channels=()):
+    """
+    Pack the temporary environment of the given spec (creating it if need
+    be), along with the metadata needed to name it, into a single bundle
+    file which can be imported on another machine with :func:`import_bundle`.
+
+    """
+    env_locn = create_env(spec, extra_channels=channels)
+    metadata = {'prefix': env_locn, 'spec': list(canonical_specs(spec)),
+                'channels': list(channels), 'subdir': conda_execute.config.subdir}
+    exclude = _env_records(env_locn) - set([os.path.relpath(_manifest_file(env_locn), env_locn)])
+    log.info('Exporting {} to {}'.format(env_locn, path))
+    conda_execute.archive.pack(env_locn, path, arcname='prefix', exclude=exclude,
+                               extra={_BUNDLE_METADATA: yaml.safe_dump(metadata).encode('utf-8')})
+    return env_locn
+
+
+def import_bundle(path, force=False):
+    """
+    Unpack a bundle created by :func:`export_bundle` into the env_dir at the
+    prefix that its spec names on this machine, relocating it if that
+    differs from the prefix it was exported from. Returns the prefix.
+
+    """
+    staging = os.path.join(conda_execute.config.env_dir,
+                           '.import-{}'.format(os.getpid()))
+    conda_execute.archive.unpack(path, staging)
+    try:
+        with open(os.path.join(staging, _BUNDLE_METADATA), 'r') as fh:
+            metadata = yaml.safe_load(fh)
+        if metadata['subdir'] != conda_execute.config.subdir:
+            raise ValueError('The bundle was exported for {}, not {}.'.format(
+                metadata['subdir'], conda_execute.config.subdir))
+        env_locn = name_env(metadata['spec'], metadata['channels'])
+        with Locked(env_locn):
+            if env_is_complete(env_locn) and not force:
+                log.warn('{} already exists; not importing {}.'.format(env_locn, path))
+                return env_locn
+            if os.path.exists(env_locn):
+                shutil.rmtree(env_locn)
+            os.rename(os.path.join(staging, 'prefix'), env_locn)
+            if metadata['prefix'] != env_locn:
+                log.info('Relocating from {} to {}'.format(metadata['prefix'], env_locn))
+                try:
+                    relocate_env(env_locn, metadata['prefix'])
+                except Exception:
+                    shutil.rmtree(env_locn)
+                    raise
+            conda_execute.catalog.add(env_locn)
+            _refresh_manifest(env_locn)
+            touch_env_usage(env_locn)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return env_locn
+
+
+def subcommand_export(args):
+    specs = _specs_from_args(args)
+    if not specs:
+        import sys
+        print("Error: no packages specified, must supply command line package specs or --file.", file=sys.stderr)
+        return 1
+    export_bundle(specs, args.output, args.channel)
+    print(args.output)
+    return 0
+
+
+def subcommand_import(args):
+    print(import_bundle(args.bundle, force=args.force))
+    return 0
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    return '{:.2f}s'.format(seconds)
+
+
+def subcommand_stats(args):
+    """
+    Summarise the event log: the warm hit rate, the percentiles of the time
+    taken by each phase of an execution, the environments which are run
+    most and which have cost the most time to create, and the resources used
+    by the scripts of each environment (compared to before it was rebuilt).
+
+    """
+    since = None
+    if args.since is not None:
+        since = time.time() - parse_duration(args.since) * 60 * 60
+    stats = conda_execute.events.Stats()
+    for event in conda_execute.events.read_events(since):
+        stats.add(event)
+    if not stats.runs:
+        print('No executions recorded.')
+        return 0
+
+    print('{} executions from {} to {}: {} warm ({:.1%} hit rate), {} failed'.format(
+        stats.runs, datetime.datetime.fromtimestamp(stats.first).strftime('%Y-%m-%d %H:%M'),
+        datetime.datetime.fromtimestamp(stats.last).strftime('%Y-%m-%d %H:%M'),
+        stats.hits, stats.hits / float(stats.runs), stats.failures))
+    print('')
+    row = '{:<10} {:>9} {:>9} {:>9} {:>9} {:>9}'
+    print(row.format('phase', 'p50', 'p90', 'p95', 'p99', 'max'))
+    histograms = [(phase, stats.phases[phase]) for phase in ['spec', 'env', 'solve', 'run']
+                  if phase in stats.phases]
+    for name, histogram in histograms + [('startup', stats.startup)]:
+        print(row.format(name, *[_format_seconds(histogram.percentile(percent))
+                                 for percent in [50, 90, 95, 99]] +
+                         [_format_seconds(histogram.max)]))
+
+    for title, key in [('Most run', 'runs'), ('Most time creating', 'created')]:
+        top = stats.top_envs(args.top, key)
+        if not top:
+            continue
+        print('')
+        print('{} environments:'.format(title))
+        row = '{:<20} {:>7} {:>9} {:>10}  {}'
+        print(row.format('env', 'runs', 'creations', 'creating', 'spec'))
+        for env, runs, creations, seconds in top:
+            usage = conda_execute.usage.read_usage(conda_execute.catalog.env_path(env)) or {}
+            print(row.format(env, runs, creations, _format_seconds(seconds),
+                             ', '.join(usage.get('spec', []))))
+
+    top = stats.top_resources(args.top)
+    if top:
+        print('')
+        print('Resources used since each environment was (re)built:')
+        row = '{:<20} {:>7} {:>9} {:>10} {:>8} {:>8}'
+        print(row.format('env', 'runs', 'CPU/run', 'peak RSS', 'CPU', 'RSS'))
+        for env, runs, cpu, max_rss, cpu_change, rss_change in top:
+            print(row.format(env, runs, _format_seconds(cpu),
+                             '{:.1f}MiB'.format(max_rss / 1024. ** 2),
+                             *['-' if change is None else '{:+.0%}'.format(change - 1)
+                               for change in [cpu_change, rss_change]]))
+    return 0
+
+
+def subcommand_metrics(args):
+    if args.textfile:
+        conda_execute.metrics.write_textfile(args.textfile)
+    else:
+        print(conda_execute.metrics.collect(), end='')
+    return 0
+
+
+def subcommand_reindex(args):
+    envs = conda_execute.catalog.reindex()
+    print('Indexed {} temporary environments.'.format(len(envs)))
+    return 0
+
+
 def subcommand_clear(args):
     if args.min_age is not None:
         args.min_age = float(args.min_age)
     return cleanup_tmp_envs(min_age=args.min_age)
 
 
-def cleanup_tmp_envs(min_age=None):
+def subcommand_archive(args):
+    if args.min_age is not None:
+        args.min_age = parse_duration(args.min_age)
+    archived = archive_idle_envs(min_age=args.min_age)
+    print('Archived {} temporary environments.'.format(len(archived)))
+    return 0
+
+
+def archive_idle_envs(min_age=None):
+    """
+    Pack the temporary environments with no running processes which haven't
+    been used for min_age hours (default ``archive-after`` config) into
+    compressed archives (see :mod:`conda_execute.archive`), other than the
+    hot and pinned environments and those whose scripts asked to be kept
+    (``keep_for``). Returns the prefixes of the archived environments.
+
+    Only the lock of each environment is held while it is packed, so that
+    executions of other environments needn't wait for the archiving.
+
+    """
+    if min_age is None:
+        min_age = conda_execute.config.archive_after
+    if min_age <= 0:
+        return []
+    hot = set(conda_execute.usage.hot_envs())
+    idle = []
     for env, env_stats in envs_and_running_pids():
-        if env_stats is not None:
-            last_pid_dt = datetime.datetime.fromtimestamp(env_stats['latest_creation_time'])
-            age = datetime.datetime.now() - last_pid_dt
-            if min_age is None:
-                min_age = conda_execute.config.min_age
-            old = age > datetime.timedelta(min_age)
-            if len(env_stats['alive_PIDs']) == 0 and old:
-                log.warn('Removing unused temporary environment {}.'.format(env))
-                shutil.rmtree(env)
+        env_info = read_env_info(env)
+        if (env_stats is None or env in hot or env_info.get('pin') or 'keep_for' in env_info):
+            continue
+        if not env_stats['alive_PIDs']:
+            idle.append(env)
+
+    archived = []
+    for env in idle:
+        with Locked(env):
+            # The environment may have been used (or removed) since it was found to be idle.
+            env_stats = _env_stats(env, set(psutil.pids()))
+            if (env_stats is None or env_stats['alive_PIDs'] or
+                    time.time() - env_stats['latest_creation_time'] < min_age * 60 * 60):
+                continue
+            conda_execute.archive.archive_env(env, env_stats['latest_creation_time'])
+            archived.append(env)
+    return archived
+
+
+def _stale_env(env, env_stats, hot, min_age, log_kept=None):
+    """
+    Why the environment should be removed (or, if it no longer exists,
+    forgotten) by :func:`cleanup_tmp_envs`, or None if it should be kept
+    (passing the reason to log_kept, if given).
+
+    """
+    env_info = read_env_info(env)
+    if env in hot:
+        kept = 'Keeping frequently used temporary environment {} warm.'
+    elif env_info.get('pin'):
+        kept = 'Keeping pinned temporary environment {}.'
+    elif env_stats is not None:
+        last_pid_dt = datetime.datetime.fromtimestamp(env_stats['latest_creation_time'])
+        age = datetime.datetime.now() - last_pid_dt
+        if 'keep_for' in env_info:
+            old = age > datetime.timedelta(hours=env_info['keep_for'])
         else:
-            log.warn('Could not find execution log for {}. Removing environment.'.format(env))
-            shutil.rmtree(env)
+            old = age > datetime.timedelta(days=min_age)
+        if len(env_stats['alive_PIDs']) == 0 and old:
+            return 'Removing unused temporary environment {}.'.format(env)
+        return None
+    elif env_is_being_created(env):
+        kept = 'Skipping temporary environment {} which is being created.'
+    elif (os.path.exists(_journal_file(env)) and
+            time.time() - os.path.getmtime(_journal_file(env)) < min_age * 24 * 60 * 60):
+        kept = 'Keeping interrupted temporary environment {} to be resumed.'
+    elif not os.path.exists(env):
+        return 'Removing {}, which no longer exists, from the catalog.'.format(env)
+    else:
+        return 'Could not find execution log for {}. Removing environment.'.format(env)
+    if log_kept is not None:
+        log_kept(kept.format(env))
+    return None
+
+
+def cleanup_tmp_envs(min_age=None):
+    """
+    Remove temporary environments with no running processes which haven't
+    been used for min_age days (default ``remove-if-unused-for`` config).
+    Environments whose scripts asked to be kept for longer (``keep_for``) are
+    kept for longer, and pinned environments are never removed.
+
+    Archives (see :func:`archive_idle_envs`) are removed once min_age has
+    passed since their environment was last used.
+
+    """
+    if min_age is None:
+        min_age = conda_execute.config.min_age
+    hot = set(conda_execute.usage.hot_envs())
+    # Check without the lock first, so that the usual cleanup (after an execution in an
+    # environment which was already built), which removes nothing, never imports conda for it.
+    running_pids = set(psutil.pids())
+    if any(_stale_env(env, _env_stats(env, running_pids), hot, min_age, log.debug)
+           for env in tmp_envs()):
+        for env, env_stats in envs_and_running_pids():
+            reason = _stale_env(env, env_stats, hot, min_age)
+            if reason is None:
+                continue
+            if os.path.exists(env):
+                log.warn(reason)
+                shutil.rmtree(env)
+            else:
+                log.debug(reason)
+            conda_execute.catalog.remove(env)
+
+    for env, archive in conda_execute.archive.archived_envs():
+        if env not in hot and time.time() - os.path.getmtime(archive) > min_age * 24 * 60 * 60:
+            log.warn('Removing unused archived environment {}.'.format(archive))
+            os.remove(archive)
+    conda_execute.remote.prune_script_cache()
+    conda_execute.usage.maintain_if_due()
+    conda_execute.metrics.write_textfile_if_due()
 
 
 def main():
     common_arguments = argparse.ArgumentParser(add_help=False)
     common_arguments.add_argument('--verbose', '-v', action='store_true', help='show debug output')
+    common_arguments.add_argument('--env-dir', default=None,
+                                  help='The directory of the temporary environments, in place of '
+                                       'the env-dir config.')
+    common_arguments.add_argument('--pkg-dir', default=None,
+                                  help='The package cache, in place of the pkg-dir config.')
 
     parser = argparse.ArgumentParser(description='Manage temporary environments within conda.',
                                      parents=[common_arguments])
@@ -271,6 +1521,8 @@ def main():
     creation_args.add_argument('--file', default=[], action='append',
                                help=('Read package versions from the given file. Repeated file '
                                      'specifications can be passed (e.g. --file=file1 --file=file2)'))
+    creation_args.add_argument('--channel', '-c', default=[], action='append',
+                               help='Additional channel to search for packages. May be repeated.')
 
     create_subcommand = subparsers.add_parser('create', parents=[common_arguments, creation_args],
                                               help='Create a new environment from specifications.')
@@ -281,6 +1533,56 @@ def main():
                                             help='Get the full prefix for a specified environment.')
     name_subcommand.set_defaults(subcommand_func=subcommand_name)
 
+    export_subcommand = subparsers.add_parser('export', parents=[common_arguments, creation_args],
+                                              help='Pack an environment into a bundle for use on another machine.')
+    export_subcommand.set_defaults(subcommand_func=subcommand_export)
+    export_subcommand.add_argument('--output', '-o', required=True,
+                                   help='The bundle file to write (zstd compressed if it ends with .zst, '
+                                        'gzip otherwise).')
+
+    import_subcommand = subparsers.add_parser('import', parents=[common_arguments],
+                                              help='Unpack an environment bundle created with export.')
+    import_subcommand.set_defaults(subcommand_func=subcommand_import)
+    import_subcommand.add_argument('bundle', help='The bundle file to import.')
+    import_subcommand.add_argument('--force', action='store_true',
+                                   help='Replace the environment, even if it already exists.')
+
+    prewarm_subcommand = subparsers.add_parser('prewarm', parents=[common_arguments],
+                                               help='Build the environments of scripts ahead of time.')
+    prewarm_subcommand.set_defaults(subcommand_func=subcommand_prewarm)
+    prewarm_subcommand.add_argument('paths', nargs='+', metavar='PATH',
+                                    help='Scripts, or directories of scripts, to build environments for.')
+    prewarm_subcommand.add_argument('--jobs', '-j', type=int, default=4,
+                                    help='The maximum number of environments to build at once.')
+
+    stats_subcommand = subparsers.add_parser('stats', parents=[common_arguments],
+                                             help='Summarise the log of executions.')
+    stats_subcommand.set_defaults(subcommand_func=subcommand_stats)
+    stats_subcommand.add_argument('--since', default=None,
+                                  help='Only include executions within this duration (e.g. 12h, 7d).')
+    stats_subcommand.add_argument('--top', type=int, default=10,
+                                  help='The number of environments to list in each table.')
+
+    metrics_subcommand = subparsers.add_parser('metrics', parents=[common_arguments],
+                                               help='Output Prometheus metrics of the environments and executions.')
+    metrics_subcommand.set_defaults(subcommand_func=subcommand_metrics)
+    metrics_subcommand.add_argument('--textfile', default=None,
+                                    help=('Write the metrics (atomically) to this file, e.g. in '
+                                          'the node_exporter textfile collector directory, rather '
+                                          'than to stdout.'))
+
+    reindex_subcommand = subparsers.add_parser('reindex', parents=[common_arguments],
+                                               help='Rebuild the catalog of temporary environments.')
+    reindex_subcommand.set_defaults(subcommand_func=subcommand_reindex)
+
+    archive_subcommand = subparsers.add_parser('archive', parents=[common_arguments],
+                                               help='Archive idle environments into compressed tarballs.')
+    archive_subcommand.set_defaults(subcommand_func=subcommand_archive)
+    archive_subcommand.add_argument('--min-age', default=None, dest='min_age',
+                                    help=('The time since an environment was last used (e.g. 12h, '
+                                          '2d) after which it is archived. Defaults to the '
+                                          'archive-after config.'))
+
     clear_subcommand = subparsers.add_parser('clear', parents=[common_arguments],
                                              help='Clean up unused temporary environments.')
     clear_subcommand.set_defaults(subcommand_func=subcommand_clear)
@@ -295,6 +1597,12 @@ def main():
         log_level = logging.DEBUG
 
     conda_execute.config.setup_logging(log_level)
+    conda_execute.config.cache_conda_settings()
+    if args.env_dir:
+        for name, value in conda_execute.config.env_dir_settings(args.env_dir).items():
+            setattr(conda_execute.config, name, value)
+    if args.pkg_dir:
+        conda_execute.config.pkg_dir = os.path.normpath(os.path.expanduser(args.pkg_dir))
 
     log.debug('Arguments passed: {}'.format(args))
     if hasattr(args, 'subcommand_func'):
@@ -0,0 +1,181 @@
+"""
+Usage statistics for the specifications of temporary environments.
+
+Each environment has a record under ``<env_dir>/.usage`` (laid out as the
+environments are in the env_dir) of its spec, channels, the number of times it
+has been used and when it was last used. The records outlive the environments
+themselves, so that the most popular environments can be kept warm (see the
+``keep-warm`` config) and rebuilt if they are removed. The records of
+environments which have been removed, and not used since for
+``forget-usage-after`` days, are pruned.
+
+Counts are updated without locking, so concurrent executions of the same
+spec may occasionally lose an increment. They are a measure of popularity,
+not an audit log.
+
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import conda_execute.archive
+import conda_execute.catalog
+import conda_execute.config
+from conda_execute.utils import atomic_write
+
+
+log = logging.getLogger('conda-execute')
+log.addHandler(logging.NullHandler())
+
+
+def _usage_dir():
+    return os.path.join(conda_execute.config.env_dir, '.usage')
+
+
+def _usage_file(env_prefix):
+    name = os.path.relpath(env_prefix, conda_execute.config.env_dir)
+    if name.startswith(os.pardir):
+        # Environments in the shared stores are recorded as if in the local store.
+        name = os.path.relpath(conda_execute.catalog.env_path(os.path.basename(env_prefix)),
+                               conda_execute.config.env_dir)
+    return os.path.join(_usage_dir(), name + '.json')
+
+
+def read_usage(env_prefix):
+    try:
+        with open(_usage_file(env_prefix), 'r') as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def record_usage(env_prefix, spec, channels=()):
+    """
+    Increment the usage count of the environment, recording the spec and
+    channels needed to rebuild it.
+
+    """
+    usage = read_usage(env_prefix) or {'count': 0}
+    usage.update({'spec': list(spec), 'channels': list(channels),
+                  'count': usage['count'] + 1, 'last_used': time.time()})
+    try:
+        atomic_write(_usage_file(env_prefix), json.dumps(usage, sort_keys=True))
+    except (IOError, OSError) as exception:
+        log.debug('Unable to record usage of {}: {}'.format(env_prefix, exception))
+
+
+def ranked_envs():
+    """
+    Return a list of (env_prefix, usage) for every environment with a usage
+    record, the most frequently used first (most recently used breaking ties).
+
+    """
+    ranked = []
+    for name, _ in conda_execute.catalog.sharded_files(_usage_dir(), '.json'):
+        env_prefix = os.path.join(conda_execute.config.env_dir, name)
+        usage = read_usage(env_prefix)
+        if usage is not None:
+            ranked.append((env_prefix, usage))
+    ranked.sort(key=lambda item: (item[1].get('count', 0), item[1].get('last_used', 0)),
+                reverse=True)
+    return ranked
+
+
+def env_ranks():
+    """
+    A dictionary mapping environment prefix to popularity rank (1 being the
+    most used).
+
+    """
+    return dict((env_prefix, rank) for rank, (env_prefix, _) in enumerate(ranked_envs(), 1))
+
+
+def hot_envs(n=None):
+    """
+    The prefixes of the ``n`` (default ``keep-warm`` config) most used
+    environments, which should be kept warm.
+
+    """
+    if n is None:
+        n = conda_execute.config.keep_warm
+    if n <= 0:
+        return []
+    return [env_prefix for env_prefix, _ in ranked_envs()[:n]]
+
+
+def prune_usage(max_age=None):
+    """
+    Remove the usage records of the environments which no longer exist (nor
+    are archived), and haven't been used for max_age days (default
+    ``forget-usage-after`` config).
+
+    """
+    if max_age is None:
+        max_age = conda_execute.config.forget_usage_after
+    for name, path in conda_execute.catalog.sharded_files(_usage_dir(), '.json'):
+        env_prefix = os.path.join(conda_execute.config.env_dir, name)
+        if os.path.isdir(env_prefix) or conda_execute.archive.archive_path(env_prefix):
+            continue
+        usage = read_usage(env_prefix) or {}
+        if time.time() - usage.get('last_used', 0) > max_age * 24 * 60 * 60:
+            log.debug('Forgetting the usage of {}'.format(env_prefix))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def maintain_if_due():
+    """
+    Prune the usage records, and ensure the hot environments are built (see
+    :func:`ensure_warm_standby`), if that hasn't been done within the last
+    ``usage-interval`` seconds.
+
+    """
+    stamp = os.path.join(_usage_dir(), '.maintained')
+    try:
+        if time.time() - os.path.getmtime(stamp) < conda_execute.config.usage_interval:
+            return
+    except OSError:
+        pass
+    try:
+        atomic_write(stamp, '')
+    except (IOError, OSError) as exception:
+        log.debug('Unable to maintain the usage records: {}'.format(exception))
+        return
+    prune_usage()
+    ensure_warm_standby()
+
+
+def ensure_warm_standby():
+    """
+    Rebuild, in the background, any of the hot environments which have been
+    removed or damaged, so that the next caller needn't wait for them.
+
+    """
+    from conda_execute.tmpenv import env_is_being_created, env_is_complete, find_env
+
+    for env_prefix in hot_envs():
+        usage = read_usage(env_prefix)
+        # Legacy named environments are rebuilt under their current name.
+        env_prefix = find_env(usage['spec'], usage.get('channels', []))
+        if env_is_complete(env_prefix) or env_is_being_created(env_prefix):
+            continue
+        # The rebuild is made with this process' (e.g. an Executor's) env_dir and pkg_dir.
+        cmd = [sys.executable, '-m', 'conda_execute.tmpenv', 'create',
+               '--env-dir', conda_execute.config.env_dir,
+               '--pkg-dir', conda_execute.config.pkg_dir] + usage['spec']
+        for channel in usage.get('channels', []):
+            cmd.extend(['--channel', channel])
+        if os.path.exists(env_prefix):
+            cmd.append('--force')
+        log.info('Rebuilding hot environment {} in the background'.format(env_prefix))
+        with open(os.devnull, 'w') as devnull:
+            kwargs = {}
+            if os.name == 'posix':
+                kwargs['preexec_fn'] = os.setsid
+            subprocess.Popen(cmd, stdin=devnull, stdout=devnull, stderr=devnull,
+                             close_fds=True, **kwargs)
@@ -0,0 +1,24 @@
+import os
+import tempfile
+
+
+def atomic_write(path, data, mode='w'):
+    """
+    Write the data to the given path such that readers only ever see the old
+    or the new content in full. The parent directory is created if needed.
+
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, mode) as fh:
+            fh.write(data)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -1,9 +1,28 @@
 from setuptools import setup
 import os.path
+import sys
 
 import versioneer
 
 
+cmdclass = versioneer.get_cmdclass()
+
+if sys.version_info < (3, 5):
+    _build_py = cmdclass['build_py']
+
+    class build_py(_build_py):
+        """
+        Leave out the asyncio interface (conda_execute.aio), whose syntax is
+        that of Python 3.5+, so that it isn't byte-compiled by older Pythons.
+
+        """
+        def find_package_modules(self, package, package_dir):
+            modules = _build_py.find_package_modules(self, package, package_dir)
+            return [module for module in modules if module[:2] != ('conda_execute', 'aio')]
+
+    cmdclass['build_py'] = build_py
+
+
 setup(name='conda-execute',
       version=versioneer.get_version(),
       description='A tool for executing scripts in a consistent environment.',
@@ -17,6 +36,6 @@ setup(name='conda-execute',
               'conda-tmpenv = conda_execute.tmpenv:main',
           ]
       },
-      cmdclass=versioneer.get_cmdclass(),
+      cmdclass=cmdclass,
      )
 